@@ -0,0 +1,199 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import contextlib
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, Optional, Tuple
+from configs import load_config
+from instrumentation import Timer, log_event
+
+# Error codes that mean a call was rejected because of its request rate, rather than a resource limit
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException',
+                          'RequestLimitExceeded', 'SlowDown', 'RequestThrottled']
+
+class TokenBucket:
+    """Lets calls start at up to rate per second, with bursts of up to a second's worth of calls
+
+    The rate is adjusted additive increase, multiplicative decrease: it is cut by decrease_factor
+    on each throttle, down to min_rate, and grows back by a fraction of max_rate on each success.
+    """
+
+    def __init__(self, max_rate: float, min_rate: float, decrease_factor: float = 0.5, increase: float = 0.02) -> None:
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.decrease_factor = decrease_factor
+        self.increase = increase * max_rate
+        self.rate = max_rate
+        self.tokens = max(max_rate, 1)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, max(self.rate, 1))
+            self.updated = now
+            # Take the token now, so calls arriving meanwhile queue up behind this one
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0: time.sleep(wait)
+
+    def on_throttle(self) -> None:
+        with self.lock:
+            self.rate = max(self.rate * self.decrease_factor, self.min_rate)
+
+    def on_success(self) -> None:
+        with self.lock:
+            self.rate = min(self.rate + self.increase, self.max_rate)
+
+class OperationMetrics:
+    """Number of calls, attempts, errors and throttles, and the latency of the calls of one API operation"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.attempts = 0
+        self.errors = 0
+        self.throttles = 0
+        self.latency = Timer()
+        self.lock = threading.Lock()
+
+    def record_attempt(self, throttled: bool) -> None:
+        with self.lock:
+            self.attempts += 1
+            if throttled: self.throttles += 1
+
+    def record_call(self, secs: float, failed: bool) -> None:
+        with self.lock:
+            self.calls += 1
+            if failed: self.errors += 1
+            self.latency.add(secs)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            latency = self.latency.summary()
+            return {'calls': self.calls, 'attempts': self.attempts, 'errors': self.errors, 'throttles': self.throttles,
+                    'total_secs': latency["total_secs"], 'p50_ms': latency.get("p50_ms", 0), 'p90_ms': latency.get("p90_ms", 0),
+                    'p99_ms': latency.get("p99_ms", 0), 'max_ms': latency.get("max_ms", 0)}
+
+# Buckets and metrics are kept per process and shared by every client of a service, like the quotas they follow
+lock = threading.Lock()
+buckets: Dict[Tuple[str, str], TokenBucket] = {}
+metrics: Dict[Tuple[str, str], OperationMetrics] = defaultdict(OperationMetrics)
+sessions: Dict[Tuple[int, str], object] = {}
+clients: Dict[Tuple, object] = {}
+# Stand-ins returned instead of real clients by service name, see use_clients
+client_overrides: Dict[str, object] = {}
+
+def get_operation(event_name: str) -> Tuple[str, str]:
+    # Events are named <event>.<service id>.<operation>, e.g. before-send.iotsitewise.CreateAsset
+    _, service_id, operation = event_name.split('.', 2)
+    return service_id, operation
+
+def get_bucket(service_id: str, operation: str, config: Dict) -> TokenBucket:
+    # The rates come from the config of the first client calling the operation
+    with lock:
+        if (service_id, operation) not in buckets:
+            service_config = config["services"].get(service_id, {})
+            rate = (service_config.get("rates") or {}).get(operation, service_config.get("default_rate", config["default_rate"]))
+            buckets[(service_id, operation)] = TokenBucket(rate, config["min_rate"], config["decrease_factor"], config["increase"])
+        return buckets[(service_id, operation)]
+
+def get_metrics(service_id: str, operation: str) -> OperationMetrics:
+    with lock:
+        return metrics[(service_id, operation)]
+
+def is_throttled(parsed_response: Optional[Dict], response_dict: Optional[Dict]) -> bool:
+    if response_dict is not None and response_dict["status_code"] == 429: return True
+    return parsed_response is not None and parsed_response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+def before_send(event_name: str, clients_config: Dict, **kwargs) -> None:
+    # Sent once per attempt, so retries wait for a token as well
+    get_bucket(*get_operation(event_name), clients_config).acquire()
+
+def response_received(event_name: str, clients_config: Dict, parsed_response: Optional[Dict] = None, response_dict: Optional[Dict] = None,
+                      **kwargs) -> None:
+    throttled = is_throttled(parsed_response, response_dict)
+    bucket = get_bucket(*get_operation(event_name), clients_config)
+    if throttled: bucket.on_throttle()
+    elif response_dict is not None and response_dict["status_code"] < 400: bucket.on_success()
+    get_metrics(*get_operation(event_name)).record_attempt(throttled)
+
+def before_call(context: Dict, **kwargs) -> None:
+    context["call_start"] = time.perf_counter()
+
+def after_call(event_name: str, context: Dict, **kwargs) -> None:
+    # The latency of a call includes its retries and the time spent waiting for tokens
+    failed = event_name.startswith('after-call-error') or 'Error' in (kwargs.get("parsed") or {})
+    get_metrics(*get_operation(event_name)).record_call(time.perf_counter() - context.get("call_start", time.perf_counter()), failed)
+
+def get_session(profile_name: str):
+    # boto3 is only imported by processes that make calls, it takes longer to import than the rest of a script
+    import boto3
+    key = (os.getpid(), profile_name)
+    with lock:
+        if key not in sessions: sessions[key] = boto3.Session(profile_name=profile_name)
+        return sessions[key]
+
+def create_client(service: str, config: Dict, max_pool_connections: Optional[int] = None):
+    """Returns a new client whose calls are rate limited per operation, retried and measured
+
+    config holds the settings of aws_clients.yml. Failed attempts are retried up to max_attempts
+    times with exponential backoff and jitter.
+    """
+    from botocore.config import Config
+    client_config = Config(retries={'mode': 'standard', 'max_attempts': config["max_attempts"]},
+                           max_pool_connections=max_pool_connections or config["max_pool_connections"])
+    client = get_session(config["profile_name"]).client(service, config=client_config)
+    service_id = client.meta.service_model.service_id.hyphenize()
+    events = client.meta.events
+    events.register(f'before-send.{service_id}', functools.partial(before_send, clients_config=config))
+    events.register(f'response-received.{service_id}', functools.partial(response_received, clients_config=config))
+    events.register(f'before-call.{service_id}', before_call)
+    events.register(f'after-call.{service_id}', after_call)
+    events.register(f'after-call-error.{service_id}', after_call)
+    return client
+
+def get_client(service: str, max_pool_connections: Optional[int] = None, clients_config: Optional[Dict] = None):
+    """Returns the client of the service for this process, created on first use
+
+    Clients are thread safe but must not cross a fork, so each process creates its own. Threads
+    sharing a client should ask for a max_pool_connections of at least their number. Clients are
+    configured by clients_config, or by config/aws_clients.yml when it is not given.
+    """
+    if service in client_overrides: return client_overrides[service]
+    key = (os.getpid(), service, max_pool_connections, None if clients_config is None else id(clients_config))
+    with lock:
+        if key in clients: return clients[key]
+    # Created outside of the lock, which get_session takes as well
+    client = create_client(service, clients_config if clients_config is not None else load_config('aws_clients'), max_pool_connections)
+    with lock:
+        return clients.setdefault(key, client)
+
+@contextlib.contextmanager
+def use_clients(**overrides) -> Iterator[None]:
+    """Makes get_client return the given stand-ins by service name, e.g. use_clients(iotsitewise=StubSiteWiseClient())"""
+    saved = dict(client_overrides)
+    client_overrides.update(overrides)
+    try:
+        yield
+    finally:
+        client_overrides.clear()
+        client_overrides.update(saved)
+
+def get_metrics_summary() -> Dict[str, Dict]:
+    with lock:
+        items = sorted(metrics.items())
+    return {f'{service_id}.{operation}': operation_metrics.snapshot() for (service_id, operation), operation_metrics in items}
+
+def print_metrics() -> None:
+    summary = get_metrics_summary()
+    if len(summary) == 0: return
+    log_event('api_calls', operations=summary)
+    print('\nAPI calls:')
+    for operation, snapshot in summary.items():
+        print(f'\t{operation}: {snapshot["calls"]} calls, {snapshot["attempts"]} attempts, {snapshot["throttles"]} throttled, '
+              f'{snapshot["errors"]} failed, p50 {snapshot["p50_ms"]} ms, p99 {snapshot["p99_ms"]} ms, max {snapshot["max_ms"]} ms')
@@ -0,0 +1,194 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List
+import numpy as np
+from aws_clients import use_clients
+from configs import load_config
+from id_registry import IdRegistry
+from sitewise_stub import StubSiteWiseClient
+
+dir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.abspath(os.path.dirname(dir))
+benchmark_dir = f'{root_dir}/tmp/benchmarks'
+
+BENCHMARK_START_DATE = datetime.date(2022, 11, 1)
+BENCHMARK_BUCKET = 'benchmark-bucket'
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def timed(function: Callable, *args, **kwargs) -> float:
+    # The scripts print progress per file and per resource, which would dominate short runs
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args, **kwargs)
+    return time.perf_counter() - start_time
+
+def count_files(directory: str) -> Dict:
+    files = glob.glob(os.path.join(directory, '*'))
+    rows = 0
+    for file_path in files:
+        with open(file_path, 'rb') as f:
+            rows += sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 24), b''))
+    return {'files': len(files), 'rows': rows, 'bytes': sum(os.path.getsize(file_path) for file_path in files)}
+
+def benchmark_generate(property_counts: List[int], days: List[int], workers: int) -> List[Dict]:
+    import simulate_historical_data as simulation
+    # A config of its own, with synthetic properties, so the benchmark does not depend on what exists in SiteWise
+    data_simulation_config, bulk_import_config = load_config('data_simulation'), load_config('bulk_import')
+    results = []
+    for property_count in property_counts:
+        data_simulation_config["properties"] = [
+            {'name': f'property_{idx}', 'model': 'Benchmark', 'min': 0, 'max': 100} for idx in range(property_count)]
+        properties = [{'asset_id': f'benchmark-asset-{idx}', 'property_id': f'benchmark-property-{idx}',
+                       'model_name': 'Benchmark', 'property_name': f'property_{idx}'} for idx in range(property_count)]
+        for day_count in days:
+            data_simulation_config["date_range"] = {'from': str(BENCHMARK_START_DATE),
+                                     'to': str(BENCHMARK_START_DATE + datetime.timedelta(days=day_count - 1))}
+            with tempfile.TemporaryDirectory() as output_dir:
+                elapsed = timed(simulation.generate_historical_data, properties, data_simulation_config, bulk_import_config, seed=1, workers=workers,
+                                data_dir=output_dir)
+                output = count_files(output_dir)
+            results.append(dict(output, properties=property_count, days=day_count, workers=workers, secs=round(elapsed, 3),
+                                rows_per_sec=round(output["rows"] / elapsed), mb_per_sec=round(output["bytes"] / 1024 / 1024 / elapsed, 2)))
+            print(f'\tgenerate {property_count} properties x {day_count} days: {results[-1]["rows_per_sec"]} rows/s, {results[-1]["mb_per_sec"]} MB/s')
+    return results
+
+def benchmark_upload(file_count: int, file_mb: int, concurrencies: List[int], part_size_mb: int) -> List[Dict]:
+    try:
+        from moto import mock_aws
+    except ImportError:
+        print('\tSkipping the upload benchmark, it requires: pip install moto')
+        return []
+    import upload_to_s3 as upload
+    import boto3
+    data_config = dict(load_config('bulk_import')["data"], bucket=BENCHMARK_BUCKET)
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_dir = f'{work_dir}/data'
+        os.makedirs(data_dir)
+        for file_num in range(1, file_count + 1):
+            with open(f'{data_dir}/historical_data_{file_num}.csv', 'wb') as f:
+                f.write(np.random.default_rng(file_num).bytes(file_mb * 1024 * 1024))
+        for concurrency in concurrencies:
+            # A fresh local S3 stand-in and manifest per run, so every run uploads all files. The checkpoint
+            # store is left out, so the benchmark files are not recorded as uploaded in tmp/checkpoints.db
+            run_dir = tempfile.mkdtemp(dir=work_dir)
+            with mock_aws():
+                s3_client = boto3.client('s3', region_name='us-east-1')
+                s3_client.create_bucket(Bucket=BENCHMARK_BUCKET)
+                with use_clients(s3=s3_client):
+                    elapsed = timed(upload.upload_history_to_s3, concurrency, part_size_mb, data_config, data_dir, f'{run_dir}/upload_manifest.json',
+                                    f'{run_dir}/checkpoints.db')
+            total_mb = file_count * file_mb
+            results.append({'files': file_count, 'file_mb': file_mb, 'concurrency': concurrency, 'part_size_mb': part_size_mb,
+                            'secs': round(elapsed, 3), 'mb_per_sec': round(total_mb / elapsed, 2), 'files_per_sec': round(file_count / elapsed, 2)})
+            print(f'\tupload {file_count} x {file_mb} MB with concurrency {concurrency}: {results[-1]["mb_per_sec"]} MB/s')
+    return results
+
+def benchmark_create_asset_hierarchy(latencies: List[float], concurrency: int) -> List[Dict]:
+    import create_asset_hierarchy as hierarchy
+    id_registry = hierarchy.id_registry
+    results = []
+    try:
+        for latency in latencies:
+            for parallel in [False, True]:
+                stub = StubSiteWiseClient(latency=latency)
+                with tempfile.TemporaryDirectory() as work_dir, use_clients(iotsitewise=stub):
+                    hierarchy.id_registry = IdRegistry(f'{work_dir}/ids.db')
+                    elapsed = timed(hierarchy.start, parallel, concurrency)
+                    hierarchy.id_registry.close()
+                mode = 'parallel' if parallel else 'sequential'
+                results.append({'mode': mode, 'latency': latency, 'secs': round(elapsed, 3),
+                                'api_calls': sum(stub.calls.values()), 'calls': dict(stub.calls)})
+                print(f'\tcreate_asset_hierarchy {mode} at {latency * 1000:.0f} ms latency: {results[-1]["secs"]} secs, {results[-1]["api_calls"]} calls')
+    finally:
+        hierarchy.id_registry = id_registry
+    return results
+
+def benchmark_check_job_status(latencies: List[float], job_count: int, job_secs: float, max_active_jobs: int) -> List[Dict]:
+    import create_bulk_import_job as bulk_import
+    bulk_import_config = load_config('bulk_import')
+    results = []
+    for latency in latencies:
+        stub = StubSiteWiseClient(latency=latency, job_secs=job_secs, max_active_jobs=max_active_jobs)
+        job_manager = bulk_import.BulkImportJobManager(
+            bulk_import_config, max_active_jobs=max_active_jobs, submit_rate=1000, submit_concurrency=bulk_import_config["job"]["submit_concurrency"],
+            min_poll_secs=job_secs / 10, max_poll_secs=job_secs)
+        job_manager.queue_jobs([[f'benchmark/historical_data_{idx}.csv'] for idx in range(1, job_count + 1)])
+        # Waits on the jobs without check_job_status, which would mark the benchmark keys as imported in tmp/checkpoints.db
+        with use_clients(iotsitewise=stub):
+            elapsed = timed(job_manager.wait)
+        results.append({'jobs': job_count, 'job_secs': job_secs, 'max_active_jobs': max_active_jobs, 'latency': latency,
+                        'secs': round(elapsed, 3), 'api_calls': sum(stub.calls.values()), 'calls': dict(stub.calls)})
+        print(f'\tcheck_job_status for {job_count} jobs at {latency * 1000:.0f} ms latency: {results[-1]["secs"]} secs, {results[-1]["api_calls"]} calls')
+    return results
+
+def write_results(results: Dict, output_path: str = None) -> str:
+    if output_path is None:
+        output_path = f'{benchmark_dir}/benchmark_{results["commit"]}_{results["timestamp"].replace(":", "")}.json'
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    if not os.path.exists(output_dir): os.makedirs(output_dir)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return output_path
+
+def start(benchmarks: List[str], args: argparse.Namespace) -> None:
+    results = {
+        'commit': get_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'benchmarks': {}
+    }
+    if 'generate' in benchmarks:
+        print('Benchmarking data generation..')
+        results["benchmarks"]["generate"] = benchmark_generate(args.property_counts, args.days, args.workers)
+    if 'upload' in benchmarks:
+        print('Benchmarking uploads against a local S3 stand-in..')
+        results["benchmarks"]["upload"] = benchmark_upload(args.upload_files, args.upload_file_mb, args.upload_concurrency, args.part_size_mb)
+    if 'create_asset_hierarchy' in benchmarks:
+        print('Benchmarking asset hierarchy creation against a stubbed SiteWise client..')
+        results["benchmarks"]["create_asset_hierarchy"] = benchmark_create_asset_hierarchy(args.latency, args.concurrency)
+    if 'check_job_status' in benchmarks:
+        print('Benchmarking bulk import job tracking against a stubbed SiteWise client..')
+        results["benchmarks"]["check_job_status"] = benchmark_check_job_status(args.latency, args.jobs, args.job_secs, args.max_active_jobs)
+    print(f'Benchmark results written to {write_results(results, args.output)}')
+
+BENCHMARKS = ['generate', 'upload', 'create_asset_hierarchy', 'check_job_status']
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark data generation, uploads and SiteWise provisioning and job tracking')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='benchmarks to run, all by default')
+    parser.add_argument('--property-counts', type=int, nargs='+', default=[10, 100], help='numbers of properties to generate data for')
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 7], help='date range lengths in days to generate data for')
+    parser.add_argument('--workers', type=int, default=1, help='number of generator processes')
+    parser.add_argument('--upload-files', type=int, default=16, help='number of files to upload')
+    parser.add_argument('--upload-file-mb', type=int, default=8, help='size of each uploaded file in MB')
+    parser.add_argument('--upload-concurrency', type=int, nargs='+', default=[1, 4], help='numbers of files uploaded in parallel')
+    parser.add_argument('--part-size-mb', type=int, default=8, help='multipart upload chunk size in MB')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.0, 0.05], help='simulated SiteWise API latencies in seconds')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent SiteWise calls in parallel provisioning')
+    parser.add_argument('--jobs', type=int, default=20, help='number of bulk import jobs to track')
+    parser.add_argument('--job-secs', type=float, default=1.0, help='time each simulated bulk import job takes')
+    parser.add_argument('--max-active-jobs', type=int, default=10, help='simulated limit on concurrent bulk import jobs')
+    parser.add_argument('--output', help=f'results file, defaults to a new file under {benchmark_dir}')
+    args = parser.parse_args()
+    start(args.only, args)
+    print('Script execution successfully completed!!')
@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+class CheckpointStore:
+    """Progress of incremental data generation, upload and import per asset property
+
+    A file is recorded as open when it is started and as closed once all of its rows are
+    written, together with the first and last timestamp of each property in it. Only closed
+    files move a property's checkpoints forward, so an interrupted run resumes from the last
+    complete file. The database may be shared by several generator processes.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        db_dir = os.path.dirname(db_path)
+        if not os.path.exists(db_dir): os.makedirs(db_dir)
+        self.lock = threading.Lock()
+        # Generator processes write concurrently, so wait for their transactions instead of failing
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS files (file_name TEXT PRIMARY KEY, file_prefix TEXT NOT NULL, file_num INTEGER NOT NULL, '
+                              'closed INTEGER NOT NULL DEFAULT 0, uploaded INTEGER NOT NULL DEFAULT 0, imported INTEGER NOT NULL DEFAULT 0)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS segments (file_name TEXT, asset_id TEXT, property_id TEXT, first_timestamp INTEGER NOT NULL, '
+                              'last_timestamp INTEGER NOT NULL, PRIMARY KEY (file_name, asset_id, property_id))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS checkpoints (asset_id TEXT, property_id TEXT, generated_to INTEGER, uploaded_to INTEGER, '
+                              'PRIMARY KEY (asset_id, property_id))')
+        self.checkpoints: Dict[Tuple[str, str], Tuple[Optional[int], Optional[int]]] = {(row[0], row[1]): (row[2], row[3]) for row in self.conn.execute(
+            'SELECT asset_id, property_id, generated_to, uploaded_to FROM checkpoints')}
+
+    def get_generated_to(self, asset_id: str, property_id: str) -> Optional[int]:
+        # Last timestamp of the property written to a closed file
+        return self.checkpoints.get((asset_id, property_id), (None, None))[0]
+
+    def get_uploaded_to(self, asset_id: str, property_id: str) -> Optional[int]:
+        # Every timestamp of the property up to this one is in an uploaded file
+        return self.checkpoints.get((asset_id, property_id), (None, None))[1]
+
+    def get_last_file_num(self, file_prefix: str) -> int:
+        # Continue numbering after every file started so far, so no earlier file is overwritten
+        return self.conn.execute('SELECT COALESCE(MAX(file_num), 0) FROM files WHERE file_prefix = ?', (file_prefix,)).fetchone()[0]
+
+    def get_open_files(self) -> List[str]:
+        return [row[0] for row in self.conn.execute('SELECT file_name FROM files WHERE closed = 0')]
+
+    def is_imported(self, file_name: str) -> bool:
+        row = self.conn.execute('SELECT imported FROM files WHERE file_name = ?', (file_name,)).fetchone()
+        return row is not None and row[0] == 1
+
+    def file_opened(self, file_prefix: str, file_num: int, file_name: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO files (file_name, file_prefix, file_num) VALUES (?, ?, ?)', (file_name, file_prefix, file_num))
+
+    def file_closed(self, file_name: str, progress: Dict[Tuple[str, str], List[int]], uploaded: bool = False) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE files SET closed = 1, uploaded = ? WHERE file_name = ?', (int(uploaded), file_name))
+            self.conn.executemany('INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?)',
+                                  [(file_name, asset_id, property_id, first, last) for (asset_id, property_id), (first, last) in progress.items()])
+            self.conn.executemany('INSERT INTO checkpoints (asset_id, property_id, generated_to) VALUES (?, ?, ?) '
+                                  'ON CONFLICT (asset_id, property_id) DO UPDATE SET generated_to = MAX(COALESCE(generated_to, 0), excluded.generated_to)',
+                                  [(asset_id, property_id, last) for (asset_id, property_id), (_, last) in progress.items()])
+            if uploaded: self.update_uploaded_to(list(progress))
+            self.load_checkpoints(list(progress))
+
+    def remove_file(self, file_name: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM files WHERE file_name = ?', (file_name,))
+            self.conn.execute('DELETE FROM segments WHERE file_name = ?', (file_name,))
+
+    def mark_uploaded(self, file_name: str) -> None:
+        with self.lock, self.conn:
+            if self.conn.execute('UPDATE files SET uploaded = 1 WHERE file_name = ? AND closed = 1', (file_name,)).rowcount == 0: return
+            series = [(row[0], row[1]) for row in self.conn.execute('SELECT asset_id, property_id FROM segments WHERE file_name = ?', (file_name,))]
+            self.update_uploaded_to(series)
+            self.load_checkpoints(series)
+
+    def mark_imported(self, file_name: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE files SET imported = 1 WHERE file_name = ?', (file_name,))
+
+    def update_uploaded_to(self, series: List[Tuple[str, str]]) -> None:
+        # Uploads finish out of order, so a property is uploaded up to just before its first timestamp still waiting in a file
+        for asset_id, property_id in series:
+            self.conn.execute('UPDATE checkpoints SET uploaded_to = COALESCE((SELECT MIN(s.first_timestamp) - 1 FROM segments s JOIN files f USING (file_name) '
+                              'WHERE s.asset_id = ? AND s.property_id = ? AND f.uploaded = 0), generated_to) WHERE asset_id = ? AND property_id = ?',
+                              (asset_id, property_id, asset_id, property_id))
+
+    def load_checkpoints(self, series: List[Tuple[str, str]]) -> None:
+        for asset_id, property_id in series:
+            row = self.conn.execute('SELECT generated_to, uploaded_to FROM checkpoints WHERE asset_id = ? AND property_id = ?', (asset_id, property_id)).fetchone()
+            self.checkpoints[(asset_id, property_id)] = (row[0], row[1])
+
+    def close(self) -> None:
+        self.conn.close()
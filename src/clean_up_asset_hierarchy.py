@@ -1,115 +1,113 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import time
+import argparse
 import json
-import csv
-import yaml
 import os
-from typing import List, Dict
-import boto3
+import shutil
+from typing import List, Dict, Optional
 import glob
+from aws_clients import get_client, print_metrics
+from configs import load_config
+from id_registry import IdRegistry
+from instrumentation import finish_run, run_log_path, start_run
+from provisioning import TeardownEngine, wait_for
 
-PROFILE_NAME = 'default'
-boto3.setup_default_session(profile_name=PROFILE_NAME)
-client = boto3.client('iotsitewise')
 dir = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.abspath(os.path.dirname(dir))
-config_dir = f'{root_dir}/config'
 data_dir = f'{root_dir}/data'
 tmp_dir = f'{root_dir}/tmp'
 
-# Load assets_models_configuration
-with open(f'{config_dir}/assets_models.yml', 'r') as file:
-    assets_models_config = yaml.safe_load(file)
+# Ids of the models, assets and hierarchies created by create_asset_hierarchy, opened on first use
+id_registry: Optional[IdRegistry] = None
+
+def get_id_registry() -> IdRegistry:
+    global id_registry
+    if id_registry is None: id_registry = IdRegistry(f'{tmp_dir}/ids.db')
+    return id_registry
 
 def print_json(dict_obj: Dict) -> None:
     print(json.dumps(dict_obj, indent=2, default=str))
 
-def get_model_id_by_name(asset_model_name) -> str:
-    with open(f'{tmp_dir}/asset_models.csv', 'r') as f:
-        models = csv.DictReader(f)
-        for model in models:
-            # condition to match
-            if model['asset_model_name'] == asset_model_name:
-                return model['asset_model_id']
-
-def get_asset_id_by_name(asset_name) -> str:
-    with open(f'{tmp_dir}/assets.csv', 'r') as f:
-        assets = csv.DictReader(f)
-        for asset in assets:
-            # condition to match
-            if asset['asset_name'] == asset_name:
-                return asset['asset_id']
-
-def get_hierarchy_id(asset_model_name, child_asset_model_id) -> str:
-    with open(f'{tmp_dir}/hierarchies.csv', 'r') as f:
-        hierarchies = csv.DictReader(f)
-        for hierarchy in hierarchies:
-            # condition to match
-            if hierarchy['asset_model_name'] == asset_model_name and hierarchy['child_asset_model_id'] == child_asset_model_id: 
-                return hierarchy['hierarchy_id']
-
 def get_asset_model_status(asset_model_id: str) -> str:
-    response = client.describe_asset_model(
+    response = get_client('iotsitewise').describe_asset_model(
         assetModelId=asset_model_id
     )
     return response["assetModelStatus"]["state"]
 
+def is_deleted(describe: str, **kwargs) -> bool:
+    from botocore.exceptions import ClientError
+    try:
+        getattr(get_client('iotsitewise'), describe)(**kwargs)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == 'ResourceNotFoundException': return True
+        raise
+    return False
+
 def disassociate_assets(assets: List[Dict]) -> None:
+    client, id_registry = get_client('iotsitewise'), get_id_registry()
+    asset_model_names = {asset["name"]: asset["model"] for asset in assets}
     for asset in assets:
-        try:
-            asset_id = get_asset_id_by_name(asset["name"])
-        except FileNotFoundError:
+        asset_id = id_registry.get_asset_id(asset["name"])
+        if asset_id is None:
             print("\tAsset not found! proceeding..")
-            continue 
+            continue
         model_name = asset["model"]
         associated_assets = asset["associated_assets"]
         # Create associations
         if associated_assets is not None:
             for child_asset_name in associated_assets:
-                child_asset_model_name = [asset["model"] for asset in assets_models_config["assets"] if asset["name"] == child_asset_name][0]
-                child_asset_model_id = get_model_id_by_name(child_asset_model_name)
-                hierarchy_id = get_hierarchy_id(model_name, child_asset_model_id)
-                child_asset_id = get_asset_id_by_name(child_asset_name)
+                child_asset_model_id = id_registry.get_model_id(asset_model_names[child_asset_name])
+                hierarchy_id = id_registry.get_hierarchy_id(model_name, child_asset_model_id)
+                child_asset_id = id_registry.get_asset_id(child_asset_name)
                 client.disassociate_assets(assetId=asset_id, hierarchyId=hierarchy_id, childAssetId=child_asset_id)
 
 def delete_assets(assets: List[Dict]) -> None:
+    client, id_registry = get_client('iotsitewise'), get_id_registry()
+    asset_ids = []
     for asset in assets:
-        asset_name = asset["name"]
-        try:
-            asset_id = get_asset_id_by_name(asset["name"])
-        except FileNotFoundError:
+        asset_id = id_registry.get_asset_id(asset["name"])
+        if asset_id is None:
             print("\tAsset not found! proceeding..")
-            continue 
+            continue
         client.delete_asset(assetId=asset_id)
-    time.sleep(5)
+        asset_ids.append(asset_id)
+    # Models can only be updated and deleted once their assets are gone
+    for asset_id in asset_ids:
+        wait_for(lambda: is_deleted('describe_asset', assetId=asset_id))
 
 def remove_hierarchies(asset_models: List[Dict]) -> None:
+    client, id_registry = get_client('iotsitewise'), get_id_registry()
     for model in asset_models:
         model_name = model["name"]
-        model_id = get_model_id_by_name(model_name)
+        model_id = id_registry.get_model_id(model_name)
         client.update_asset_model(assetModelId=model_id, assetModelName=model_name)
-        while True:
-            model_status = get_asset_model_status(model_id)
-            if model_status == "ACTIVE": 
-                break
-            time.sleep(1)
+        wait_for(lambda: get_asset_model_status(model_id) == "ACTIVE")
 
 def delete_asset_models(asset_models: List[Dict]) -> None:
+    client, id_registry = get_client('iotsitewise'), get_id_registry()
     for model in asset_models:
         model_name = model["name"]
-        model_id = get_model_id_by_name(model_name)
+        model_id = id_registry.get_model_id(model_name)
         client.delete_asset_model(assetModelId=model_id)
-        time.sleep(5)
-
-def cleanup_filesystem():
-    data_files = glob.glob(os.path.join(data_dir, "*"))
-    for f in data_files: os.remove(f)
-    tmp_files = glob.glob(os.path.join(tmp_dir, "*"))
-    for f in tmp_files: os.remove(f)
-
-def delete_asset_hierarchy() -> None:
+        wait_for(lambda: is_deleted('describe_asset_model', assetModelId=model_id))
+
+def remove_path(path: str) -> None:
+    # Other scripts write directories here too, e.g. tmp/benchmarks and tmp/metadata_transfer
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+def cleanup_filesystem(remove_run_log: bool = False) -> None:
+    for path in glob.glob(os.path.join(data_dir, "*")): remove_path(path)
+    if id_registry is not None: id_registry.close()
+    for path in glob.glob(os.path.join(tmp_dir, "*")):
+        # The run log is kept, runs may still be appending to it
+        if not remove_run_log and os.path.abspath(path) == os.path.abspath(run_log_path): continue
+        remove_path(path)
+
+def delete_asset_hierarchy(assets_models_config: Dict) -> None:
     print('\nRemoving asset associations..')
     disassociate_assets(assets_models_config["assets"])
     print('All assets updated!')
@@ -123,12 +121,29 @@ def delete_asset_hierarchy() -> None:
     delete_asset_models(assets_models_config["asset_models"])
     print('All asset models deleted!')
 
-def start() -> None:
-    delete_asset_hierarchy() 
+def delete_asset_hierarchy_parallel(assets_models_config: Dict, concurrency: int) -> None:
+    engine = TeardownEngine(get_client('iotsitewise'), get_id_registry(), concurrency=concurrency)
+    engine.teardown(assets_models_config)
+
+def start(parallel: bool = False, concurrency: int = 8, remove_run_log: bool = False,
+          assets_models_config: Optional[Dict] = None) -> None:
+    if assets_models_config is None: assets_models_config = load_config('assets_models')
+    if parallel:
+        delete_asset_hierarchy_parallel(assets_models_config, concurrency)
+    else:
+        delete_asset_hierarchy(assets_models_config)
     print('Cleaning up the filesystem..')
-    cleanup_filesystem()
+    cleanup_filesystem(remove_run_log)
     print('Data and temporary files removed!')
 
 if __name__ == "__main__":
-    start()
+    parser = argparse.ArgumentParser(description='Delete the configured asset hierarchy and local data')
+    parser.add_argument('--parallel', action='store_true', help='delete concurrently, bottom-up, waiting on the actual deletion state')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent SiteWise calls in parallel mode')
+    parser.add_argument('--remove-run-log', action='store_true', help='also delete the run log in tmp/, which is kept by default')
+    args = parser.parse_args()
+    start_run('clean_up_asset_hierarchy', **vars(args))
+    start(args.parallel, args.concurrency, args.remove_run_log)
+    print_metrics()
+    finish_run()
     print('Script execution successfully completed!!')
\ No newline at end of file
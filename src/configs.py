@@ -0,0 +1,27 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import datetime
+import os
+import time
+from typing import Dict
+import yaml
+
+dir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.abspath(os.path.dirname(dir))
+config_dir = f'{root_dir}/config'
+
+def load_config(name: str) -> Dict:
+    """Returns the parsed config/<name>.yml, e.g. load_config('bulk_import')
+
+    Configs are read when a script starts rather than at import, and handed to the functions
+    that need them, so callers can run with configs of their own.
+    """
+    with open(f'{config_dir}/{name}.yml', 'r') as file:
+        return yaml.safe_load(file)
+
+def date_to_epoch(date: str) -> int:
+    # Dates of the configs and arguments, e.g. 2022-11-01, start at midnight local time. The simulator
+    # has always read them this way, so the scripts checking its output convert them the same way
+    utc_date = datetime.datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    return int(time.mktime(utc_date.timetuple()))
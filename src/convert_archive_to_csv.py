@@ -0,0 +1,63 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import glob
+import gzip
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from configs import load_config
+from output_writers import CsvFileWriter
+
+dir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.abspath(os.path.dirname(dir))
+data_dir = f'{root_dir}/data'
+archive_dir = f'{root_dir}/archive'
+
+# Number of archived rows converted at a time
+BATCH_ROWS = 100000
+
+def read_parquet_blocks(file_path: str, column_names: List[str]) -> Iterator[Dict]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(file_path).iter_batches(batch_size=BATCH_ROWS, columns=column_names):
+        block = {}
+        for name in column_names:
+            column = batch.column(name)
+            if pa.types.is_dictionary(column.type):
+                # Decode through the dictionary instead of converting every string
+                column = column.dictionary.to_numpy(zero_copy_only=False).astype(str)[column.indices.to_numpy(zero_copy_only=False)]
+            else:
+                column = column.to_numpy(zero_copy_only=False)
+            block[name] = column
+        yield block
+
+def read_csv_gz_blocks(file_path: str, column_names: List[str]) -> Iterator[Dict]:
+    with gzip.open(file_path, 'rt', encoding='UTF8', newline='') as f:
+        while True:
+            lines = [line for _, line in zip(range(BATCH_ROWS), f)]
+            if len(lines) == 0: break
+            # Values are passed through as text so the converted rows match the archived ones exactly
+            columns = np.array([line.rstrip('\r\n').split(',') for line in lines], dtype=str)
+            yield {name: columns[:, idx] for idx, name in enumerate(column_names)}
+
+def convert_archive_to_csv(archive_files: List[str], bulk_import_config: Dict) -> None:
+    if not os.path.exists(data_dir): os.makedirs(data_dir)
+    column_names = bulk_import_config["data"]["column_names"]
+    # Named apart from the historical_data files the simulator writes to data/, so neither overwrites the other
+    writer = CsvFileWriter(data_dir, bulk_import_config["job"]["rows_per_job"], 'archive_data', column_names)
+    for file_path in archive_files:
+        read_blocks = read_parquet_blocks if file_path.endswith('.parquet') else read_csv_gz_blocks
+        for block in read_blocks(file_path, column_names):
+            writer.write(block)
+    writer.close()
+
+def start(bulk_import_config: Optional[Dict] = None) -> None:
+    archive_files = sorted(glob.glob(os.path.join(archive_dir, "*.parquet")) + glob.glob(os.path.join(archive_dir, "*.csv.gz")))
+    print(f'Converting {len(archive_files)} archived files into import-ready CSV files..')
+    convert_archive_to_csv(archive_files, bulk_import_config if bulk_import_config is not None else load_config('bulk_import'))
+    print('Conversion complete!')
+
+if __name__ == "__main__":
+    start()
+    print('Script execution successfully completed!!')
@@ -0,0 +1,373 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import csv
+import glob
+import io
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from aws_clients import get_client
+from configs import load_config
+from id_registry import IdRegistry
+from instrumentation import add_progress, finish_run, progress, report, start_run, stats
+from output_writers import CsvFileWriter
+from signals import splitmix64
+from validate_data import get_words, split_fields, split_lines
+
+dir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.abspath(os.path.dirname(dir))
+data_dir = f'{root_dir}/data'
+tmp_dir = f'{root_dir}/tmp'
+export_dir = f'{root_dir}/historian'
+
+QUOTE, POINT, COLON, SPACE, PLUS, MINUS = b'"'[0], b'.'[0], b':'[0], b' '[0], b'+'[0], b'-'[0]
+DATE_TIME_SEPARATORS = [b'T'[0], b' '[0]]
+UTC = b'Z'[0]
+# Length of 2022-11-01T12:30:00, and the longest fraction and UTC offset that can follow it
+BASE_LENGTH = 19
+MAX_FRACTION_DIGITS = 9
+MAX_SUFFIX_LENGTH = 1 + MAX_FRACTION_DIGITS + 6
+
+def gather_fields(words: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # Copies the fields into fixed width byte strings, 8 bytes of all fields at a time, see validate_data.get_words
+    lengths = ends - starts
+    word_count = max(-(-int(lengths.max(initial=0)) // 8), 1)
+    matrix = np.zeros((len(starts), word_count), dtype='<u8')
+    last = len(words) - 1
+    for idx in range(word_count):
+        remaining = lengths - idx * 8
+        # Drop the bytes past the end of the field, the low bytes come first
+        shift = ((8 - np.clip(remaining, 1, 8)) * 8).astype(np.uint64)
+        matrix[:, idx] = np.where(remaining > 0, (words[np.minimum(starts + idx * 8, last)] << shift) >> shift, 0)
+    return matrix.view(f'S{word_count * 8}').ravel()
+
+def to_byte_strings(values: np.ndarray) -> np.ndarray:
+    if values.dtype.kind == 'S': return values
+    return np.char.encode(values.astype(str), 'UTF8')
+
+def find_unique(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the distinct values and the index of each value among them, like np.unique
+
+    Byte strings are told apart by a 64 bit hash of their words, which sorts much faster than the strings.
+    """
+    if values.dtype.kind != 'S': return np.unique(values, return_inverse=True)
+    width = values.dtype.itemsize
+    matrix = np.zeros((len(values), -(-width // 8) * 8), dtype=np.uint8)
+    if len(values) > 0: matrix[:, :width] = np.ascontiguousarray(values).view(np.uint8).reshape(len(values), width)
+    hashes = np.zeros(len(values), dtype=np.uint64)
+    for column in matrix.view('<u8').T:
+        hashes = splitmix64(0, hashes ^ column)
+    _, index, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    return values[index], inverse
+
+def parse_timestamps(values: np.ndarray, utc_offset_secs: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the epoch seconds, nanosecond offset and validity of ISO 8601 timestamps
+
+    Timestamps are read as a matrix of bytes, so every row is parsed by the same few array
+    operations: 2022-11-01T12:30:00 with a T or space separator, up to 9 fraction digits and
+    an optional Z or +hh:mm, -hh:mm or +hhmm UTC offset.
+    """
+    values = to_byte_strings(values)
+    rows, width = len(values), max(values.dtype.itemsize, 1)
+    padded = np.zeros((rows, max(width, BASE_LENGTH) + MAX_SUFFIX_LENGTH + 1), dtype=np.uint8)
+    if rows > 0: padded[:, :width] = np.ascontiguousarray(values).view(np.uint8).reshape(rows, width)
+    lengths = (padded != 0).sum(axis=1)
+    row_idx = np.arange(rows)
+
+    def at(positions) -> np.ndarray:
+        # Fixed positions are read as a column, positions past the fraction differ per row
+        return padded[:, positions] if isinstance(positions, int) else padded[row_idx, positions]
+
+    def number(*positions) -> Tuple[np.ndarray, np.ndarray]:
+        value, valid = np.zeros(rows, dtype=np.int64), np.ones(rows, dtype=bool)
+        for position in positions:
+            digit = at(position).astype(np.int64) - 48
+            valid &= (digit >= 0) & (digit <= 9)
+            value = value * 10 + digit
+        return value, valid
+
+    year, valid = number(0, 1, 2, 3)
+    fields = [number(5, 6), number(8, 9), number(11, 12), number(14, 15), number(17, 18)]
+    for _, field_valid in fields: valid &= field_valid
+    (month, _), (day, _), (hour, _), (minute, _), (second, _) = fields
+    valid &= (at(4) == MINUS) & (at(7) == MINUS) & np.isin(at(10), DATE_TIME_SEPARATORS) & (at(13) == COLON) & (at(16) == COLON)
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour < 24) & (minute < 60) & (second < 60)
+
+    # Fraction digits after the point, a tenth digit makes the timestamp invalid
+    has_fraction = at(BASE_LENGTH) == POINT
+    nanos, digits = np.zeros(rows, dtype=np.int64), np.zeros(rows, dtype=np.int64)
+    in_fraction = has_fraction.copy()
+    for pos in range(MAX_FRACTION_DIGITS + 1):
+        digit = at(BASE_LENGTH + 1 + pos).astype(np.int64) - 48
+        in_fraction &= (digit >= 0) & (digit <= 9)
+        if pos < MAX_FRACTION_DIGITS: nanos += np.where(in_fraction, digit * 10 ** (MAX_FRACTION_DIGITS - 1 - pos), 0)
+        digits += in_fraction
+    valid &= (digits <= MAX_FRACTION_DIGITS) & (~has_fraction | (digits > 0))
+
+    # Z, a UTC offset or nothing after the seconds and fraction
+    end = BASE_LENGTH + has_fraction * (1 + digits)
+    suffix = at(end)
+    is_utc, has_offset = suffix == UTC, (suffix == PLUS) | (suffix == MINUS)
+    offset_hours, hours_valid = number(end + 1, end + 2)
+    has_colon = at(end + 3) == COLON
+    offset_minutes, minutes_valid = number(end + 3 + has_colon, end + 4 + has_colon)
+    valid &= ~has_offset | (hours_valid & minutes_valid & (offset_hours < 24) & (offset_minutes < 60))
+    offset_secs = np.where(has_offset, np.where(suffix == MINUS, -1, 1) * (offset_hours * 3600 + offset_minutes * 60), np.where(is_utc, 0, utc_offset_secs))
+    valid &= lengths == end + np.where(has_offset, 5 + has_colon, is_utc)
+
+    # Days since the epoch from the calendar date, invalid dates such as 2022-02-30 roll over into the next month
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0)
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + np.where(valid, day - 1, 0)
+    valid &= days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) == months
+    seconds = days * 86400 + hour * 3600 + minute * 60 + second - offset_secs
+    return np.where(valid, seconds, 0), np.where(valid, nanos, 0), valid
+
+def get_column_indices(header: Optional[List[str]], input_config: Dict) -> Dict[str, int]:
+    columns = {key: name for key, name in input_config["columns"].items() if name is not None}
+    if header is None: return {key: int(name) for key, name in columns.items()}
+    missing = [name for name in columns.values() if name not in header]
+    if len(missing) > 0: raise ValueError(f'Columns {missing} not found in the export header {header}')
+    return {key: header.index(name) for key, name in columns.items()}
+
+def read_csv_chunks(file_path: str, chunk_bytes: int, input_config: Dict) -> Iterator[Tuple[Dict, int]]:
+    """Reads a csv export chunk_bytes at a time, cut at line ends, and yields its columns as byte strings
+
+    Fields are split without decoding the text. Chunks with quoted fields go through the csv module instead,
+    a quoted field spanning lines across a chunk boundary is not supported.
+    """
+    separator = input_config["separator"].encode('UTF8')
+    with open(file_path, 'rb') as f:
+        header = None
+        if input_config["has_header"]:
+            header_line = f.readline()
+            header = next(csv.reader([header_line.decode('utf-8-sig')], delimiter=input_config["separator"]))
+        indices = get_column_indices(header, input_config)
+        column_count = len(header) if header is not None else None
+        remainder = b''
+        while True:
+            with stats.timer('read_chunk'):
+                data = f.read(chunk_bytes)
+            at_end = len(data) < chunk_bytes
+            data = remainder + data
+            cut = len(data) if at_end else data.rfind(b'\n') + 1
+            remainder = data[cut:]
+            if cut > 0:
+                if column_count is None: column_count = data[:data.find(b'\n') if b'\n' in data else cut].count(separator) + 1
+                with stats.timer('split_chunk'):
+                    chunk = split_csv_chunk(data[:cut], indices, column_count, separator)
+                yield chunk, cut
+            if at_end: break
+
+def split_csv_chunk(data: bytes, indices: Dict[str, int], column_count: int, separator: bytes) -> Dict:
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if np.any(buffer == QUOTE):
+        rows = [row for row in csv.reader(io.StringIO(data.decode('UTF8', errors='replace')), delimiter=separator.decode('UTF8')) if len(row) > 0]
+        valid = np.array([len(row) == column_count for row in rows], dtype=bool)
+        chunk = {key: to_byte_strings(np.array([row[idx] for row, is_valid in zip(rows, valid) if is_valid], dtype=str)) for key, idx in indices.items()}
+        return dict(chunk, column_count_errors=int((~valid).sum()))
+    starts, ends = split_lines(buffer)
+    not_empty = ends > starts
+    valid, field_starts, field_ends = split_fields(buffer, starts[not_empty], ends[not_empty], column_count, separator[0])
+    words = get_words(buffer)
+    chunk = {key: gather_fields(words, field_starts[:, idx], field_ends[:, idx]) for key, idx in indices.items()}
+    return dict(chunk, column_count_errors=int((~valid).sum()))
+
+def read_parquet_chunks(file_path: str, chunk_rows: int, input_config: Dict) -> Iterator[Tuple[Dict, int]]:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Reading parquet exports requires pyarrow, install it with: pip install pyarrow')
+    columns = {key: name for key, name in input_config["columns"].items() if name is not None}
+    parquet_file = pq.ParquetFile(file_path)
+    file_bytes, file_rows = os.path.getsize(file_path), max(parquet_file.metadata.num_rows, 1)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=list(columns.values())):
+        chunk = {'column_count_errors': 0}
+        for key, name in columns.items():
+            column = batch.column(name)
+            if pa.types.is_dictionary(column.type):
+                # Decode through the dictionary instead of converting every string
+                values = column.dictionary.to_numpy(zero_copy_only=False).astype(str)[column.indices.fill_null(0).to_numpy(zero_copy_only=False)]
+            elif pa.types.is_timestamp(column.type):
+                # Timestamps with a time zone are stored in UTC, naive ones are in utc_offset_minutes
+                offset_ns = 0 if column.type.tz is not None else input_config["utc_offset_minutes"] * 60 * 10 ** 9
+                values = column.cast(pa.timestamp('ns', column.type.tz)).to_numpy(zero_copy_only=False).astype('datetime64[ns]').astype(np.int64) - offset_ns
+            else:
+                values = column.to_numpy(zero_copy_only=False)
+            chunk[key] = values
+            if column.null_count > 0: chunk[f'{key}_null'] = column.is_null().to_numpy(zero_copy_only=False)
+        yield chunk, round(file_bytes * batch.num_rows / file_rows)
+
+class ExportConverter:
+    """Turns chunks of historian export columns into blocks of import-ready rows
+
+    Tags and qualities repeat across rows, so only their distinct values are looked up. Rows of
+    unmapped tags, with invalid timestamps or without a value are dropped and counted.
+    """
+
+    def __init__(self, tag_mapping: Dict[str, Tuple[str, str, str]], quality_map: Dict[str, str], default_quality: str, utc_offset_secs: int) -> None:
+        self.tag_mapping = tag_mapping
+        self.quality_map = {str(quality): mapped for quality, mapped in quality_map.items()}
+        self.default_quality = default_quality
+        self.utc_offset_secs = utc_offset_secs
+        self.rows = 0
+        self.dropped = Counter()
+        self.unmapped_tags = Counter()
+
+    def map_tags(self, tags: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        unique, inverse = find_unique(tags)
+        names = [tag.decode('UTF8', errors='replace') if isinstance(tag, bytes) else str(tag) for tag in unique]
+        resolved = [self.tag_mapping.get(name) for name in names]
+        for name, count in zip(names, np.bincount(inverse, minlength=len(unique))):
+            if self.tag_mapping.get(name) is None: self.unmapped_tags[name] += int(count)
+        mapped = np.array([entry is not None for entry in resolved], dtype=bool)[inverse]
+        asset_ids, property_ids, data_types = (np.array([entry[idx] if entry is not None else '' for entry in resolved])[inverse] for idx in range(3))
+        return mapped, asset_ids, property_ids, data_types
+
+    def map_qualities(self, qualities: Optional[np.ndarray], rows: int) -> np.ndarray:
+        if qualities is None: return np.full(rows, 'GOOD')
+        unique, inverse = find_unique(qualities)
+        names = [quality.decode('UTF8', errors='replace').strip() if isinstance(quality, bytes) else str(quality) for quality in unique]
+        return np.array([self.quality_map.get(name, self.default_quality) for name in names])[inverse]
+
+    def get_timestamps(self, timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if timestamps.dtype.kind in 'iu':
+            # Nanoseconds since the epoch, read from typed timestamp columns
+            seconds, nanos = np.divmod(timestamps.astype(np.int64), 10 ** 9)
+            return seconds, nanos, np.ones(len(timestamps), dtype=bool)
+        return parse_timestamps(timestamps, self.utc_offset_secs)
+
+    def get_values(self, values: np.ndarray, missing: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        if values.dtype.kind == 'f':
+            # Shortest text that reads back as the same double
+            has_value = np.isfinite(values)
+            values = values.astype(str)
+        elif values.dtype.kind == 'S':
+            has_value = np.char.str_len(values) > 0
+            # Text is passed through, and only decoded when it is not plain ASCII
+            if values.size > 0 and np.frombuffer(values.tobytes(), dtype=np.uint8).max() >= 128: values = np.char.decode(values, 'UTF8')
+        else:
+            values = values.astype(str)
+            has_value = np.char.str_len(values) > 0
+        if missing is not None: has_value &= ~missing
+        return values, has_value
+
+    def convert(self, chunk: Dict) -> Dict:
+        """Returns the rows of a chunk to import as a block of columns, see output_writers"""
+        self.dropped["column_count"] += chunk["column_count_errors"]
+        mapped, asset_ids, property_ids, data_types = self.map_tags(chunk["tag"])
+        if chunk.get("tag_null") is not None: mapped &= ~chunk["tag_null"]
+        seconds, nanos, valid_timestamps = self.get_timestamps(chunk["timestamp"])
+        if chunk.get("timestamp_null") is not None: valid_timestamps &= ~chunk["timestamp_null"]
+        values, has_value = self.get_values(chunk["value"], chunk.get("value_null"))
+        qualities = self.map_qualities(chunk.get("quality"), len(mapped))
+        self.dropped["unmapped_tag"] += int((~mapped).sum())
+        self.dropped["timestamp"] += int((mapped & ~valid_timestamps).sum())
+        self.dropped["value"] += int((mapped & valid_timestamps & ~has_value).sum())
+        keep = mapped & valid_timestamps & has_value
+        self.rows += int(keep.sum())
+        return {'ASSET_ID': asset_ids[keep], 'PROPERTY_ID': property_ids[keep], 'DATA_TYPE': data_types[keep], 'TIMESTAMP_SECONDS': seconds[keep],
+                'TIMESTAMP_NANO_OFFSET': nanos[keep], 'QUALITY': qualities[keep], 'VALUE': values[keep]}
+
+def load_mapping_entries(export_config: Dict) -> List[Dict]:
+    entries = list(export_config.get("tags") or [])
+    if export_config.get("mapping_file"):
+        mapping_path = os.path.join(root_dir, export_config["mapping_file"])
+        with open(mapping_path, 'r', encoding='utf-8-sig', newline='') as f:
+            entries.extend({key: value for key, value in row.items() if value} for row in csv.DictReader(f))
+    return entries
+
+def load_tag_mapping(id_registry: IdRegistry, export_config: Dict, client=None) -> Dict[str, Tuple[str, str, str]]:
+    """Resolves the configured tags once into tag -> (asset id, property id, data type)
+
+    Asset names are looked up in the id registry. Properties given by name are looked up with
+    one DescribeAsset call per asset, entries with a property id and data type need no calls.
+    """
+    asset_properties: Dict[str, Dict[str, Tuple[str, str]]] = {}
+    tag_mapping, errors = {}, []
+    for entry in load_mapping_entries(export_config):
+        asset_id = entry.get("asset_id") or id_registry.get_asset_id(entry.get("asset"))
+        if asset_id is None:
+            errors.append(f'{entry["tag"]}: asset {entry.get("asset")} not found, run create_asset_hierarchy.py first')
+            continue
+        if entry.get("property_id") and entry.get("data_type"):
+            tag_mapping[entry["tag"]] = (asset_id, entry["property_id"], entry["data_type"])
+            continue
+        if asset_id not in asset_properties:
+            if client is None: client = get_client('iotsitewise')
+            response = client.describe_asset(assetId=asset_id)
+            asset_properties[asset_id] = {property["name"]: (property["id"], property["dataType"]) for property in response["assetProperties"]}
+            asset_properties[asset_id].update({property_id: (property_id, data_type) for property_id, data_type in asset_properties[asset_id].values()})
+        resolved = asset_properties[asset_id].get(entry.get("property_id") or entry.get("property"))
+        if resolved is None:
+            errors.append(f'{entry["tag"]}: property {entry.get("property_id") or entry.get("property")} not found on asset {asset_id}')
+            continue
+        tag_mapping[entry["tag"]] = (asset_id, resolved[0], entry.get("data_type") or resolved[1])
+    if len(errors) > 0:
+        raise ValueError(f'{len(errors)} tags could not be mapped to asset properties:\n\t' + '\n\t'.join(errors[:20]))
+    return tag_mapping
+
+def convert_exports(export_files: List[str], tag_mapping: Dict[str, Tuple[str, str, str]], export_config: Dict, bulk_import_config: Dict,
+                    chunk_mb: Optional[int] = None) -> ExportConverter:
+    if not os.path.exists(data_dir): os.makedirs(data_dir)
+    input_config = export_config["input"]
+    chunk_mb = chunk_mb or input_config["chunk_mb"]
+    converter = ExportConverter(tag_mapping, export_config["quality_map"] or {}, export_config["default_quality"], input_config["utc_offset_minutes"] * 60)
+    writer = CsvFileWriter(data_dir, bulk_import_config["job"]["rows_per_job"], export_config["file_prefix"], bulk_import_config["data"]["column_names"])
+    with progress('Converting', sum(os.path.getsize(file_path) for file_path in export_files), 'bytes'):
+        for file_path in export_files:
+            chunks = read_parquet_chunks(file_path, input_config["chunk_rows"], input_config) if file_path.endswith('.parquet') \
+                else read_csv_chunks(file_path, chunk_mb * 1024 * 1024, input_config)
+            for chunk, chunk_bytes in chunks:
+                with stats.timer('convert_chunk'):
+                    block = converter.convert(chunk)
+                with stats.timer('write_block'):
+                    writer.write(block)
+                stats.count('rows', len(block["TIMESTAMP_SECONDS"]))
+                add_progress(chunk_bytes)
+                if export_config["unmapped_tags"] == 'error' and len(converter.unmapped_tags) > 0:
+                    raise ValueError(f'Tags missing from the mapping in {file_path}: {list(converter.unmapped_tags)[:20]}')
+    writer.close()
+    return converter
+
+def print_summary(converter: ExportConverter, elapsed: float, total_bytes: int) -> None:
+    print(f'\tConverted {converter.rows} rows ({total_bytes / 1024 / 1024:.1f} MB of exports) in {elapsed:.1f} secs: '
+          f'{converter.rows / max(elapsed, 1e-6):.0f} rows/s, {total_bytes / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s')
+    for reason, count in sorted(converter.dropped.items()):
+        if count > 0: print(f'\tDropped {count} rows: {reason}')
+    for tag, count in converter.unmapped_tags.most_common(10):
+        print(f'\t\tunmapped tag {tag}: {count} rows')
+
+def start(input_dir: str = export_dir, chunk_mb: Optional[int] = None, export_config: Optional[Dict] = None,
+          bulk_import_config: Optional[Dict] = None) -> None:
+    export_files = sorted(glob.glob(os.path.join(input_dir, '*.csv')) + glob.glob(os.path.join(input_dir, '*.parquet')))
+    if len(export_files) == 0:
+        print(f'No historian exports found in {input_dir}!')
+        return
+    if export_config is None: export_config = load_config('historian_export')
+    if bulk_import_config is None: bulk_import_config = load_config('bulk_import')
+    id_registry = IdRegistry(f'{tmp_dir}/ids.db')
+    try:
+        tag_mapping = load_tag_mapping(id_registry, export_config)
+    finally:
+        id_registry.close()
+    print(f'Converting {len(export_files)} historian exports of {len(tag_mapping)} mapped tags into import-ready CSV files..')
+    start_time = time.perf_counter()
+    converter = convert_exports(export_files, tag_mapping, export_config, bulk_import_config, chunk_mb)
+    print_summary(converter, time.perf_counter() - start_time, sum(os.path.getsize(file_path) for file_path in export_files))
+    report('Conversion complete!', 'export_converted', rows=converter.rows, dropped=dict(converter.dropped),
+           unmapped_tags=dict(converter.unmapped_tags.most_common(100)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert historian exports keyed by tag name into import-ready CSV files')
+    parser.add_argument('--input-dir', default=export_dir, help='directory of the .csv and .parquet exports to convert')
+    parser.add_argument('--chunk-mb', type=int, help='size of the csv chunks read at a time, chunk_mb in historian_export.yml by default')
+    args = parser.parse_args()
+    start_run('convert_historian_export', **vars(args))
+    start(args.input_dir, args.chunk_mb)
+    finish_run()
+    print('Script execution successfully completed!!')
@@ -1,94 +1,56 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import time
+import argparse
 import json
-import csv
 import os
-from typing import List, Dict
-import boto3
-import yaml
+from typing import List, Dict, Optional
+from aws_clients import get_client, print_metrics
+from configs import load_config
+from id_registry import IdRegistry
+from instrumentation import finish_run, report, start_run
+from metadata_transfer import MetadataTransferEngine, build_transfer_documents, write_documents
+from provisioning import ProvisioningEngine, load_properties_schema, wait_for
 
-#PROFILE_NAME = 'default'
-#boto3.setup_default_session(profile_name=PROFILE_NAME)
-
-client = boto3.client('iotsitewise')
 dir = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.abspath(os.path.dirname(dir))
-config_dir = f'{root_dir}/config'
 schema_dir = f'{root_dir}/schema'
 tmp_dir = f'{root_dir}/tmp'
 
-# Create tmp directory if doesn't exist
-if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
+# Ids of the created models, assets and hierarchies, opened on first use
+id_registry: Optional[IdRegistry] = None
 
-# Load assets_models_configuration
-with open(f'{config_dir}/assets_models.yml', 'r') as file:
-    assets_models_config = yaml.safe_load(file)
+def get_id_registry() -> IdRegistry:
+    global id_registry
+    if id_registry is None: id_registry = IdRegistry(f'{tmp_dir}/ids.db')
+    return id_registry
 
 def print_json(dict_obj: Dict) -> None:
     print(json.dumps(dict_obj, indent=2, default=str))
 
-def get_model_id_by_name(asset_model_name: str) -> str:
-    with open(f'{tmp_dir}/asset_models.csv', 'r') as f:
-        models = csv.DictReader(f)
-        for model in models:
-            # condition to match
-            if model['asset_model_name'] == asset_model_name:
-                return model['asset_model_id']
-
-def get_asset_id_by_name(asset_name: str) -> str:
-    with open(f'{tmp_dir}/assets.csv', 'r') as f:
-        assets = csv.DictReader(f)
-        for asset in assets:
-            # condition to match
-            if asset['asset_name'] == asset_name:
-                return asset['asset_id']
-
-def get_hierarchy_id(asset_model_name: str, child_asset_model_id: str) -> str:
-    with open(f'{tmp_dir}/hierarchies.csv', 'r') as f:
-        hierarchies = csv.DictReader(f)
-        for hierarchy in hierarchies:
-            # condition to match
-            if hierarchy['asset_model_name'] == asset_model_name and hierarchy['child_asset_model_id'] == child_asset_model_id: 
-                return hierarchy['hierarchy_id']
-            
 def create_asset_model(model: Dict) -> str:
     model_name = model["name"]
-    properties_schema = []
-    # file name -> sample_stamping_press_properties.json for the model: Sample_Stamping Press
-    properties_schema_file_name = '_'.join(model_name.lower().split())+"_properties.json"
-    properties_schema_file_path = f'{schema_dir}/{properties_schema_file_name}'
-    # Load schema if existing
-    if os.path.exists(properties_schema_file_path):
-        with open(properties_schema_file_path, 'r') as file:
-            properties_schema = json.load(file)
-    response = client.create_asset_model(
+    properties_schema = load_properties_schema(schema_dir, model_name)
+    response = get_client('iotsitewise').create_asset_model(
         assetModelName= model_name,
         assetModelProperties = properties_schema
     )
     asset_model_id = response["assetModelId"]
-    print(f"\tCreated name: {model_name}, id: {asset_model_id}")
+    report(f"\tCreated name: {model_name}, id: {asset_model_id}", 'model_created', name=model_name, id=asset_model_id)
     return asset_model_id
 
 def update_asset_model(model: Dict) -> None:
+    id_registry = get_id_registry()
     model_name = model["name"]
-    model_id = get_model_id_by_name(model_name)
+    model_id = id_registry.get_model_id(model_name)
     #child_model_name = model["child"]
     child_model_names = model["children"]
     model_hierarchies = []
-    properties_schema = []
-    # file name -> stamping_press_properties.json for the model: Stamping Press
-    properties_schema_file_name = '_'.join(model_name.lower().split())+"_properties.json"
-    properties_schema_file_path = f'{schema_dir}/{properties_schema_file_name}'
-    # Load schema if existing
-    if os.path.exists(properties_schema_file_path):
-        with open(properties_schema_file_path, 'r') as file:
-            properties_schema = json.load(file)
+    properties_schema = load_properties_schema(schema_dir, model_name)
     # Prepare model hierarchy
     if child_model_names is not None:
         for child_model_name in child_model_names:
-            child_model_id = get_model_id_by_name(child_model_name)
+            child_model_id = id_registry.get_model_id(child_model_name)
             model_hierarchies.append({'name':child_model_name,'childAssetModelId':child_model_id})
     
     transformed_properties_schema = []
@@ -101,7 +63,7 @@ def update_asset_model(model: Dict) -> None:
         transformed_properties_schema.append(transformed_property)
     
     # Update model
-    client.update_asset_model(
+    get_client('iotsitewise').update_asset_model(
         assetModelId=model_id,
         assetModelName=model_name,
         assetModelProperties=transformed_properties_schema,
@@ -109,109 +71,89 @@ def update_asset_model(model: Dict) -> None:
     )
 
 def get_asset_model_status(asset_model_id: str) -> str:
-    response = client.describe_asset_model(
+    response = get_client('iotsitewise').describe_asset_model(
         assetModelId=asset_model_id
     )
     return response["assetModelStatus"]["state"]
 
 def create_asset_models(asset_models: List[Dict]) -> None:
-    f = open(f'{tmp_dir}/asset_models.csv', 'w')
-    writer = csv.writer(f)
-    writer.writerow(['asset_model_name', 'asset_model_id'])
+    id_registry = get_id_registry()
     for model in asset_models:
         model_name = model["name"]
         asset_model_id = create_asset_model(model)
         # Wait for asset to become ACTIVE
-        while True:
-            model_status = get_asset_model_status(asset_model_id)
-            if model_status == "ACTIVE":
-                print(f"\t\tstatus: {model_status}")
-                break
-            time.sleep(1)
+        wait_for(lambda: get_asset_model_status(asset_model_id) == "ACTIVE")
+        print("\t\tstatus: ACTIVE")
         # Store the asset model id for reference
-        writer.writerow([model_name, asset_model_id])
-    f.close()
+        id_registry.set_model_id(model_name, asset_model_id)
 
 def get_asset_model_hierarchies(model_id: str) -> List[Dict]:
-    response = client.describe_asset_model(
+    response = get_client('iotsitewise').describe_asset_model(
     assetModelId=model_id,
     excludeProperties=True
     )
     return response["assetModelHierarchies"]
 
 def update_asset_models(asset_models: List[Dict]) -> None:
-    f = open(f'{tmp_dir}/hierarchies.csv', 'w')
-    writer = csv.writer(f)
-    writer.writerow(['asset_model_name', 'child_asset_model_id', 'hierarchy_id'])
+    id_registry = get_id_registry()
     for model in asset_models:
         model_name = model["name"]
-        model_id = get_model_id_by_name(model_name)
+        model_id = id_registry.get_model_id(model_name)
         # Update model with hierarchy
         update_asset_model(model)
         # Wait for asset to become ACTIVE
-        while True:
-            model_status = get_asset_model_status(model_id)
-            if model_status == "ACTIVE": 
-                # Get hierarchies
-                hierarchies = get_asset_model_hierarchies(model_id)
-                for hierarchy in hierarchies:
-                    # Store hierarchy ids for reference
-                    writer.writerow([model_name, hierarchy["childAssetModelId"], hierarchy["id"]])
-                break
-            time.sleep(1)
-    f.close()
+        wait_for(lambda: get_asset_model_status(model_id) == "ACTIVE")
+        # Get hierarchies
+        hierarchies = get_asset_model_hierarchies(model_id)
+        for hierarchy in hierarchies:
+            # Store hierarchy ids for reference
+            id_registry.set_hierarchy_id(model_name, hierarchy["childAssetModelId"], hierarchy["id"])
 
 def create_assets(assets: List[Dict]) -> None:
-    f = open(f'{tmp_dir}/assets.csv', 'w')
-    writer = csv.writer(f)
-    writer.writerow(['asset_name', 'asset_id'])
+    id_registry = get_id_registry()
     for asset in assets:
         asset_name = asset["name"]
         asset_id = create_asset(asset)
         # Wait for asset to become ACTIVE
-        while True:
-            asset_status = get_asset_status(asset_id)
-            if asset_status == "ACTIVE":
-                print(f"\t\tstatus: {asset_status}")
-                break
-            time.sleep(1)
-        # Store the asset model id for reference
-        writer.writerow([asset_name, asset_id])
-    f.close()
+        wait_for(lambda: get_asset_status(asset_id) == "ACTIVE")
+        print("\t\tstatus: ACTIVE")
+        # Store the asset id for reference
+        id_registry.set_asset_id(asset_name, asset_id)
 
 def create_asset(asset: Dict) -> str:
     asset_name = asset["name"]
     model_name = asset["model"]
-    model_id = get_model_id_by_name(model_name)
-    response = client.create_asset(
+    model_id = get_id_registry().get_model_id(model_name)
+    response = get_client('iotsitewise').create_asset(
     assetName=asset_name,
     assetModelId=model_id,
     )
     asset_id = response["assetId"]
-    print(f"\tCreated name: {asset_name}, id: {asset_id}")
+    report(f"\tCreated name: {asset_name}, id: {asset_id}", 'asset_created', name=asset_name, id=asset_id)
     return asset_id
 
 def get_asset_status(asset_id: str) -> str:
-    response = client.describe_asset(
+    response = get_client('iotsitewise').describe_asset(
         assetId=asset_id
     )
     return response["assetStatus"]["state"]
 
 def associate_assets(assets: List[Dict]) -> None:
+    client, id_registry = get_client('iotsitewise'), get_id_registry()
+    asset_model_names = {asset["name"]: asset["model"] for asset in assets}
     for asset in assets:
-        asset_id = get_asset_id_by_name(asset["name"])
+        asset_id = id_registry.get_asset_id(asset["name"])
         model_name = asset["model"]
         associated_assets = asset["associated_assets"]
         # Create associations
         if associated_assets is not None:
             for child_asset_name in associated_assets:
-                child_asset_model_name = [asset["model"] for asset in assets_models_config["assets"] if asset["name"] == child_asset_name][0]
-                child_asset_model_id = get_model_id_by_name(child_asset_model_name)
-                hierarchy_id = get_hierarchy_id(model_name, child_asset_model_id)
-                child_asset_id = get_asset_id_by_name(child_asset_name)
+                child_asset_model_id = id_registry.get_model_id(asset_model_names[child_asset_name])
+                hierarchy_id = id_registry.get_hierarchy_id(model_name, child_asset_model_id)
+                child_asset_id = id_registry.get_asset_id(child_asset_name)
                 client.associate_assets(assetId=asset_id, hierarchyId=hierarchy_id, childAssetId=child_asset_id)
 
-def create_asset_hierarchy() -> None:
+def create_asset_hierarchy(assets_models_config: Dict) -> None:
     print('Creating asset models..')
     create_asset_models(assets_models_config["asset_models"])
     print('All asset models created!')
@@ -225,9 +167,41 @@ def create_asset_hierarchy() -> None:
     associate_assets(assets_models_config["assets"])
     print('All assets updated!')
 
-def start() -> None:
-    create_asset_hierarchy() 
+def create_asset_hierarchy_parallel(assets_models_config: Dict, concurrency: int) -> None:
+    engine = ProvisioningEngine(get_client('iotsitewise'), get_id_registry(), schema_dir, concurrency=concurrency)
+    engine.provision(assets_models_config)
+
+def create_asset_hierarchy_transfer(assets_models_config: Dict, bulk_import_config: Dict, dry_run: bool) -> None:
+    transfer_config = bulk_import_config["metadata_transfer"]
+    documents = build_transfer_documents(assets_models_config, schema_dir, transfer_config["max_assets_per_document"])
+    if dry_run:
+        file_paths = write_documents(documents, f'{tmp_dir}/metadata_transfer')
+        print(f'Wrote {len(file_paths)} metadata transfer documents to {tmp_dir}/metadata_transfer')
+        return
+    engine = MetadataTransferEngine(get_client('iotsitewise'), get_client('iottwinmaker'), get_client('s3'), get_id_registry(), bulk_import_config["data"]["bucket"],
+                                    transfer_config["prefix"], min_poll_secs=transfer_config["min_poll_secs"], max_poll_secs=transfer_config["max_poll_secs"])
+    engine.provision(documents)
+
+def start(parallel: bool = False, concurrency: int = 8, bulk_transfer: bool = False, dry_run: bool = False,
+          assets_models_config: Optional[Dict] = None, bulk_import_config: Optional[Dict] = None) -> None:
+    # The configs are read from config/ unless given
+    if assets_models_config is None: assets_models_config = load_config('assets_models')
+    if bulk_transfer:
+        create_asset_hierarchy_transfer(assets_models_config, bulk_import_config if bulk_import_config is not None else load_config('bulk_import'), dry_run)
+    elif parallel:
+        create_asset_hierarchy_parallel(assets_models_config, concurrency)
+    else:
+        create_asset_hierarchy(assets_models_config)
 
 if __name__ == "__main__":
-    start()
+    parser = argparse.ArgumentParser(description='Create the configured asset models, assets and asset associations')
+    parser.add_argument('--parallel', action='store_true', help='create models, assets and associations concurrently, level by level')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent SiteWise calls in parallel mode')
+    parser.add_argument('--bulk-transfer', action='store_true', help='create the hierarchy with a few metadata transfer jobs instead of one call per resource')
+    parser.add_argument('--dry-run', action='store_true', help='with --bulk-transfer, only write the metadata transfer documents to tmp/')
+    args = parser.parse_args()
+    start_run('create_asset_hierarchy', **vars(args))
+    start(args.parallel, args.concurrency, args.bulk_transfer, args.dry_run)
+    print_metrics()
+    finish_run()
     print('Script execution successfully completed!!')
\ No newline at end of file
@@ -1,46 +1,112 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import json
+import math
 import os
+import queue
 from datetime import datetime
 import time
-from typing import List, Dict
-import boto3
-import yaml
-
-PROFILE_NAME = 'default'
-boto3.setup_default_session(profile_name=PROFILE_NAME)
-client = boto3.client('iotsitewise')
-s3_client = boto3.client('s3')
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Dict, Optional, Tuple
+from aws_clients import get_client, print_metrics
+from checkpoint_store import CheckpointStore
+from configs import load_config
+from instrumentation import finish_run, progress, report, start_run, stats
+from error_reports import extract_rejected_rows, list_error_report_keys, summarize_failures
+from job_packer import JobPacker, pack_jobs
+from output_writers import S3StreamWriter
+from rate_limiter import RateLimiter
 
 dir = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.abspath(os.path.dirname(dir))
-config_dir = f'{root_dir}/config'
 data_dir = f'{root_dir}/data'
+tmp_dir = f'{root_dir}/tmp'
+checkpoints_db_path = f'{tmp_dir}/checkpoints.db'
+failures_path = f'{tmp_dir}/import_failures.json'
+
+# Jobs in these states still count towards the SiteWise limit on concurrent bulk import jobs
+ACTIVE_JOB_STATUSES = ['PENDING', 'RUNNING']
+# Jobs in these states leave rejected rows in the error report location
+FAILED_JOB_STATUSES = ['FAILED', 'COMPLETED_WITH_FAILURES']
+
+# Number of bytes read from the start of a data file to estimate the size of a row
+ROW_SAMPLE_BYTES = 64 * 1024
+
+def list_s3_pages(bucket: str, prefix: str, delimiter: Optional[str] = None) -> Iterator[Dict]:
+    # Follows the continuation tokens, so listings are not cut off after 1000 objects
+    kwargs = {'Delimiter': delimiter} if delimiter is not None else {}
+    pages = iter(get_client('s3').get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix, **kwargs))
+    while True:
+        with stats.timer('list_s3_page'):
+            page = next(pages, None)
+        if page is None: return
+        yield page
+
+def get_records(page: Dict) -> List[Dict]:
+    # Pages of an empty prefix have no Contents
+    return [{'key': record["Key"], 'size': record["Size"]} for record in page.get("Contents", [])]
+
+def list_shard(bucket: str, prefix: str, results: queue.Queue) -> None:
+    for page in list_s3_pages(bucket, prefix):
+        results.put(get_records(page))
+
+def get_s3_objects(data_config: Dict) -> Iterator[Dict]:
+    """Yields the key and size of the data objects as their listing pages arrive
+
+    Sub-prefixes are listed in parallel: the list_shard_prefixes in bulk_import.yml if set,
+    otherwise the folders found under the data prefix.
+    """
+    bucket, prefix = data_config["bucket"], data_config["prefix"]
+    shard_prefixes = [f'{prefix}{shard_prefix}' for shard_prefix in data_config.get("list_shard_prefixes") or []]
+    # Unbounded, so listing threads never block on a consumer that stopped early
+    results = queue.Queue()
+    with ThreadPoolExecutor(max_workers=data_config["list_concurrency"]) as executor:
+        futures = [executor.submit(list_shard, bucket, shard_prefix, results) for shard_prefix in shard_prefixes]
+        if len(shard_prefixes) == 0:
+            for page in list_s3_pages(bucket, prefix, '/'):
+                futures.extend(executor.submit(list_shard, bucket, common_prefix["Prefix"], results) for common_prefix in page.get("CommonPrefixes", []))
+                yield from get_records(page)
+        while True:
+            try:
+                yield from results.get(timeout=0.1)
+            except queue.Empty:
+                # Pages are queued before their listing finishes, so nothing is left once all are done
+                if all(future.done() for future in futures) and results.empty(): break
+        for future in futures: future.result()
+
+def get_s3_keys(data_config: Dict) -> Iterator[str]:
+    for s3_object in get_s3_objects(data_config):
+        yield s3_object["key"]
 
-# Load bulk import configuration
-with open(f'{config_dir}/bulk_import.yml', 'r') as file:
-    bulk_import_config = yaml.safe_load(file)
+def estimate_row_bytes(bucket: str, s3_key: str) -> float:
+    # Data files are generated with rows of similar length, so the first rows of one file are representative
+    response = get_client('s3').get_object(Bucket=bucket, Key=s3_key, Range=f'bytes=0-{ROW_SAMPLE_BYTES - 1}')
+    sample = response["Body"].read()
+    return len(sample) / max(sample.count(b'\n'), 1)
 
-job_ids = []
+def create_packer(bulk_import_config: Dict, sample_s3_key: str) -> JobPacker:
+    job_config = bulk_import_config["job"]
+    return JobPacker(max_job_bytes=job_config["max_job_size_mb"] * 1024 * 1024, max_job_rows=job_config["max_job_rows"],
+                     max_files_per_job=job_config["max_files_per_job"], row_bytes=estimate_row_bytes(bulk_import_config["data"]["bucket"], sample_s3_key))
 
-def get_s3_keys() -> List[str]:
-    response = s3_client.list_objects_v2(Bucket=bulk_import_config["data"]["bucket"], Prefix=bulk_import_config["data"]["prefix"])
-    s3_keys = []
-    if response["ResponseMetadata"]["HTTPStatusCode"] == 200:
-        content_records = response["Contents"]
-        s3_keys = [record["Key"] for record in content_records]
-    return s3_keys
+def plan_jobs(s3_objects: List[Dict], bulk_import_config: Dict) -> List[List[str]]:
+    """Returns the S3 keys of the files of each job, one file per job unless pack_jobs is set"""
+    if not bulk_import_config["job"]["pack_jobs"] or len(s3_objects) == 0: return [[s3_object["key"]] for s3_object in s3_objects]
+    return pack_jobs(s3_objects, create_packer(bulk_import_config, s3_objects[0]["key"]))
 
-def create_job(s3_key: str) -> Dict:
-    response = client.create_bulk_import_job(
-        jobName= f'job_{str(int(datetime.now().timestamp()))}',
+def create_job(s3_keys: List[str], bulk_import_config: Dict) -> Dict:
+    response = get_client('iotsitewise').create_bulk_import_job(
+        # Jobs are submitted concurrently, so the timestamp alone is not unique
+        jobName= f'job_{str(int(datetime.now().timestamp()))}_{uuid.uuid4().hex[:8]}',
         jobRoleArn=bulk_import_config["job"]["role_arn"],
         files=[
             {
                 'bucket': bulk_import_config["data"]["bucket"],
                 'key': s3_key
-            },
+            } for s3_key in s3_keys
         ],
         errorReportLocation={
             'bucket': bulk_import_config["job"]["error_bucket"],
@@ -56,21 +122,8 @@ def create_job(s3_key: str) -> Dict:
     )
     return response
 
-def create_jobs() -> None:
-    s3_keys = get_s3_keys()
-    print(f'Total S3 objects: {len(s3_keys)}')
-    if len(s3_keys) > 0: 
-        print(f'Number of bulk import jobs to create: {len(s3_keys)}')
-    else:
-        print('No data found in S3!')
-
-    for s3_key in s3_keys:
-        job_id = create_job(s3_key)['jobId']
-        print(f'\tCreated job: {job_id} for importing data from {s3_key} S3 object')
-        job_ids.append(job_id)
-        time.sleep(1)
-
 def list_bulk_import_jobs() -> List[Dict]:
+    client = get_client('iotsitewise')
     all_jobs = []
     response = client.list_bulk_import_jobs(maxResults=250)
     all_jobs = response["jobSummaries"]
@@ -83,31 +136,244 @@ def list_bulk_import_jobs() -> List[Dict]:
             break  # No more jobs, exit the loop
     return all_jobs
 
-def job_status(job_id: str) -> str:
-    status = None
-    for job in list_bulk_import_jobs():
-        if job['id'] == job_id: status = job["status"] 
-    return status
+def list_job_statuses() -> Dict[str, str]:
+    return {job['id']: job["status"] for job in list_bulk_import_jobs()}
 
-def check_job_status() -> None:
-    SLEEP_SECS = 5
-    active_job_ids = job_ids.copy()
-    print(f'Checking job status every {SLEEP_SECS} secs until completion..')
+class BulkImportJobManager:
+    """Submits bulk import jobs concurrently and tracks them with a single job listing per poll cycle
 
-    while True:
-        for job_id in active_job_ids:
-            status=job_status(job_id)
-            if status not in ['PENDING','RUNNING']:
-                print(f'\tJob id: {job_id}, status: {status}')
-                active_job_ids.remove(job_id)
-        if len(active_job_ids) == 0: 
-            break
-        time.sleep(SLEEP_SECS)
-
-def start() -> None:
-    create_jobs()
-    check_job_status()
+    Jobs, each a list of S3 keys to import, wait in a local queue while SiteWise is at its
+    limit of concurrent jobs, and are submitted as soon as earlier jobs finish. Jobs import from
+    the data bucket of bulk_import_config, into the locations of its job settings.
+    """
+
+    def __init__(self, bulk_import_config: Dict, max_active_jobs: int = 10, submit_rate: float = 5, submit_concurrency: int = 4,
+                 min_poll_secs: float = 5, max_poll_secs: float = 60) -> None:
+        self.bulk_import_config = bulk_import_config
+        self.max_active_jobs = max_active_jobs
+        self.submit_concurrency = submit_concurrency
+        self.min_poll_secs = min_poll_secs
+        self.max_poll_secs = max_poll_secs
+        self.poll_secs = min_poll_secs
+        self.rate_limiter = RateLimiter(submit_rate)
+        self.queued = deque()
+        self.active = {}
+        self.job_ids = []
+        self.job_keys = {}
+        self.submitted_at = {}
+        self.statuses = {}
+
+    def queue_jobs(self, jobs: List[List[str]]) -> None:
+        self.queued.extend(jobs)
+
+    def submit(self, s3_keys: List[str]) -> Optional[str]:
+        from botocore.exceptions import ClientError
+        self.rate_limiter.acquire()
+        try:
+            with stats.timer('submit_job'):
+                return create_job(s3_keys, self.bulk_import_config)['jobId']
+        except ClientError as e:
+            if e.response["Error"]["Code"] != 'LimitExceededException': raise
+            return None
+
+    def submit_queued(self) -> int:
+        slots = self.max_active_jobs - len(self.active)
+        batch = [self.queued.popleft() for _ in range(min(slots, len(self.queued)))]
+        if len(batch) == 0: return 0
+        with ThreadPoolExecutor(max_workers=self.submit_concurrency) as executor:
+            job_ids = list(executor.map(self.submit, batch))
+        rejected = []
+        for s3_keys, job_id in zip(batch, job_ids):
+            if job_id is None:
+                rejected.append(s3_keys)
+                continue
+            if len(s3_keys) == 1:
+                report(f'\tCreated job: {job_id} for importing data from {s3_keys[0]} S3 object', 'job_created', job_id=job_id, files=1)
+            else:
+                report(f'\tCreated job: {job_id} for importing data from {len(s3_keys)} S3 objects: {s3_keys[0]} ..', 'job_created', job_id=job_id, files=len(s3_keys))
+            self.active[job_id] = s3_keys
+            self.job_ids.append(job_id)
+            self.job_keys[job_id] = s3_keys
+            self.submitted_at[job_id] = time.perf_counter()
+        # SiteWise is at its concurrent job limit, keep the files queued in their original order
+        self.queued.extendleft(reversed(rejected))
+        return len(batch) - len(rejected)
+
+    def check_finished(self) -> int:
+        """Reads the status of all jobs with one listing and returns the number of active jobs that finished"""
+        with stats.timer('list_job_statuses'):
+            statuses = list_job_statuses()
+        # Jobs that are not listed yet are still starting
+        finished = [job_id for job_id in self.active if statuses.get(job_id, 'PENDING') not in ACTIVE_JOB_STATUSES]
+        for job_id in finished:
+            # Measured from submission to the poll that saw the job finish
+            job_secs = time.perf_counter() - self.submitted_at[job_id]
+            stats.add_time('job_duration', job_secs)
+            report(f'\tJob id: {job_id}, status: {statuses[job_id]}', 'job_finished', job_id=job_id, status=statuses[job_id], secs=round(job_secs, 1))
+            self.statuses[job_id] = statuses[job_id]
+            del self.active[job_id]
+        return len(finished)
+
+    def next_poll_secs(self, changed: bool) -> float:
+        # Poll quickly while jobs move along and back off while nothing changes
+        self.poll_secs = self.min_poll_secs if changed else min(self.poll_secs * 2, self.max_poll_secs)
+        return self.poll_secs
+
+    def wait(self) -> Dict[str, str]:
+        print(f'Checking job status every {self.min_poll_secs}-{self.max_poll_secs} secs until completion..')
+        with progress('Importing', len(self.active) + len(self.queued), 'jobs') as progress_bar:
+            while len(self.active) > 0 or len(self.queued) > 0:
+                submitted = self.submit_queued()
+                with stats.timer('poll_wait'):
+                    time.sleep(self.poll_secs)
+                finished = self.check_finished()
+                progress_bar.update(finished)
+                self.next_poll_secs(finished > 0 or submitted > 0)
+        return self.statuses
+
+def create_job_manager(bulk_import_config: Dict) -> BulkImportJobManager:
+    job_config = bulk_import_config["job"]
+    return BulkImportJobManager(
+        bulk_import_config,
+        max_active_jobs=job_config["max_active_jobs"],
+        submit_rate=job_config["submit_rate_per_sec"],
+        submit_concurrency=job_config["submit_concurrency"],
+        min_poll_secs=job_config["min_poll_secs"],
+        max_poll_secs=job_config["max_poll_secs"]
+    )
+
+def open_checkpoints() -> Optional[CheckpointStore]:
+    # Incremental generation records which files were imported, so re-runs only import new files
+    return CheckpointStore(checkpoints_db_path) if os.path.exists(checkpoints_db_path) else None
+
+def get_new_s3_objects(s3_objects: Iterator[Dict], counts: Dict[str, int]) -> Iterator[Dict]:
+    checkpoints = open_checkpoints()
+    try:
+        for s3_object in s3_objects:
+            counts["listed"] += 1
+            if checkpoints is not None and checkpoints.is_imported(s3_object["key"].split('/')[-1]):
+                counts["imported"] += 1
+                continue
+            yield s3_object
+    finally:
+        if checkpoints is not None: checkpoints.close()
+
+def print_job_counts(job_manager: BulkImportJobManager, counts: Dict[str, int], job_count: int) -> None:
+    print(f'Total S3 objects: {counts["listed"]}')
+    if counts["imported"] > 0: print(f'\tSkipping {counts["imported"]} S3 objects imported by earlier jobs')
+    if job_count > 0:
+        print(f'Number of bulk import jobs to create: {job_count}')
+        waves = math.ceil(job_count / job_manager.max_active_jobs)
+        print(f'\t{counts["listed"] - counts["imported"]} S3 objects in {job_count} jobs, expected to run in {waves} waves of up to {job_manager.max_active_jobs} concurrent jobs')
+    elif counts["imported"] > 0:
+        print('No new data to import!')
+    else:
+        print('No data found in S3!')
+
+def create_jobs_while_listing(job_manager: BulkImportJobManager, counts: Dict[str, int]) -> int:
+    # Jobs are submitted as soon as they are complete, while later pages are still being listed
+    bulk_import_config = job_manager.bulk_import_config
+    pack = bulk_import_config["job"]["pack_jobs"]
+    packer = None
+    job_count = 0
+    for s3_object in get_new_s3_objects(get_s3_objects(bulk_import_config["data"]), counts):
+        if not pack:
+            jobs = [[s3_object["key"]]]
+        else:
+            if packer is None: packer = create_packer(bulk_import_config, s3_object["key"])
+            jobs = packer.add(s3_object["key"], s3_object["size"])
+        job_count += len(jobs)
+        job_manager.queue_jobs(jobs)
+        # Submit in batches, so the submissions of a batch still run concurrently
+        if len(job_manager.queued) >= job_manager.submit_concurrency: job_manager.submit_queued()
+    if packer is not None:
+        jobs = packer.flush()
+        job_count += len(jobs)
+        job_manager.queue_jobs(jobs)
+    return job_count
+
+def create_jobs(job_manager: BulkImportJobManager) -> None:
+    bulk_import_config = job_manager.bulk_import_config
+    counts = {'listed': 0, 'imported': 0}
+    if bulk_import_config["job"]["submit_while_listing"]:
+        print('Creating bulk import jobs while listing S3 objects..')
+        job_count = create_jobs_while_listing(job_manager, counts)
+        print_job_counts(job_manager, counts, job_count)
+    else:
+        jobs = plan_jobs(list(get_new_s3_objects(get_s3_objects(bulk_import_config["data"]), counts)), bulk_import_config)
+        print_job_counts(job_manager, counts, len(jobs))
+        job_manager.queue_jobs(jobs)
+    job_manager.submit_queued()
+    if len(job_manager.queued) > 0:
+        print(f'\t{len(job_manager.queued)} jobs queued until active jobs complete')
+
+def check_job_status(job_manager: BulkImportJobManager) -> None:
+    statuses = job_manager.wait()
+    checkpoints = open_checkpoints()
+    if checkpoints is None: return
+    try:
+        for job_id, status in statuses.items():
+            if status != 'COMPLETED': continue
+            for s3_key in job_manager.job_keys[job_id]: checkpoints.mark_imported(s3_key.split('/')[-1])
+    finally:
+        checkpoints.close()
+
+def print_failure_summary(summary: List[Dict]) -> None:
+    for property_summary in summary[:20]:
+        errors = ', '.join(f'{error_code}: {count}' for error_code, count in property_summary["errors"].items())
+        print(f'\tAsset id: {property_summary["asset_id"]}, property id: {property_summary["property_id"]}, rejected rows: {property_summary["rows"]} ({errors})')
+    if len(summary) > 20: print(f'\t.. and {len(summary) - 20} more properties, see {failures_path}')
+
+def create_retry_files(bulk_import_config: Dict, job_ids: List[str], attempt: int) -> Tuple[List[str], List[Dict]]:
+    """Extracts the rows rejected by the jobs into retry files in S3
+
+    Returns the S3 keys of the retry files and the failures per property.
+    """
+    s3_client = get_client('s3')
+    data_config, job_config, upload_config = bulk_import_config["data"], bulk_import_config["job"], bulk_import_config["upload"]
+    error_keys = [key for job_id in job_ids for key in list_error_report_keys(s3_client, job_config["error_bucket"], job_config["error_prefix"], job_id)]
+    # Retry files go under their own prefix, so a later create_jobs run does not import them again
+    writer = S3StreamWriter(s3_client, data_config["bucket"], job_config["retry_prefix"], job_config["rows_per_job"],
+                            f'retry_{int(datetime.now().timestamp())}_{attempt}', column_names=data_config["column_names"],
+                            part_size=upload_config["part_size_mb"] * 1024 * 1024, max_queued_parts=upload_config["max_queued_parts"],
+                            concurrency=upload_config["concurrency"])
+    with stats.timer('extract_rejected_rows'):
+        failures = extract_rejected_rows(s3_client, job_config["error_bucket"], error_keys, data_config["column_names"], writer)
+        writer.close()
+    return [upload['key'] for upload in writer.uploads], summarize_failures(failures)
+
+def retry_failed_jobs(job_manager: BulkImportJobManager) -> None:
+    job_config = job_manager.bulk_import_config["job"]
+    job_ids = [job_id for job_id, status in job_manager.statuses.items() if status in FAILED_JOB_STATUSES]
+    summaries = []
+    for attempt in range(1, job_config["max_retry_attempts"] + 1):
+        if len(job_ids) == 0: break
+        print(f'Extracting rejected rows of {len(job_ids)} failed jobs, retry attempt {attempt}..')
+        retry_keys, summary = create_retry_files(job_manager.bulk_import_config, job_ids, attempt)
+        summaries.append({'attempt': attempt, 'job_ids': job_ids, 'retry_keys': retry_keys, 'properties': summary})
+        print(f'\t{sum(property_summary["rows"] for property_summary in summary)} rejected rows of {len(summary)} properties written to {len(retry_keys)} retry files')
+        print_failure_summary(summary)
+        if len(retry_keys) == 0: break
+        # Only the retry jobs are checked for failures in the next attempt
+        finished_job_ids = set(job_manager.statuses)
+        job_manager.queue_jobs([[retry_key] for retry_key in retry_keys])
+        statuses = job_manager.wait()
+        job_ids = [job_id for job_id, status in statuses.items() if job_id not in finished_job_ids and status in FAILED_JOB_STATUSES]
+    if len(summaries) == 0: return
+    if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
+    with open(failures_path, 'w') as f:
+        json.dump(summaries, f, indent=2)
+    if len(job_ids) > 0: print(f'{len(job_ids)} retry jobs still failed, see {failures_path} for the failures per property')
+
+def start(bulk_import_config: Optional[Dict] = None) -> None:
+    job_manager = create_job_manager(bulk_import_config if bulk_import_config is not None else load_config('bulk_import'))
+    create_jobs(job_manager)
+    check_job_status(job_manager)
+    retry_failed_jobs(job_manager)
 
 if __name__ == "__main__":
+    start_run('create_bulk_import_job')
     start()
+    print_metrics()
+    finish_run()
     print('Script execution successfully completed!!')
\ No newline at end of file
@@ -0,0 +1,60 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import csv
+from collections import Counter
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+from output_writers import FileWriter
+
+# Number of rejected rows collected before they are written on as one block
+BATCH_ROWS = 100000
+
+def list_error_report_keys(s3_client, bucket: str, prefix: str, job_id: str) -> List[str]:
+    # SiteWise writes the error files of a job under <errorReportLocation prefix><job id>/
+    keys = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=f'{prefix}{job_id}/'):
+        keys.extend(record["Key"] for record in page.get("Contents", []))
+    return keys
+
+def read_error_rows(s3_client, bucket: str, key: str, column_names: List[str]) -> Iterator[Tuple[List[str], str, str]]:
+    """Yields the rejected row, the error code and the error message of each line of an error file
+
+    Error files repeat the columns of the imported file, followed by the error code and message.
+    """
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    for fields in csv.reader(line.decode('UTF8') for line in body.iter_lines()):
+        if len(fields) <= len(column_names) or fields[0] == column_names[0]: continue
+        yield fields[:len(column_names)], fields[len(column_names)], ','.join(fields[len(column_names) + 1:])
+
+def extract_rejected_rows(s3_client, bucket: str, keys: List[str], column_names: List[str], writer: FileWriter) -> Counter:
+    """Writes the rejected rows of the error files into compact retry files
+
+    Returns the number of rejected rows per asset id, property id and error code.
+    """
+    failures = Counter()
+    asset_idx, property_idx = column_names.index('ASSET_ID'), column_names.index('PROPERTY_ID')
+    rows = []
+    for key in keys:
+        for row, error_code, _ in read_error_rows(s3_client, bucket, key, column_names):
+            failures[(row[asset_idx], row[property_idx], error_code)] += 1
+            rows.append(row)
+            if len(rows) == BATCH_ROWS:
+                write_rows(writer, rows, column_names)
+                rows = []
+    if len(rows) > 0: write_rows(writer, rows, column_names)
+    return failures
+
+def write_rows(writer: FileWriter, rows: List[List[str]], column_names: List[str]) -> None:
+    # Values are passed through as text so the retried rows match the rejected ones exactly
+    columns = np.array(rows, dtype=str)
+    writer.write({name: columns[:, idx] for idx, name in enumerate(column_names)})
+
+def summarize_failures(failures: Counter) -> List[Dict]:
+    # One entry per property, with the most frequent error codes first
+    properties = {}
+    for (asset_id, property_id, error_code), count in failures.most_common():
+        summary = properties.setdefault((asset_id, property_id), {'asset_id': asset_id, 'property_id': property_id, 'rows': 0, 'errors': {}})
+        summary["rows"] += count
+        summary["errors"][error_code] = count
+    return sorted(properties.values(), key=lambda summary: summary["rows"], reverse=True)
@@ -0,0 +1,136 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import json
+import os
+from typing import Dict, List, Tuple
+import numpy as np
+import yaml
+from provisioning import get_properties_schema_file_name
+
+dir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.abspath(os.path.dirname(dir))
+config_dir = f'{root_dir}/config'
+fleet_dir = f'{root_dir}/fleet'
+
+# Levels of the sample hierarchy, from the top
+DEFAULT_LEVELS = ['Enterprise', 'Site', 'Area', 'Production Line', 'Stamping Press']
+DEFAULT_FAN_OUT = [1, 4, 4, 2, 4]
+
+# Measurements the generated properties are modelled on: name, unit, min, max
+PROPERTY_TEMPLATES = [
+    ('pressure', 'kPa', 60, 90),
+    ('temperature', 'Fahrenheit', 200, 300),
+    ('vibration', 'mm/s', 0, 12),
+    ('speed', 'rpm', 800, 1600),
+    ('current', 'A', 10, 40),
+    ('voltage', 'V', 380, 420),
+    ('flow', 'l/min', 20, 80),
+    ('humidity', '%', 30, 60)
+]
+
+# The C implementation dumps large fleets many times faster, when PyYAML was built with it
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+def get_model_name(prefix: str, level: str) -> str:
+    return f'{prefix}_{level}'
+
+def generate_properties(count: int, rng: np.random.Generator) -> List[Tuple[Dict, Dict]]:
+    """Returns the schema entry and the simulation range of count properties
+
+    Templates are used in turn, with a number appended once they have all been used.
+    """
+    properties = []
+    for idx in range(count):
+        name, unit, low, high = PROPERTY_TEMPLATES[idx % len(PROPERTY_TEMPLATES)]
+        if idx >= len(PROPERTY_TEMPLATES): name = f'{name}_{idx // len(PROPERTY_TEMPLATES) + 1}'
+        # Vary the ranges a little, so properties of the same kind are told apart in the data
+        span = high - low
+        low, high = round(low + rng.uniform(-0.1, 0.1) * span), round(high + rng.uniform(-0.1, 0.1) * span)
+        schema = {'externalId': f'External_Id_{name.title()}', 'name': name, 'dataType': 'DOUBLE', 'unit': unit, 'type': {'measurement': {}}}
+        properties.append((schema, {'name': name, 'min': low, 'max': high}))
+    return properties
+
+def generate_assets(prefix: str, levels: List[str], fan_out: List[int]) -> List[Dict]:
+    # Asset names carry the path from the top, e.g. Fleet_Production Line 1-3-2-1
+    assets = []
+    parents = [(get_model_name(prefix, levels[0]), [idx]) for idx in range(1, fan_out[0] + 1)]
+    for level_idx in range(len(levels)):
+        children = []
+        for model_name, path in parents:
+            asset = {'name': f'{model_name} {"-".join(map(str, path))}', 'model': model_name, 'associated_assets': None}
+            if level_idx + 1 < len(levels):
+                child_model_name = get_model_name(prefix, levels[level_idx + 1])
+                child_paths = [path + [idx] for idx in range(1, fan_out[level_idx + 1] + 1)]
+                asset["associated_assets"] = [f'{child_model_name} {"-".join(map(str, child_path))}' for child_path in child_paths]
+                children.extend((child_model_name, child_path) for child_path in child_paths)
+            assets.append(asset)
+        parents = children
+    return assets
+
+def generate_fleet_config(levels: List[str], fan_out: List[int], property_counts: List[int], prefix: str, seed: int,
+                          base_simulation_config: Dict) -> Tuple[Dict, Dict, Dict[str, List[Dict]]]:
+    """Returns the assets_models and data_simulation configurations and the properties schema per model"""
+    rng = np.random.default_rng(seed)
+    model_names = [get_model_name(prefix, level) for level in levels]
+    asset_models = [{'name': model_name, 'children': [model_names[idx + 1]] if idx + 1 < len(model_names) else None}
+                    for idx, model_name in enumerate(model_names)]
+    schemas = {}
+    simulated_properties = []
+    for model_name, property_count in zip(model_names, property_counts):
+        if property_count == 0: continue
+        properties = generate_properties(property_count, rng)
+        schemas[model_name] = [schema for schema, _ in properties]
+        simulated_properties.extend(dict(simulation, model=model_name) for _, simulation in properties)
+    assets_models_config = {'asset_models': asset_models, 'assets': generate_assets(prefix, levels, fan_out)}
+    # Keep the date range, output and other settings of the current configuration, and seed the values so load tests repeat
+    data_simulation_config = dict(base_simulation_config, properties=simulated_properties)
+    if data_simulation_config.get("seed") is None: data_simulation_config["seed"] = seed
+    return assets_models_config, data_simulation_config, schemas
+
+def write_yaml(config: Dict, file_path: str) -> None:
+    with open(file_path, 'w') as file:
+        yaml.dump(config, file, Dumper=Dumper, default_flow_style=False, sort_keys=False)
+
+def write_fleet_config(output_dir: str, assets_models_config: Dict, data_simulation_config: Dict, schemas: Dict[str, List[Dict]]) -> None:
+    for sub_dir in ['config', 'schema']:
+        if not os.path.exists(f'{output_dir}/{sub_dir}'): os.makedirs(f'{output_dir}/{sub_dir}')
+    write_yaml(assets_models_config, f'{output_dir}/config/assets_models.yml')
+    write_yaml(data_simulation_config, f'{output_dir}/config/data_simulation.yml')
+    for model_name, schema in schemas.items():
+        with open(f'{output_dir}/schema/{get_properties_schema_file_name(model_name)}', 'w') as file:
+            json.dump(schema, file, indent=4)
+
+def start(levels: List[str], fan_out: List[int], property_counts: List[int], prefix: str, seed: int, output_dir: str) -> None:
+    if len(fan_out) != len(levels):
+        raise ValueError(f'Expected a fan-out for each of the {len(levels)} levels, got {len(fan_out)}')
+    # A single count applies to the bottom level only, like the sample where only presses have properties
+    if len(property_counts) == 1: property_counts = [0] * (len(levels) - 1) + property_counts
+    if len(property_counts) != len(levels):
+        raise ValueError(f'Expected a property count for the bottom level or for each of the {len(levels)} levels, got {len(property_counts)}')
+    with open(f'{config_dir}/data_simulation.yml', 'r') as file:
+        base_simulation_config = yaml.safe_load(file)
+
+    assets_models_config, data_simulation_config, schemas = generate_fleet_config(
+        levels, fan_out, property_counts, prefix, seed, base_simulation_config)
+    write_fleet_config(output_dir, assets_models_config, data_simulation_config, schemas)
+
+    asset_counts = np.cumprod(fan_out)
+    series_count = int(np.dot(asset_counts, property_counts))
+    print(f'Generated {len(levels)} asset models and {int(asset_counts.sum())} assets ({", ".join(f"{count} {level}" for count, level in zip(asset_counts, levels))})')
+    print(f'\t{series_count} simulated time series, configuration written to {output_dir}/config and {output_dir}/schema')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate asset models, assets, properties schemas and simulation settings for a large fleet')
+    parser.add_argument('--levels', nargs='+', default=DEFAULT_LEVELS, help='asset model of each hierarchy level, from the top')
+    parser.add_argument('--fan-out', type=int, nargs='+', default=DEFAULT_FAN_OUT,
+                        help='number of top-level assets, then the number of children of each asset per level below')
+    parser.add_argument('--properties', type=int, nargs='+', default=[2],
+                        help='number of properties of the bottom-level model, or of each model from the top')
+    parser.add_argument('--prefix', default='Fleet', help='prefix of the generated model and asset names')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated property ranges')
+    parser.add_argument('--output-dir', default=fleet_dir, help='directory to write the config and schema directories into')
+    args = parser.parse_args()
+    start(args.levels, args.fan_out, args.properties, args.prefix, args.seed, args.output_dir)
+    print('Script execution successfully completed!!')
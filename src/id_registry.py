@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+class IdRegistry:
+    """Name to id lookups for the asset models, assets and hierarchies created in SiteWise
+
+    All ids are loaded into dictionaries once, and every change is written through to a
+    SQLite database in its own transaction, so an interrupted run keeps the ids it created.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        db_dir = os.path.dirname(db_path)
+        if not os.path.exists(db_dir): os.makedirs(db_dir)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS asset_models (asset_model_name TEXT PRIMARY KEY, asset_model_id TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS assets (asset_name TEXT PRIMARY KEY, asset_id TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS hierarchies (asset_model_name TEXT, child_asset_model_id TEXT, hierarchy_id TEXT NOT NULL, '
+                              'PRIMARY KEY (asset_model_name, child_asset_model_id))')
+        self.model_ids: Dict[str, str] = dict(self.conn.execute('SELECT asset_model_name, asset_model_id FROM asset_models'))
+        self.asset_ids: Dict[str, str] = dict(self.conn.execute('SELECT asset_name, asset_id FROM assets'))
+        self.hierarchy_ids: Dict[Tuple[str, str], str] = {(row[0], row[1]): row[2] for row in self.conn.execute(
+            'SELECT asset_model_name, child_asset_model_id, hierarchy_id FROM hierarchies')}
+
+    def get_model_id(self, asset_model_name: str) -> Optional[str]:
+        return self.model_ids.get(asset_model_name)
+
+    def get_asset_id(self, asset_name: str) -> Optional[str]:
+        return self.asset_ids.get(asset_name)
+
+    def get_hierarchy_id(self, asset_model_name: str, child_asset_model_id: str) -> Optional[str]:
+        return self.hierarchy_ids.get((asset_model_name, child_asset_model_id))
+
+    def set_model_id(self, asset_model_name: str, asset_model_id: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO asset_models VALUES (?, ?)', (asset_model_name, asset_model_id))
+            self.model_ids[asset_model_name] = asset_model_id
+
+    def set_asset_id(self, asset_name: str, asset_id: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO assets VALUES (?, ?)', (asset_name, asset_id))
+            self.asset_ids[asset_name] = asset_id
+
+    def set_hierarchy_id(self, asset_model_name: str, child_asset_model_id: str, hierarchy_id: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO hierarchies VALUES (?, ?, ?)', (asset_model_name, child_asset_model_id, hierarchy_id))
+            self.hierarchy_ids[(asset_model_name, child_asset_model_id)] = hierarchy_id
+
+    def remove_asset_id(self, asset_name: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM assets WHERE asset_name = ?', (asset_name,))
+            self.asset_ids.pop(asset_name, None)
+
+    def remove_model_id(self, asset_model_name: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM asset_models WHERE asset_model_name = ?', (asset_model_name,))
+            self.conn.execute('DELETE FROM hierarchies WHERE asset_model_name = ?', (asset_model_name,))
+            self.model_ids.pop(asset_model_name, None)
+            self.hierarchy_ids = {key: value for key, value in self.hierarchy_ids.items() if key[0] != asset_model_name}
+
+    def close(self) -> None:
+        self.conn.close()
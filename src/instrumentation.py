@@ -0,0 +1,313 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+dir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.abspath(os.path.dirname(dir))
+tmp_dir = f'{root_dir}/tmp'
+run_log_path = f'{tmp_dir}/run_log.jsonl'
+
+# The run is identified through the environment, so worker processes log into the same run
+RUN_ID_VARIABLE = 'BULK_IMPORT_RUN_ID'
+RUN_SCRIPT_VARIABLE = 'BULK_IMPORT_RUN_SCRIPT'
+RUN_START_VARIABLE = 'BULK_IMPORT_RUN_START'
+
+# Durations kept per timer for percentiles, the count, total and maximum cover every call
+TIMER_SAMPLES = 1024
+
+class Timer:
+    """Count, total and maximum of the durations of a timer, with a bounded uniform sample for percentiles
+
+    The sample is a reservoir of up to TIMER_SAMPLES durations, so memory stays the same however
+    long a run takes.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: List[float] = []
+        self.rng = random.Random()
+
+    def add(self, secs: float) -> None:
+        self.count += 1
+        self.total += secs
+        self.max = max(self.max, secs)
+        if len(self.samples) < TIMER_SAMPLES:
+            self.samples.append(secs)
+            return
+        slot = self.rng.randrange(self.count)
+        if slot < TIMER_SAMPLES: self.samples[slot] = secs
+
+    def export(self) -> Dict:
+        return {'count': self.count, 'total': self.total, 'max': self.max, 'samples': list(self.samples)}
+
+    def merge(self, exported: Dict) -> None:
+        if exported["count"] == 0: return
+        if self.count == 0:
+            self.count, self.total, self.max, self.samples = exported["count"], exported["total"], exported["max"], list(exported["samples"])
+            return
+        # Each sample stands for count / len(samples) durations, so the merged sample is drawn with those weights
+        weights = [self.count / len(self.samples)] * len(self.samples) + [exported["count"] / len(exported["samples"])] * len(exported["samples"])
+        samples = self.samples + exported["samples"]
+        self.count += exported["count"]
+        self.total += exported["total"]
+        self.max = max(self.max, exported["max"])
+        if len(samples) > TIMER_SAMPLES:
+            samples = [samples[idx] for idx in np.random.default_rng().choice(len(samples), TIMER_SAMPLES, replace=False, p=np.array(weights) / sum(weights))]
+        self.samples = samples
+
+    def summary(self) -> Dict:
+        if self.count == 0: return {'count': 0, 'total_secs': 0.0}
+        p50, p90, p99 = (float(p) * 1000 for p in np.percentile(self.samples, [50, 90, 99]))
+        return {'count': self.count, 'total_secs': round(self.total, 3), 'p50_ms': round(p50, 1), 'p90_ms': round(p90, 1),
+                'p99_ms': round(p99, 1), 'max_ms': round(self.max * 1000, 1)}
+
+class Stats:
+    """Timers and counters of one process
+
+    Timers keep running totals and a bounded sample of their durations, so percentiles can be
+    reported and worker processes can hand their timers to the parent to merge.
+    """
+
+    def __init__(self) -> None:
+        self.timers: Dict[str, Timer] = defaultdict(Timer)
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start_time)
+
+    def add_time(self, name: str, secs: float) -> None:
+        with self.lock:
+            self.timers[name].add(secs)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += n
+
+    def reset(self) -> None:
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def export(self) -> Dict:
+        with self.lock:
+            return {'timers': {name: timer.export() for name, timer in self.timers.items()}, 'counters': dict(self.counters)}
+
+    def merge(self, exported: Dict) -> None:
+        with self.lock:
+            for name, timer in exported["timers"].items(): self.timers[name].merge(timer)
+            self.counters.update(exported["counters"])
+
+    def summary(self) -> Dict:
+        with self.lock:
+            return {'timers': {name: timer.summary() for name, timer in sorted(self.timers.items())}, 'counters': dict(self.counters)}
+
+stats = Stats()
+
+def get_run() -> Optional[Dict]:
+    if RUN_ID_VARIABLE not in os.environ: return None
+    return {'run_id': os.environ[RUN_ID_VARIABLE], 'script': os.environ.get(RUN_SCRIPT_VARIABLE)}
+
+def log_event(event: str, **fields) -> None:
+    """Appends an event to the JSON-lines run log, when a run was started
+
+    Events are small and rare next to the data written, so the log is opened per event,
+    which lets worker processes append to it as well.
+    """
+    run = get_run()
+    if run is None: return
+    record = dict(time=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds'), pid=os.getpid(), event=event, **run, **fields)
+    with open(run_log_path, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+def start_run(script: str, **fields) -> None:
+    if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
+    os.environ[RUN_ID_VARIABLE] = uuid.uuid4().hex[:12]
+    os.environ[RUN_SCRIPT_VARIABLE] = script
+    os.environ[RUN_START_VARIABLE] = str(time.time())
+    log_event('run_started', **fields)
+
+def finish_run(**fields) -> None:
+    if get_run() is None: return
+    wall_secs = time.time() - float(os.environ[RUN_START_VARIABLE])
+    summary = stats.summary()
+    log_event('run_finished', wall_secs=round(wall_secs, 3), **summary, **fields)
+    print_time_breakdown(wall_secs, summary["timers"], summary["counters"])
+
+def print_time_breakdown(wall_secs: float, timers: Dict[str, Dict], counters: Dict[str, int]) -> None:
+    # Timers of concurrent threads and processes overlap, so they can add up to more than the wall time
+    print(f'\nTime spent, {wall_secs:.1f} secs wall time:')
+    for name, timer in sorted(timers.items(), key=lambda item: item[1]["total_secs"], reverse=True):
+        print(f'\t{name}: {timer["total_secs"]:.1f} secs in {timer["count"]} calls, p50 {timer.get("p50_ms", 0)} ms, '
+              f'p99 {timer.get("p99_ms", 0)} ms, max {timer.get("max_ms", 0)} ms')
+    for name, count in sorted(counters.items()):
+        print(f'\t{name}: {count} ({format_count(count / wall_secs)}/s)')
+
+class ProgressBar:
+    """Shows the share of work done, its rate and the time left on the terminal
+
+    Work done in worker processes is added to a shared counter, which is read from a
+    background thread. Nothing is shown when stderr is not a terminal, the run log
+    records the outcome either way.
+    """
+
+    WIDTH = 30
+
+    def __init__(self, label: str, total: float, unit: str, counter=None, min_refresh_secs: float = 0.2) -> None:
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.counter = counter
+        self.min_refresh_secs = min_refresh_secs
+        self.done = 0
+        self.start_time = time.perf_counter()
+        self.rendered_at = 0.0
+        self.enabled = sys.stderr.isatty()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if counter is not None:
+            self.thread = threading.Thread(target=self.watch_counter, daemon=True)
+            self.thread.start()
+
+    def watch_counter(self) -> None:
+        while not self.stopped.wait(self.min_refresh_secs):
+            self.done = self.counter.value
+            self.render()
+
+    def update(self, n: float) -> None:
+        with self.lock:
+            self.done += n
+        self.render()
+
+    def format_line(self) -> str:
+        elapsed = time.perf_counter() - self.start_time
+        share = min(self.done / self.total, 1) if self.total > 0 else 1
+        rate = self.done / elapsed if elapsed > 0 else 0
+        eta = datetime.timedelta(seconds=round((self.total - self.done) / rate)) if rate > 0 and self.done < self.total else '-'
+        filled = int(share * self.WIDTH)
+        return (f'{self.label} [{"#" * filled}{"." * (self.WIDTH - filled)}] {share:4.0%} {format_count(self.done)}/{format_count(self.total)} '
+                f'{self.unit}, {format_count(rate)} {self.unit}/s, ETA {eta}')
+
+    def render(self, force: bool = False) -> None:
+        if not self.enabled: return
+        now = time.perf_counter()
+        with self.lock:
+            if not force and now - self.rendered_at < self.min_refresh_secs: return
+            self.rendered_at = now
+            sys.stderr.write(f'\r\033[K{self.format_line()}')
+            sys.stderr.flush()
+
+    def clear(self) -> None:
+        if not self.enabled: return
+        with self.lock:
+            sys.stderr.write('\r\033[K')
+            sys.stderr.flush()
+            self.rendered_at = 0.0
+
+    def close(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.done = self.counter.value
+        self.render(force=True)
+        if self.enabled: sys.stderr.write('\n')
+        elapsed = time.perf_counter() - self.start_time
+        log_event('progress', label=self.label, unit=self.unit, done=self.done, total=self.total, secs=round(elapsed, 3),
+                  per_sec=round(self.done / elapsed, 1) if elapsed > 0 else None)
+
+def format_count(count: float) -> str:
+    for divisor, suffix in [(1e9, 'G'), (1e6, 'M'), (1e3, 'k')]:
+        if abs(count) >= divisor: return f'{count / divisor:.1f}{suffix}'
+    return f'{count:.0f}'
+
+# Progress bar of the parent process, and the counter shared with it in worker processes
+progress_bar: Optional[ProgressBar] = None
+progress_counter = None
+
+@contextlib.contextmanager
+def progress(label: str, total: float, unit: str, counter=None) -> Iterator[ProgressBar]:
+    global progress_bar
+    progress_bar = ProgressBar(label, total, unit, counter)
+    try:
+        yield progress_bar
+    finally:
+        progress_bar.close()
+        progress_bar = None
+
+def init_worker(counter) -> None:
+    # Run in each worker process, so the work it does moves the parent's progress bar
+    global progress_counter
+    progress_counter = counter
+
+def run_with_stats(function: Callable, *args) -> Tuple:
+    # Run in a worker process, returns the result along with the timers and counters of the work
+    stats.reset()
+    return function(*args), stats.export()
+
+def add_progress(n: float) -> None:
+    if progress_counter is not None:
+        with progress_counter.get_lock():
+            progress_counter.value += n
+    elif progress_bar is not None:
+        progress_bar.update(n)
+
+def report(message: str, event: Optional[str] = None, **fields) -> None:
+    """Prints a progress line above the progress bar and records it in the run log"""
+    if progress_bar is not None: progress_bar.clear()
+    # Worker processes cannot clear the parent's progress bar, so their lines overwrite it
+    if progress_counter is not None and sys.stdout.isatty(): message = f'\r\033[K{message}'
+    print(message, flush=progress_bar is not None)
+    if progress_bar is not None: progress_bar.render(force=True)
+    if event is not None: log_event(event, **fields)
+
+def load_runs(log_path: str) -> List[Dict]:
+    runs = {}
+    with open(log_path, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            run = runs.setdefault(record["run_id"], {'run_id': record["run_id"], 'script': record["script"], 'started': record["time"], 'events': Counter()})
+            run["events"][record["event"]] += 1
+            if record["event"] == 'run_finished': run.update(finished=record)
+            if record["event"] == 'api_calls': run.update(api_calls=record["operations"])
+    return list(runs.values())
+
+def print_runs(log_path: str, last: int) -> None:
+    # One line per script run, then where the time of each finished run went
+    for run in load_runs(log_path)[-last:]:
+        finished = run.get("finished")
+        wall = f'{finished["wall_secs"]:.1f} secs' if finished is not None else 'not finished'
+        events = ', '.join(f'{count} {event}' for event, count in run["events"].items() if event not in ['run_started', 'run_finished'])
+        print(f'{run["started"]} {run["script"]} ({run["run_id"]}): {wall}{", " + events if events else ""}')
+        if finished is None: continue
+        for name, timer in sorted(finished["timers"].items(), key=lambda item: item[1]["total_secs"], reverse=True)[:10]:
+            print(f'\t{name}: {timer["total_secs"]:.1f} secs in {timer["count"]} calls, p50 {timer.get("p50_ms", 0)} ms, p99 {timer.get("p99_ms", 0)} ms')
+        for name, snapshot in run.get("api_calls", {}).items():
+            print(f'\t{name}: {snapshot["calls"]} calls, {snapshot["throttles"]} throttled, p50 {snapshot["p50_ms"]} ms, p99 {snapshot["p99_ms"]} ms')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarize the runs recorded in the run log')
+    parser.add_argument('--log', default=run_log_path, help='JSON-lines run log to read')
+    parser.add_argument('--last', type=int, default=10, help='number of most recent runs to show')
+    args = parser.parse_args()
+    print_runs(args.log, args.last)
@@ -0,0 +1,61 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import math
+from typing import Dict, List
+
+class JobPacker:
+    """Groups S3 objects into bulk import jobs within size, row and file count budgets
+
+    Objects go into the first open job they still fit in. At most max_open_jobs jobs are
+    kept open; once more are needed, the fullest one is handed out. Objects can be added
+    as they are listed, and packing a sorted list largest first fills the jobs best.
+    """
+
+    def __init__(self, max_job_bytes: int, max_job_rows: int, max_files_per_job: int, row_bytes: float, max_open_jobs: int = 8) -> None:
+        self.max_job_bytes = max_job_bytes
+        self.max_job_rows = max_job_rows
+        self.max_files_per_job = max_files_per_job
+        self.row_bytes = row_bytes
+        self.max_open_jobs = max_open_jobs
+        self.open_jobs: List[Dict] = []
+
+    def estimate_rows(self, size: int) -> int:
+        return math.ceil(size / self.row_bytes)
+
+    def fits(self, job: Dict, size: int, rows: int) -> bool:
+        return len(job["keys"]) < self.max_files_per_job and job["bytes"] + size <= self.max_job_bytes and job["rows"] + rows <= self.max_job_rows
+
+    def add(self, key: str, size: int) -> List[List[str]]:
+        """Adds an object and returns the keys of the jobs that are complete"""
+        rows = self.estimate_rows(size)
+        job = next((job for job in self.open_jobs if self.fits(job, size, rows)), None)
+        completed = []
+        if job is None:
+            # An object larger than a budget still gets a job of its own
+            job = {'keys': [], 'bytes': 0, 'rows': 0}
+            self.open_jobs.append(job)
+            if len(self.open_jobs) > self.max_open_jobs:
+                fullest = max(self.open_jobs[:-1], key=lambda open_job: open_job["bytes"])
+                self.open_jobs.remove(fullest)
+                completed.append(fullest["keys"])
+        job["keys"].append(key)
+        job["bytes"] += size
+        job["rows"] += rows
+        # A job that cannot take another file is complete right away
+        if len(job["keys"]) == self.max_files_per_job:
+            self.open_jobs.remove(job)
+            completed.append(job["keys"])
+        return completed
+
+    def flush(self) -> List[List[str]]:
+        completed = [job["keys"] for job in self.open_jobs]
+        self.open_jobs = []
+        return completed
+
+def pack_jobs(objects: List[Dict], packer: JobPacker) -> List[List[str]]:
+    # Largest objects first, so the small ones fill the gaps left in each job
+    jobs = []
+    for record in sorted(objects, key=lambda record: record["size"], reverse=True):
+        jobs.extend(packer.add(record["key"], record["size"]))
+    return jobs + packer.flush()
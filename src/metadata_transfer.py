@@ -0,0 +1,162 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import re
+import time
+import zlib
+from typing import Dict, List
+from id_registry import IdRegistry
+from instrumentation import report, stats
+from provisioning import SiteWiseEngine, get_asset_levels, load_properties_schema
+
+# Metadata transfer jobs end in one of these states
+FINAL_STATES = ['COMPLETED', 'ERROR', 'CANCELLED']
+
+def get_external_id(kind: str, name: str) -> str:
+    # External ids only allow letters, digits, _ - . and :, so other characters are replaced and
+    # the crc32 of the name keeps apart names that differ only in those characters
+    return f"{kind}.{re.sub(r'[^A-Za-z0-9_.:-]', '_', name)[:100]}.{zlib.crc32(name.encode()):08x}"
+
+def get_asset_model_definition(model: Dict, schema_dir: str) -> Dict:
+    model_name = model["name"]
+    # Hierarchies are named after their child model, as in create_asset_hierarchy.py
+    return {
+        'assetModelExternalId': get_external_id('model', model_name),
+        'assetModelName': model_name,
+        'assetModelProperties': load_properties_schema(schema_dir, model_name),
+        'assetModelHierarchies': [{'externalId': get_external_id('hierarchy', child_model_name), 'name': child_model_name,
+                                   'childAssetModelExternalId': get_external_id('model', child_model_name)}
+                                  for child_model_name in (model["children"] or [])]
+    }
+
+def get_asset_definition(asset: Dict, asset_model_names: Dict[str, str]) -> Dict:
+    return {
+        'assetExternalId': get_external_id('asset', asset["name"]),
+        'assetName': asset["name"],
+        'assetModelExternalId': get_external_id('model', asset["model"]),
+        'assetHierarchies': [{'externalId': get_external_id('hierarchy', asset_model_names[child_asset_name]),
+                              'childAssetExternalId': get_external_id('asset', child_asset_name)}
+                             for child_asset_name in (asset["associated_assets"] or [])]
+    }
+
+def build_transfer_documents(assets_models_config: Dict, schema_dir: str, max_assets_per_document: int) -> List[Dict]:
+    """Returns the metadata transfer documents that create the configured asset models, assets and associations
+
+    The first document holds every asset model. Assets are spread over documents of up to
+    max_assets_per_document assets, children before their parents, so the assets a parent is
+    associated with exist once the documents are imported in order. Resources are identified by
+    external ids derived from their names, so importing the documents again updates them in place.
+    """
+    assets = assets_models_config["assets"]
+    asset_model_names = {asset["name"]: asset["model"] for asset in assets}
+    asset_definitions = [get_asset_definition(asset, asset_model_names) for level in reversed(get_asset_levels(assets)) for asset in level]
+    documents = [{'assetModels': [get_asset_model_definition(model, schema_dir) for model in assets_models_config["asset_models"]],
+                  'assets': asset_definitions[:max_assets_per_document]}]
+    documents += [{'assets': asset_definitions[offset:offset + max_assets_per_document]}
+                  for offset in range(max_assets_per_document, len(asset_definitions), max_assets_per_document)]
+    return documents
+
+def write_documents(documents: List[Dict], directory: str) -> List[str]:
+    if not os.path.exists(directory): os.makedirs(directory)
+    file_paths = []
+    for idx, document in enumerate(documents, 1):
+        file_path = f'{directory}/asset_hierarchy_{idx}.json'
+        with open(file_path, 'w') as file:
+            json.dump(document, file, indent=2)
+        file_paths.append(file_path)
+    return file_paths
+
+def map_external_ids(id_registry: IdRegistry, documents: List[Dict], model_summaries: List[Dict],
+                     model_hierarchies: Dict[str, List[Dict]], asset_summaries: List[Dict]) -> List[str]:
+    """Stores the ids SiteWise assigned to the resources of the documents under their names
+
+    model_summaries and asset_summaries are the results of the list APIs, and model_hierarchies
+    holds the assetModelHierarchies of each asset model id, as returned by describe_asset_model.
+    Returns the external ids that none of the summaries matched.
+    """
+    model_ids = {model["externalId"]: model["id"] for model in model_summaries if model.get("externalId") is not None}
+    asset_ids = {asset["externalId"]: asset["id"] for asset in asset_summaries if asset.get("externalId") is not None}
+    missing = []
+    for document in documents:
+        for model in document.get("assetModels", []):
+            model_id = model_ids.get(model["assetModelExternalId"])
+            if model_id is None:
+                missing.append(model["assetModelExternalId"])
+                continue
+            id_registry.set_model_id(model["assetModelName"], model_id)
+            for hierarchy in model_hierarchies.get(model_id, []):
+                id_registry.set_hierarchy_id(model["assetModelName"], hierarchy["childAssetModelId"], hierarchy["id"])
+        for asset in document.get("assets", []):
+            asset_id = asset_ids.get(asset["assetExternalId"])
+            if asset_id is None:
+                missing.append(asset["assetExternalId"])
+                continue
+            id_registry.set_asset_id(asset["assetName"], asset_id)
+    return missing
+
+class MetadataTransferEngine(SiteWiseEngine):
+    """Creates the asset hierarchy with a few metadata transfer jobs instead of one call per resource
+
+    Each document is uploaded to S3 and imported by its own job, one job at a time. The ids
+    SiteWise assigned are then looked up by external id with one listing per asset model and
+    stored in the registry, so the other scripts find them as if the hierarchy had been created
+    call by call.
+    """
+
+    def __init__(self, client, transfer_client, s3_client, id_registry: IdRegistry, bucket: str, prefix: str, **kwargs) -> None:
+        super().__init__(client, id_registry, **kwargs)
+        self.transfer_client = transfer_client
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def call_transfer(self, operation: str, **kwargs) -> Dict:
+        return getattr(self.transfer_client, operation)(**kwargs)
+
+    def upload_document(self, document: Dict, key: str) -> str:
+        self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(document).encode())
+        return f'arn:aws:s3:::{self.bucket}/{key}'
+
+    def run_job(self, job_id: str, location: str) -> Dict:
+        self.call_transfer('create_metadata_transfer_job', metadataTransferJobId=job_id, sources=[{'type': 's3', 's3Configuration': {'location': location}}],
+                           destination={'type': 'iotsitewise'})
+        poll_secs = self.min_poll_secs
+        while True:
+            with stats.timer('poll_wait'):
+                time.sleep(poll_secs)
+            response = self.call_transfer('get_metadata_transfer_job', metadataTransferJobId=job_id)
+            if response["status"]["state"] in FINAL_STATES: return response
+            poll_secs = min(poll_secs * 2, self.max_poll_secs)
+
+    def transfer(self, documents: List[Dict]) -> None:
+        run_id = time.strftime('%Y%m%d%H%M%S')
+        for idx, document in enumerate(documents, 1):
+            job_id = f'asset-hierarchy-{run_id}-{idx}'
+            location = self.upload_document(document, f'{self.prefix}{job_id}.json')
+            response = self.run_job(job_id, location)
+            status, job_progress = response["status"], response.get("progress") or {}
+            if status["state"] != 'COMPLETED' or job_progress.get("failedCount", 0) > 0:
+                raise RuntimeError(f'Metadata transfer job {job_id} ended {status["state"]} with {job_progress.get("failedCount", 0)} failed resources: '
+                                   f'{status.get("error")}, see {response.get("reportUrl")}')
+            report(f'\tJob {job_id}: {job_progress.get("succeededCount", 0)} resources imported, {job_progress.get("skippedCount", 0)} unchanged',
+                   'metadata_transfer_job_completed', job_id=job_id, progress=job_progress)
+
+    def map_ids(self, documents: List[Dict]) -> None:
+        external_ids = {model["assetModelExternalId"] for document in documents for model in document.get("assetModels", [])}
+        model_summaries = [model for model in self.list_all('list_asset_models', 'assetModelSummaries') if model.get("externalId") in external_ids]
+        model_hierarchies = {model["id"]: self.call('describe_asset_model', assetModelId=model["id"], excludeProperties=True)["assetModelHierarchies"]
+                             for model in model_summaries}
+        asset_summaries = [asset for model in model_summaries for asset in self.list_all('list_assets', 'assetSummaries', assetModelId=model["id"])]
+        missing = map_external_ids(self.id_registry, documents, model_summaries, model_hierarchies, asset_summaries)
+        if len(missing) > 0:
+            raise RuntimeError(f'{len(missing)} transferred resources were not found in SiteWise: {missing[:10]}')
+
+    def provision(self, documents: List[Dict]) -> None:
+        print(f'Importing asset models and assets with {len(documents)} metadata transfer jobs..')
+        self.transfer(documents)
+        print('All metadata transfer jobs completed!')
+        print('Storing the ids of the transferred resources..')
+        self.map_ids(documents)
+        print('All ids stored!')
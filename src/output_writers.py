@@ -0,0 +1,303 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import gzip
+import queue
+import threading
+from typing import Callable, List, Dict, Optional, Tuple
+import numpy as np
+from instrumentation import report, stats
+
+# A block holds the rows of one write as a column name -> value mapping. Columns are
+# either NumPy arrays or a single value shared by all rows, e.g. {'ASSET_ID': '...',
+# 'TIMESTAMP_SECONDS': np.array([...]), 'VALUE': np.array([...]), ...}
+COLUMN_NAMES = ['ASSET_ID', 'PROPERTY_ID', 'DATA_TYPE', 'TIMESTAMP_SECONDS', 'TIMESTAMP_NANO_OFFSET', 'QUALITY', 'VALUE']
+WRITE_BUFFER_BYTES = 8 * 1024 * 1024
+# Matches the line terminator of csv.writer
+LINE_TERMINATOR = '\r\n'
+
+def get_block_length(block: Dict) -> int:
+    return len(block["TIMESTAMP_SECONDS"])
+
+def slice_block(block: Dict, start: int, stop: int) -> Dict:
+    return {name: column[start:stop] if isinstance(column, np.ndarray) else column for name, column in block.items()}
+
+def format_csv_rows(block: Dict, column_names: List[str] = COLUMN_NAMES) -> str:
+    # One %-format per row from Python lists outruns the np.char ufuncs, which build a new array per column.
+    # Constant columns are folded into the row format, floats are written with two decimals
+    row_format, columns = [], []
+    for name in column_names:
+        column = block[name]
+        if not isinstance(column, np.ndarray):
+            row_format.append(str(column).replace('%', '%%'))
+            continue
+        row_format.append('%.2f' if column.dtype.kind == 'f' else '%d' if column.dtype.kind in 'iu' else '%s')
+        # Byte strings are decoded first, tolist would give bytes that format as b'...'
+        columns.append((np.char.decode(column, 'UTF8') if column.dtype.kind == 'S' else column).tolist())
+    row_format = ','.join(row_format)
+    rows = [row_format % row for row in zip(*columns)]
+    return LINE_TERMINATOR.join(rows) + LINE_TERMINATOR if len(rows) > 0 else ''
+
+class FileWriter:
+    """Splits blocks of rows into sequentially numbered files holding at most rows_per_file rows each"""
+
+    extension = None
+
+    def __init__(self, directory: str, rows_per_file: int, file_prefix: str = 'historical_data', column_names: List[str] = COLUMN_NAMES) -> None:
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self.file_prefix = file_prefix
+        self.column_names = column_names
+        self.file_num = 0
+        self.file = None
+        self.file_name = None
+        self.file_rows = 0
+        # Optional CheckpointStore told about every file started and completed
+        self.checkpoints = None
+        # Optional callback given the name of every completed file
+        self.on_file_completed: Optional[Callable[[str], None]] = None
+        self.file_progress: Dict[Tuple[str, str], List[int]] = {}
+
+    def next_file_name(self) -> str:
+        self.file_num += 1
+        self.file_name = f'{self.file_prefix}_{self.file_num}.{self.extension}'
+        self.file_rows = 0
+        if self.checkpoints is not None: self.checkpoints.file_opened(self.file_prefix, self.file_num, self.file_name)
+        return self.file_name
+
+    def track_progress(self, block: Dict) -> None:
+        # First and last timestamp of each property in the current file, blocks hold a single property
+        timestamps = block["TIMESTAMP_SECONDS"]
+        if len(timestamps) == 0: return
+        progress = self.file_progress.setdefault((block["ASSET_ID"], block["PROPERTY_ID"]), [int(timestamps[0]), int(timestamps[-1])])
+        progress[0], progress[1] = min(progress[0], int(timestamps[0])), max(progress[1], int(timestamps[-1]))
+
+    def file_completed(self, file_name: str, progress: Dict[Tuple[str, str], List[int]], uploaded: bool = False) -> None:
+        if self.checkpoints is not None: self.checkpoints.file_closed(file_name, progress, uploaded)
+        if self.on_file_completed is not None: self.on_file_completed(file_name)
+
+    def open_file(self) -> None:
+        raise NotImplementedError
+
+    def write_block(self, block: Dict) -> None:
+        raise NotImplementedError
+
+    def close_file(self) -> None:
+        raise NotImplementedError
+
+    def write(self, block: Dict) -> None:
+        length = get_block_length(block)
+        offset = 0
+        while offset < length:
+            if self.file is None: self.open_file()
+            # Only take as many rows as still fit in the current file
+            count = min(self.rows_per_file - self.file_rows, length - offset)
+            rows = slice_block(block, offset, offset + count) if count < length else block
+            self.write_block(rows)
+            if self.checkpoints is not None: self.track_progress(rows)
+            self.file_rows += count
+            offset += count
+            if self.file_rows == self.rows_per_file: self.close_file()
+
+    def close(self) -> None:
+        self.close_file()
+
+class CsvFileWriter(FileWriter):
+    """Writes import-ready CSV files"""
+
+    extension = 'csv'
+
+    def open_file(self) -> None:
+        self.file = open(f'{self.directory}/{self.next_file_name()}', 'w', encoding='UTF8', newline='', buffering=WRITE_BUFFER_BYTES)
+
+    def write_block(self, block: Dict) -> None:
+        self.write_text(format_csv_rows(block, self.column_names))
+
+    def write_text(self, text: str) -> None:
+        self.file.write(text)
+
+    def close_file(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.file_completed(self.file_name, self.file_progress)
+            self.file_progress = {}
+            report(f'\t{self.file_name} file created', 'file_created', file_name=self.file_name)
+
+class GzipCsvFileWriter(CsvFileWriter):
+    """Writes gzip-compressed CSV files"""
+
+    extension = 'csv.gz'
+
+    def open_file(self) -> None:
+        # Level 6 keeps most of the size reduction at a fraction of the CPU time of level 9
+        self.file = gzip.open(f'{self.directory}/{self.next_file_name()}', 'wt', compresslevel=6, encoding='UTF8', newline='')
+
+class ParquetFileWriter(FileWriter):
+    """Writes Parquet files with dictionary-encoded id and string columns
+
+    Blocks are buffered and written as row groups of row_group_rows rows.
+    """
+
+    extension = 'parquet'
+
+    def __init__(self, directory: str, rows_per_file: int, file_prefix: str = 'historical_data', column_names: List[str] = COLUMN_NAMES,
+                 row_group_rows: int = 1000000) -> None:
+        super().__init__(directory, rows_per_file, file_prefix, column_names)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('The parquet output format requires pyarrow, install it with: pip install pyarrow')
+        self.pa = pa
+        self.pq = pq
+        self.row_group_rows = row_group_rows
+        self.buffered = []
+        self.buffered_rows = 0
+        string = pa.dictionary(pa.int32(), pa.string())
+        column_types = {'ASSET_ID': string, 'PROPERTY_ID': string, 'DATA_TYPE': string, 'TIMESTAMP_SECONDS': pa.int64(),
+                        'TIMESTAMP_NANO_OFFSET': pa.int32(), 'QUALITY': string, 'VALUE': pa.float64()}
+        self.schema = pa.schema([(name, column_types[name]) for name in column_names])
+
+    def open_file(self) -> None:
+        dictionary_columns = [field.name for field in self.schema if self.pa.types.is_dictionary(field.type)]
+        # Regularly sampled timestamps shrink to almost nothing with delta encoding
+        column_encoding = {'TIMESTAMP_SECONDS': 'DELTA_BINARY_PACKED'} if 'TIMESTAMP_SECONDS' in self.column_names else None
+        self.file = self.pq.ParquetWriter(f'{self.directory}/{self.next_file_name()}', self.schema, compression='zstd',
+                                          use_dictionary=dictionary_columns, column_encoding=column_encoding)
+
+    def to_arrow(self, name: str, column, length: int):
+        data_type = self.schema.field(name).type
+        if isinstance(column, np.ndarray):
+            return self.pa.array(column).cast(data_type)
+        if self.pa.types.is_dictionary(data_type):
+            # A constant string is stored once with all rows pointing at it
+            return self.pa.DictionaryArray.from_arrays(np.zeros(length, dtype=np.int32), self.pa.array([column], self.pa.string()))
+        return self.pa.array(np.full(length, column)).cast(data_type)
+
+    def write_block(self, block: Dict) -> None:
+        length = get_block_length(block)
+        self.buffered.append(self.pa.table([self.to_arrow(name, block[name], length) for name in self.column_names], schema=self.schema))
+        self.buffered_rows += length
+        if self.buffered_rows >= self.row_group_rows: self.flush()
+
+    def flush(self) -> None:
+        if self.buffered_rows == 0: return
+        self.file.write_table(self.pa.concat_tables(self.buffered), row_group_size=self.row_group_rows)
+        self.buffered = []
+        self.buffered_rows = 0
+
+    def close_file(self) -> None:
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+            self.file_completed(self.file_name, self.file_progress)
+            self.file_progress = {}
+            report(f'\t{self.file_name} file created', 'file_created', file_name=self.file_name)
+
+OUTPUT_WRITERS = {
+    'csv': CsvFileWriter,
+    'csv.gz': GzipCsvFileWriter,
+    'parquet': ParquetFileWriter
+}
+
+class S3StreamWriter(CsvFileWriter):
+    """Streams CSV rows straight into S3 multipart uploads instead of local files
+
+    Parts are handed to uploader threads through a bounded queue, so generation blocks
+    once max_queued_parts parts are waiting and memory use stays flat.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str, rows_per_file: int, file_prefix: str = 'historical_data',
+                 column_names: List[str] = COLUMN_NAMES, part_size: int = 8 * 1024 * 1024, max_queued_parts: int = 8,
+                 concurrency: int = 4) -> None:
+        super().__init__(None, rows_per_file, file_prefix, column_names)
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.part_num = 0
+        self.uploads = []
+        self.lock = threading.Lock()
+        self.error = None
+        self.parts = queue.Queue(maxsize=max_queued_parts)
+        self.threads = [threading.Thread(target=self.upload_parts, daemon=True) for _ in range(concurrency)]
+        for thread in self.threads: thread.start()
+
+    def open_file(self) -> None:
+        if self.error is not None: raise self.error
+        file_name = self.next_file_name()
+        self.file_name = f'{self.prefix}{file_name}'
+        response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.file_name)
+        # The current upload; part_count stays None until all of its parts are queued
+        self.file = {'key': self.file_name, 'file_name': file_name, 'upload_id': response["UploadId"], 'etags': {}, 'part_count': None,
+                     'completed': False, 'progress': None}
+        self.uploads.append(self.file)
+        self.part_num = 0
+
+    def write_text(self, text: str) -> None:
+        self.buffer += text.encode('UTF8')
+        # Every part but the last must be at least 5 MB
+        if len(self.buffer) >= self.part_size: self.queue_part()
+
+    def queue_part(self) -> None:
+        self.part_num += 1
+        # Time spent here is generation waiting for the uploader threads
+        with stats.timer('wait_for_upload'):
+            self.parts.put((self.file, self.part_num, bytes(self.buffer)))
+        self.buffer = bytearray()
+
+    def close_file(self) -> None:
+        if self.file is None: return
+        if len(self.buffer) > 0 or self.part_num == 0: self.queue_part()
+        upload = self.file
+        upload['progress'] = self.file_progress
+        self.file_progress = {}
+        with self.lock:
+            upload['part_count'] = self.part_num
+            ready = len(upload['etags']) == upload['part_count']
+        if ready: self.complete_upload(upload)
+        self.file = None
+
+    def upload_parts(self) -> None:
+        while True:
+            item = self.parts.get()
+            if item is None: break
+            upload, part_num, body = item
+            try:
+                if self.error is None:
+                    with stats.timer('upload_part'):
+                        response = self.s3_client.upload_part(Bucket=self.bucket, Key=upload['key'], UploadId=upload['upload_id'], PartNumber=part_num, Body=body)
+                    stats.count('uploaded_bytes', len(body))
+                    with self.lock:
+                        upload['etags'][part_num] = response["ETag"]
+                        ready = len(upload['etags']) == upload['part_count']
+                    # Whichever thread uploads the last outstanding part completes the object
+                    if ready: self.complete_upload(upload)
+            except Exception as e:
+                self.error = self.error or e
+            finally:
+                self.parts.task_done()
+
+    def complete_upload(self, upload: Dict) -> None:
+        parts = [{'ETag': etag, 'PartNumber': part_num} for part_num, etag in sorted(upload['etags'].items())]
+        self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=upload['key'], UploadId=upload['upload_id'], MultipartUpload={'Parts': parts})
+        upload['completed'] = True
+        # A streamed file is generated and uploaded at once
+        self.file_completed(upload['file_name'], upload['progress'], uploaded=True)
+        report(f'\ts3://{self.bucket}/{upload["key"]} object uploaded', 'object_uploaded', key=upload["key"])
+
+    def close(self) -> None:
+        try:
+            if self.error is None: self.close_file()
+        finally:
+            for _ in self.threads: self.parts.put(None)
+            for thread in self.threads: thread.join()
+        if self.error is not None:
+            # Do not leave incomplete multipart uploads behind
+            for upload in self.uploads:
+                if not upload['completed']:
+                    self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=upload['key'], UploadId=upload['upload_id'])
+            raise self.error
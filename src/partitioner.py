@@ -0,0 +1,72 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+from typing import List, Dict
+
+# Characters of a CSV row besides the ids and the value:
+# DOUBLE + 10 digit timestamp + nano offset + GOOD + 6 separators + line terminator
+FIXED_ROW_BYTES = 6 + 10 + 1 + 4 + 6 + 2
+
+def estimate_row_bytes(asset_id: str, property_id: str, value_bytes: int) -> int:
+    return len(asset_id) + len(property_id) + value_bytes + FIXED_ROW_BYTES
+
+def count_rows(series: Dict, start: int, end: int) -> int:
+    # Number of samples of the series in [start, end), with start on the sampling grid
+    interval = series["interval"]
+    return max(0, -((start - end) // interval))
+
+def next_sample(series: Dict, timestamp: int) -> int:
+    # First sample of the series at or after timestamp
+    interval = series["interval"]
+    return series["from"] + -((series["from"] - timestamp) // interval) * interval
+
+def plan_files(series_list: List[Dict], max_rows: int, target_bytes: int, window_seconds: int) -> List[Dict]:
+    """Packs time series into files of at most max_rows rows and about target_bytes bytes
+
+    Each series is a dict with property_idx, asset_id, property_id, from, to (exclusive),
+    interval and row_bytes. Series are kept in order and only cut at multiples of
+    window_seconds, unless a single window does not fit into an empty file.
+    """
+    files = []
+    current = None
+    for series in series_list:
+        start = series["from"]
+        while start < series["to"]:
+            if current is None:
+                current = {'file_num': len(files) + 1, 'rows': 0, 'bytes': 0, 'segments': []}
+                files.append(current)
+            capacity = min(max_rows - current["rows"], (target_bytes - current["bytes"]) // series["row_bytes"])
+            end = series["to"]
+            if count_rows(series, start, end) > capacity:
+                # Cut at the last window boundary that still fits into the file
+                end = (start + capacity * series["interval"]) // window_seconds * window_seconds
+                if end <= start:
+                    if current["rows"] > 0:
+                        current = None
+                        continue
+                    # A single window is larger than a file, so cut it on the row budget
+                    end = start + max(capacity, 1) * series["interval"]
+            rows = count_rows(series, start, end)
+            current["segments"].append({
+                'property_idx': series["property_idx"],
+                'asset_id': series["asset_id"],
+                'property_id': series["property_id"],
+                'from': start,
+                'to': start + (rows - 1) * series["interval"],
+                'rows': rows
+            })
+            current["rows"] += rows
+            current["bytes"] += rows * series["row_bytes"]
+            start = next_sample(series, end)
+            if current["rows"] >= max_rows or current["bytes"] + series["row_bytes"] > target_bytes:
+                current = None
+    return files
+
+def write_manifest(files: List[Dict], manifest_path: str) -> None:
+    manifest_dir = os.path.dirname(manifest_path)
+    if not os.path.exists(manifest_dir): os.makedirs(manifest_dir)
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(files, f, indent=2)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
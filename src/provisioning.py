@@ -0,0 +1,305 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Optional
+from id_registry import IdRegistry
+from instrumentation import progress, report, stats
+
+def get_properties_schema_file_name(model_name: str) -> str:
+    # file name -> sample_stamping_press_properties.json for the model: Sample_Stamping Press
+    return '_'.join(model_name.lower().split())+"_properties.json"
+
+def load_properties_schema(schema_dir: str, model_name: str) -> List[Dict]:
+    properties_schema_file_name = get_properties_schema_file_name(model_name)
+    properties_schema_file_path = f'{schema_dir}/{properties_schema_file_name}'
+    # Load schema if existing
+    if not os.path.exists(properties_schema_file_path): return []
+    with open(properties_schema_file_path, 'r') as file:
+        return json.load(file)
+
+def get_asset_levels(assets: List[Dict]) -> List[List[Dict]]:
+    # Walk the association DAG from the top-level assets, one level per depth
+    assets_by_name = {asset["name"]: asset for asset in assets}
+    child_names = {child for asset in assets for child in (asset["associated_assets"] or [])}
+    levels = []
+    level = [asset for asset in assets if asset["name"] not in child_names]
+    visited = {asset["name"] for asset in level}
+    while len(level) > 0:
+        levels.append(level)
+        # Children are marked as they are added, so a child of several parents is only created once
+        next_level = []
+        for asset in level:
+            for child in (asset["associated_assets"] or []):
+                if child in visited: continue
+                visited.add(child)
+                next_level.append(assets_by_name[child])
+        level = next_level
+    if len(visited) != len(assets):
+        unreachable = [asset["name"] for asset in assets if asset["name"] not in visited]
+        raise ValueError(f'Assets not reachable from a top-level asset: {unreachable}')
+    return levels
+
+def wait_for(is_done: Callable[[], bool], min_poll_secs: float = 0.2, max_poll_secs: float = 5) -> None:
+    # Checks are rate limited by the client, so polling starts short and backs off while waiting
+    poll_secs = min_poll_secs
+    while not is_done():
+        with stats.timer('poll_wait'):
+            time.sleep(poll_secs)
+        poll_secs = min(poll_secs * 2, max_poll_secs)
+
+def is_active(status: Optional[Dict]) -> bool:
+    return status is not None and status["state"] == 'ACTIVE'
+
+def is_deleted(status: Optional[Dict]) -> bool:
+    # Deleted resources drop out of the list results
+    return status is None
+
+class SiteWiseEngine:
+    """Runs SiteWise calls from a thread pool and polls resource states in batches
+
+    Calls are rate limited by the token bucket of their operation in the client, see aws_clients.
+    """
+
+    def __init__(self, client, id_registry: IdRegistry, concurrency: int = 8, min_poll_secs: float = 0.2, max_poll_secs: float = 10) -> None:
+        self.client = client
+        self.id_registry = id_registry
+        self.concurrency = concurrency
+        self.min_poll_secs = min_poll_secs
+        self.max_poll_secs = max_poll_secs
+
+    def call(self, operation: str, **kwargs) -> Dict:
+        return getattr(self.client, operation)(**kwargs)
+
+    def list_all(self, operation: str, result_key: str, **kwargs) -> List[Dict]:
+        response = self.call(operation, maxResults=250, **kwargs)
+        results = response[result_key]
+        while 'nextToken' in response:
+            response = self.call(operation, maxResults=250, nextToken=response['nextToken'], **kwargs)
+            results = results + response[result_key]
+        return results
+
+    def list_model_statuses(self) -> Dict[str, Dict]:
+        return {model["id"]: model["status"] for model in self.list_all('list_asset_models', 'assetModelSummaries')}
+
+    def list_asset_statuses(self, model_ids: set) -> Dict[str, Dict]:
+        # One paginated listing per model covers every asset of that model
+        statuses = {}
+        for model_id in model_ids:
+            for asset in self.list_all('list_assets', 'assetSummaries', assetModelId=model_id):
+                statuses[asset["id"]] = asset["status"]
+        return statuses
+
+    def wait_until(self, pending_ids: set, list_statuses, is_done) -> None:
+        # Statuses are checked before the first sleep, resources are often done by the time a batch is submitted
+        poll_secs = self.min_poll_secs
+        while len(pending_ids) > 0:
+            with stats.timer('list_statuses'):
+                statuses = list_statuses()
+            for resource_id in list(pending_ids):
+                status = statuses.get(resource_id)
+                if status is not None and status["state"] == 'FAILED':
+                    raise RuntimeError(f'{resource_id} failed: {status.get("error")}')
+                if is_done(status): pending_ids.remove(resource_id)
+            if len(pending_ids) == 0: break
+            with stats.timer('poll_wait'):
+                time.sleep(poll_secs)
+            poll_secs = min(poll_secs * 2, self.max_poll_secs)
+
+class ProvisioningEngine(SiteWiseEngine):
+    """Creates asset models, assets and associations concurrently
+
+    Creates are submitted from a thread pool and their ACTIVE state is checked for the
+    whole batch at once through the list APIs. Assets are created level by level, and
+    each level is associated with its parents while the next level is being created.
+    """
+
+    def __init__(self, client, id_registry: IdRegistry, schema_dir: str, **kwargs) -> None:
+        super().__init__(client, id_registry, **kwargs)
+        self.schema_dir = schema_dir
+
+    def wait_for_models(self, model_ids: List[str]) -> None:
+        self.wait_until(set(model_ids), self.list_model_statuses, is_active)
+
+    def wait_for_assets(self, assets: List[Dict]) -> None:
+        model_ids = {self.id_registry.get_model_id(asset["model"]) for asset in assets}
+        asset_ids = {self.id_registry.get_asset_id(asset["name"]) for asset in assets}
+        self.wait_until(asset_ids, lambda: self.list_asset_statuses(model_ids), is_active)
+
+    def create_asset_model(self, model: Dict) -> str:
+        model_name = model["name"]
+        response = self.call('create_asset_model', assetModelName=model_name,
+                             assetModelProperties=load_properties_schema(self.schema_dir, model_name))
+        asset_model_id = response["assetModelId"]
+        report(f"\tCreated name: {model_name}, id: {asset_model_id}", 'model_created', name=model_name, id=asset_model_id)
+        self.id_registry.set_model_id(model_name, asset_model_id)
+        return asset_model_id
+
+    def update_asset_model(self, model: Dict) -> str:
+        model_name = model["name"]
+        model_id = self.id_registry.get_model_id(model_name)
+        model_hierarchies = [{'name': child_model_name, 'childAssetModelId': self.id_registry.get_model_id(child_model_name)}
+                             for child_model_name in (model["children"] or [])]
+        # Existing properties are referenced by their external id
+        properties_schema = [dict(property, id=f"externalId:{property['externalId']}")
+                             for property in load_properties_schema(self.schema_dir, model_name)]
+        self.call('update_asset_model', assetModelId=model_id, assetModelName=model_name,
+                  assetModelProperties=properties_schema, assetModelHierarchies=model_hierarchies)
+        return model_id
+
+    def store_hierarchies(self, model: Dict) -> None:
+        model_name = model["name"]
+        response = self.call('describe_asset_model', assetModelId=self.id_registry.get_model_id(model_name), excludeProperties=True)
+        for hierarchy in response["assetModelHierarchies"]:
+            self.id_registry.set_hierarchy_id(model_name, hierarchy["childAssetModelId"], hierarchy["id"])
+
+    def create_asset(self, asset: Dict) -> str:
+        asset_name = asset["name"]
+        response = self.call('create_asset', assetName=asset_name, assetModelId=self.id_registry.get_model_id(asset["model"]))
+        asset_id = response["assetId"]
+        report(f"\tCreated name: {asset_name}, id: {asset_id}", 'asset_created', name=asset_name, id=asset_id)
+        self.id_registry.set_asset_id(asset_name, asset_id)
+        return asset_id
+
+    def associate_children(self, asset: Dict, asset_model_names: Dict[str, str]) -> None:
+        # Children of one parent are associated in turn to avoid conflicting updates of the parent
+        asset_id = self.id_registry.get_asset_id(asset["name"])
+        for child_asset_name in (asset["associated_assets"] or []):
+            child_asset_model_id = self.id_registry.get_model_id(asset_model_names[child_asset_name])
+            hierarchy_id = self.id_registry.get_hierarchy_id(asset["model"], child_asset_model_id)
+            self.call('associate_assets', assetId=asset_id, hierarchyId=hierarchy_id,
+                      childAssetId=self.id_registry.get_asset_id(child_asset_name))
+
+    def create_asset_models(self, asset_models: List[Dict]) -> None:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            model_ids = list(executor.map(self.create_asset_model, asset_models))
+        self.wait_for_models(model_ids)
+        print(f"\t\t{len(model_ids)} asset models ACTIVE")
+
+    def update_asset_models(self, asset_models: List[Dict]) -> None:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            model_ids = list(executor.map(self.update_asset_model, asset_models))
+            self.wait_for_models(model_ids)
+            list(executor.map(self.store_hierarchies, asset_models))
+
+    def create_assets(self, assets: List[Dict]) -> None:
+        asset_model_names = {asset["name"]: asset["model"] for asset in assets}
+        associations = []
+        with progress('Creating assets', len(assets), 'assets') as progress_bar, ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            levels = get_asset_levels(assets)
+            for depth, level in enumerate(levels):
+                list(executor.map(self.create_asset, level))
+                self.wait_for_assets(level)
+                progress_bar.update(len(level))
+                report(f"\t\tLevel {depth + 1}: {len(level)} assets ACTIVE")
+                if depth > 0:
+                    # Parents and children are both ACTIVE, associate them while the next level is created
+                    associations += [executor.submit(self.associate_children, parent, asset_model_names) for parent in levels[depth - 1]]
+            for association in associations: association.result()
+
+    def provision(self, assets_models_config: Dict) -> None:
+        print('Creating asset models..')
+        self.create_asset_models(assets_models_config["asset_models"])
+        print('All asset models created!')
+        print('Updating asset models with hierarchy definitions..')
+        self.update_asset_models(assets_models_config["asset_models"])
+        print('All asset models updated!')
+        print('Creating assets and asset associations..')
+        self.create_assets(assets_models_config["assets"])
+        print('All assets created and associated!')
+
+class TeardownEngine(SiteWiseEngine):
+    """Removes the asset hierarchy bottom-up with concurrent calls
+
+    Each level is disassociated from its parents and deleted before the level above it,
+    and deletes are confirmed by polling the list APIs instead of sleeping. Ids are
+    dropped from the registry once deleted, so an interrupted teardown resumes where it
+    stopped.
+    """
+
+    def ignore_missing(self, operation: str, tolerated_codes: List[str], **kwargs) -> None:
+        from botocore.exceptions import ClientError
+        try:
+            self.call(operation, **kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in tolerated_codes: raise
+
+    def disassociate_children(self, asset: Dict, asset_model_names: Dict[str, str]) -> None:
+        asset_id = self.id_registry.get_asset_id(asset["name"])
+        if asset_id is None: return
+        for child_asset_name in (asset["associated_assets"] or []):
+            child_asset_id = self.id_registry.get_asset_id(child_asset_name)
+            if child_asset_id is None: continue
+            child_asset_model_id = self.id_registry.get_model_id(asset_model_names[child_asset_name])
+            hierarchy_id = self.id_registry.get_hierarchy_id(asset["model"], child_asset_model_id)
+            self.disassociate_child(asset_id, hierarchy_id, child_asset_id)
+
+    def is_associated(self, asset_id: str, hierarchy_id: str, child_asset_id: str) -> bool:
+        children = self.list_all('list_associated_assets', 'assetSummaries', assetId=asset_id, hierarchyId=hierarchy_id, traversalDirection='CHILD')
+        return any(child["id"] == child_asset_id for child in children)
+
+    def disassociate_child(self, asset_id: str, hierarchy_id: str, child_asset_id: str) -> None:
+        from botocore.exceptions import ClientError
+        try:
+            self.call('disassociate_assets', assetId=asset_id, hierarchyId=hierarchy_id, childAssetId=child_asset_id)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == 'ResourceNotFoundException': return
+            # An earlier, interrupted run may already have disassociated the child. Other invalid
+            # requests, e.g. with a wrong hierarchy id, are raised, the listing fails for those too
+            if code != 'InvalidRequestException' or self.is_associated(asset_id, hierarchy_id, child_asset_id): raise
+
+    def delete_asset(self, asset: Dict) -> None:
+        self.ignore_missing('delete_asset', ['ResourceNotFoundException'], assetId=self.id_registry.get_asset_id(asset["name"]))
+
+    def delete_assets(self, assets: List[Dict]) -> None:
+        asset_model_names = {asset["name"]: asset["model"] for asset in assets}
+        levels = get_asset_levels(assets)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for depth in reversed(range(len(levels))):
+                level = [asset for asset in levels[depth] if self.id_registry.get_asset_id(asset["name"]) is not None]
+                if depth > 0:
+                    list(executor.map(lambda parent: self.disassociate_children(parent, asset_model_names), levels[depth - 1]))
+                list(executor.map(self.delete_asset, level))
+                model_ids = {self.id_registry.get_model_id(asset["model"]) for asset in level}
+                asset_ids = {self.id_registry.get_asset_id(asset["name"]) for asset in level}
+                self.wait_until(asset_ids, lambda: self.list_asset_statuses(model_ids), is_deleted)
+                for asset in level: self.id_registry.remove_asset_id(asset["name"])
+                print(f"\t\tLevel {depth + 1}: {len(level)} assets deleted")
+
+    def remove_hierarchy(self, model: Dict) -> str:
+        model_id = self.id_registry.get_model_id(model["name"])
+        self.call('update_asset_model', assetModelId=model_id, assetModelName=model["name"])
+        return model_id
+
+    def remove_hierarchies(self, asset_models: List[Dict]) -> None:
+        asset_models = [model for model in asset_models if self.id_registry.get_model_id(model["name"]) is not None]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            model_ids = list(executor.map(self.remove_hierarchy, asset_models))
+        self.wait_until(set(model_ids), self.list_model_statuses, is_active)
+
+    def delete_asset_model(self, model: Dict) -> str:
+        model_id = self.id_registry.get_model_id(model["name"])
+        self.ignore_missing('delete_asset_model', ['ResourceNotFoundException'], assetModelId=model_id)
+        return model_id
+
+    def delete_asset_models(self, asset_models: List[Dict]) -> None:
+        asset_models = [model for model in asset_models if self.id_registry.get_model_id(model["name"]) is not None]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            model_ids = list(executor.map(self.delete_asset_model, asset_models))
+        self.wait_until(set(model_ids), self.list_model_statuses, is_deleted)
+        for model in asset_models: self.id_registry.remove_model_id(model["name"])
+
+    def teardown(self, assets_models_config: Dict) -> None:
+        print('\nRemoving asset associations and deleting assets..')
+        self.delete_assets(assets_models_config["assets"])
+        print('All assets deleted!')
+        print('\nRemoving hierarchy definitions from models..')
+        self.remove_hierarchies(assets_models_config["asset_models"])
+        print('All hierarchy definitions removed!')
+        print('\nDeleting asset models..')
+        self.delete_asset_models(assets_models_config["asset_models"])
+        print('All asset models deleted!')
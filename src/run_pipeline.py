@@ -0,0 +1,268 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import asyncio
+import contextlib
+import copy
+import multiprocessing
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional
+import create_asset_hierarchy as hierarchy
+import create_bulk_import_job as bulk_import
+import simulate_historical_data as simulation
+import upload_to_s3 as upload
+from aws_clients import print_metrics, use_clients
+from configs import load_config
+from id_registry import IdRegistry
+from instrumentation import finish_run, log_event, report, start_run, stats
+from sitewise_stub import StubSiteWiseClient
+
+if TYPE_CHECKING: from boto3.s3.transfer import TransferConfig
+
+LOCAL_BUCKET = 'local-pipeline-bucket'
+STAGES = ['provision', 'generate', 'upload', 'import']
+
+class Pipeline:
+    """Provisions assets, generates data, uploads it and imports it, with the stages overlapping
+
+    Generated files are uploaded as soon as they are written and jobs are created as soon as their
+    objects land, so the end-to-end time approaches that of the slowest stage rather than the sum
+    of all stages. Stages are connected by bounded queues: generation pauses while max_queued_files
+    files wait for upload, and uploads pause while max_queued_objects objects wait for a job.
+    Blocking calls run in a thread pool per stage, sized to its concurrency limit. Files are written
+    to data_dir and uploads recorded in the manifest at manifest_path.
+    """
+
+    def __init__(self, assets_models_config: Dict, data_simulation_config: Dict, bulk_import_config: Dict, generate_workers: Optional[int] = None,
+                 upload_concurrency: Optional[int] = None, provision: bool = True, discover: Optional[Callable[[], List[Dict]]] = None,
+                 data_dir: str = simulation.data_dir, manifest_path: str = upload.manifest_path) -> None:
+        self.assets_models_config = assets_models_config
+        self.data_simulation_config = data_simulation_config
+        self.bulk_import_config = bulk_import_config
+        self.pipeline_config = bulk_import_config["pipeline"]
+        self.generate_workers = generate_workers if generate_workers is not None else self.pipeline_config["generate_workers"]
+        self.upload_concurrency = upload_concurrency if upload_concurrency is not None else bulk_import_config["upload"]["concurrency"]
+        self.provision = provision
+        self.data_dir = data_dir
+        self.manifest_path = manifest_path
+        self.discover = discover or (lambda: simulation.get_properties_list(assets_models_config, data_simulation_config, refresh=provision))
+        self.job_manager = bulk_import.create_job_manager(bulk_import_config)
+        self.executors = {stage: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=stage)
+                          for stage, workers in [('provision', 1), ('generate', 2), ('upload', self.upload_concurrency), ('import', 1)]}
+        # Written by the generator processes and forwarded onto the upload queue. A manager queue can be handed
+        # to them as an argument, which also works when processes are spawned rather than forked
+        self.manager = multiprocessing.Manager()
+        self.completed_files = self.manager.Queue(maxsize=self.pipeline_config["max_queued_files"])
+        self.files: Optional[asyncio.Queue] = None
+        self.objects: Optional[asyncio.Queue] = None
+        self.start_time = None
+        self.timeline: Dict[str, List[float]] = {}
+        self.uploaded_bytes = 0
+        self.failed_keys = []
+
+    async def run_in(self, stage: str, function: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executors[stage], function, *args)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        # Start and end of each stage relative to the start of the pipeline, to show how they overlap
+        self.timeline[name] = [time.perf_counter() - self.start_time, None]
+        with stats.timer(f'stage_{name}'):
+            yield
+        self.timeline[name][1] = time.perf_counter() - self.start_time
+        log_event('stage_finished', stage=name, started=round(self.timeline[name][0], 3), finished=round(self.timeline[name][1], 3))
+
+    async def provision_assets(self) -> List[Dict]:
+        with self.stage('provision'):
+            if self.provision:
+                print('Creating the asset hierarchy..')
+                await self.run_in('provision', hierarchy.start, True, self.pipeline_config["provision_concurrency"],
+                                  False, False, self.assets_models_config, self.bulk_import_config)
+            print('Retrieving list of configured asset properties..')
+            properties = await self.run_in('provision', self.discover)
+        print(f'Retrieved asset properties: {len(properties)}')
+        return properties
+
+    async def generate(self, properties: List[Dict]) -> None:
+        data_simulation_config = self.data_simulation_config
+        date_range = data_simulation_config["date_range"]
+        print(f'Generating simulated data between {date_range["from"]} and {date_range["to"]}..')
+        with self.stage('generate'):
+            try:
+                await self.run_in('generate', simulation.generate_historical_data, properties, data_simulation_config, self.bulk_import_config,
+                                  data_simulation_config.get("seed"), self.generate_workers, False, 'csv', None, self.data_dir, self.completed_files)
+            finally:
+                await self.run_in('generate', self.completed_files.put, None)
+
+    async def forward_files(self) -> None:
+        while True:
+            file_name = await self.run_in('generate', self.completed_files.get)
+            if file_name is None: break
+            await self.files.put(file_name)
+        for _ in range(self.upload_concurrency): await self.files.put(None)
+
+    async def upload_files(self, s3_client, transfer_config: 'TransferConfig', manifest: Dict[str, Dict]) -> None:
+        data_config = self.bulk_import_config["data"]
+        s3_bucket, prefix = data_config["bucket"], data_config["prefix"]
+        while True:
+            file_name = await self.files.get()
+            if file_name is None: break
+            s3_key = f'{prefix}{file_name}'
+            try:
+                # The generation progress bar is shown meanwhile, so uploads do not report their bytes to it
+                uploaded = await self.run_in('upload', upload.upload_file, s3_client, f'{self.data_dir}/{file_name}', s3_bucket, s3_key, transfer_config, None)
+            except Exception as e:
+                # Later files are still uploaded and imported, the failed ones are reported at the end
+                report(f'\tFailed to upload {s3_key}: {e}', 'upload_failed', key=s3_key, error=str(e))
+                self.failed_keys.append(s3_key)
+                continue
+            with stats.timer('record_upload'):
+                manifest[f'{s3_bucket}/{s3_key}'] = uploaded
+                upload.save_manifest(manifest, self.manifest_path)
+            self.uploaded_bytes += uploaded["size"]
+            stats.count('uploaded_bytes', uploaded["size"])
+            report(f'\t{s3_key} uploaded', 'file_uploaded', key=s3_key, size=uploaded["size"])
+            await self.objects.put({'key': s3_key, 'size': uploaded["size"]})
+
+    async def upload(self) -> None:
+        s3_client = upload.get_s3_client(self.upload_concurrency)
+        transfer_config = upload.create_transfer_config(self.bulk_import_config["upload"]["part_size_mb"])
+        manifest = upload.load_manifest(self.manifest_path)
+        with self.stage('upload'):
+            await asyncio.gather(*[self.upload_files(s3_client, transfer_config, manifest) for _ in range(self.upload_concurrency)])
+        await self.objects.put(None)
+
+    def plan_jobs(self, packer, s3_object: Optional[Dict]) -> List[List[str]]:
+        # One file per job, or jobs packed in the order the objects land
+        if s3_object is None: return packer.flush() if packer is not None else []
+        if packer is None: return [[s3_object["key"]]]
+        return packer.add(s3_object["key"], s3_object["size"])
+
+    async def import_objects(self) -> None:
+        """Puts the uploaded objects into jobs, submits them and polls their status until all are finished
+
+        Objects are taken as they land, between polls. Jobs wait in the job manager's queue
+        while SiteWise is at its limit of concurrent jobs.
+        """
+        manager = self.job_manager
+        packer, uploads_done = None, False
+        next_poll = time.monotonic()
+        with self.stage('import'):
+            while not uploads_done or len(manager.active) > 0 or len(manager.queued) > 0:
+                timeout = max(next_poll - time.monotonic(), 0)
+                if not uploads_done:
+                    try:
+                        s3_object = await asyncio.wait_for(self.objects.get(), timeout)
+                    except asyncio.TimeoutError:
+                        # Nothing landed before the poll is due
+                        s3_object = False
+                    if s3_object is not False:
+                        uploads_done = s3_object is None
+                        if self.bulk_import_config["job"]["pack_jobs"] and packer is None and not uploads_done:
+                            packer = await self.run_in('import', bulk_import.create_packer, self.bulk_import_config, s3_object["key"])
+                        manager.queue_jobs(self.plan_jobs(packer, s3_object))
+                        # Submit in batches, so the submissions of a batch still run concurrently
+                        if len(manager.queued) >= manager.submit_concurrency or uploads_done: await self.run_in('import', manager.submit_queued)
+                        continue
+                else:
+                    await asyncio.sleep(timeout)
+                submitted = await self.run_in('import', manager.submit_queued)
+                finished = await self.run_in('import', manager.check_finished)
+                next_poll = time.monotonic() + manager.next_poll_secs(finished > 0 or submitted > 0)
+            await self.run_in('import', bulk_import.retry_failed_jobs, manager)
+
+    async def run(self) -> None:
+        self.start_time = time.perf_counter()
+        self.files = asyncio.Queue(maxsize=self.pipeline_config["max_queued_files"])
+        self.objects = asyncio.Queue(maxsize=self.pipeline_config["max_queued_objects"])
+        try:
+            properties = await self.provision_assets()
+            await asyncio.gather(self.generate(properties), self.forward_files(), self.upload(), self.import_objects())
+        finally:
+            for executor in self.executors.values(): executor.shutdown(wait=False)
+            self.manager.shutdown()
+        if len(self.failed_keys) > 0:
+            raise RuntimeError(f'{len(self.failed_keys)} files failed to upload and were not imported: {self.failed_keys[:10]}')
+
+    def print_timeline(self) -> None:
+        wall_secs = time.perf_counter() - self.start_time
+        print(f'\nStages, {wall_secs:.1f} secs end to end:')
+        for name in STAGES:
+            if name not in self.timeline or self.timeline[name][1] is None: continue
+            started, finished = self.timeline[name]
+            print(f'\t{name}: {started:.1f} - {finished:.1f} secs ({finished - started:.1f} secs)')
+        statuses = self.job_manager.statuses
+        print(f'\t{self.uploaded_bytes / 1024 / 1024:.1f} MB uploaded, {len(statuses)} jobs, '
+              f'{sum(1 for status in statuses.values() if status == "COMPLETED")} completed')
+
+def get_local_config(bulk_import_config: Dict) -> Dict:
+    # Data and error reports go to the bucket of the local S3 stand-in
+    local_config = copy.deepcopy(bulk_import_config)
+    local_config["data"]["bucket"] = local_config["job"]["error_bucket"] = LOCAL_BUCKET
+    return local_config
+
+@contextlib.contextmanager
+def local_stand_ins(work_dir: str, latency: float, job_secs: float, max_active_jobs: int) -> Iterator[StubSiteWiseClient]:
+    """Points the scripts at a local S3 stand-in and an in-memory SiteWise stub, with the id registry in work_dir
+
+    Data files and the upload manifest are put in work_dir by passing them to the Pipeline.
+    """
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise ImportError('Running the pipeline locally requires moto, install it with: pip install moto')
+    import boto3
+    saved = hierarchy.id_registry
+    stub = StubSiteWiseClient(latency=latency, job_secs=job_secs, max_active_jobs=max_active_jobs)
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket=LOCAL_BUCKET)
+        # Asset creation runs in a thread of this process, so the registry can be swapped here
+        hierarchy.id_registry = IdRegistry(f'{work_dir}/ids.db')
+        try:
+            with use_clients(iotsitewise=stub, s3=s3_client):
+                yield stub
+        finally:
+            hierarchy.id_registry.close()
+            hierarchy.id_registry = saved
+
+def start(generate_workers: Optional[int] = None, upload_concurrency: Optional[int] = None,
+          provision: bool = True, local: bool = False, latency: float = 0.05, job_secs: float = 5) -> None:
+    configs = [load_config('assets_models'), load_config('data_simulation'), load_config('bulk_import')]
+    if not local:
+        pipeline = Pipeline(*configs, generate_workers, upload_concurrency, provision)
+        asyncio.run(pipeline.run())
+        pipeline.print_timeline()
+        return
+    assets_models_config, data_simulation_config, bulk_import_config = configs
+    bulk_import_config = get_local_config(bulk_import_config)
+    with tempfile.TemporaryDirectory() as work_dir, local_stand_ins(work_dir, latency, job_secs, bulk_import_config["job"]["max_active_jobs"]) as stub:
+        print(f'Running against a local S3 stand-in and a SiteWise stub with {latency * 1000:.0f} ms latency and {job_secs} secs per job..')
+        # Discovery reads the stub directly, so the cache of the real asset properties is left alone
+        pipeline = Pipeline(assets_models_config, data_simulation_config, bulk_import_config, generate_workers, upload_concurrency, True,
+                            lambda: simulation.discover_properties(assets_models_config, data_simulation_config), f'{work_dir}/data',
+                            f'{work_dir}/upload_manifest.json')
+        job_manager = pipeline.job_manager
+        job_manager.min_poll_secs = job_manager.poll_secs = min(job_manager.min_poll_secs, job_secs / 5)
+        asyncio.run(pipeline.run())
+        pipeline.print_timeline()
+        print(f'\tSiteWise stub calls: {dict(stub.calls)}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create the asset hierarchy, then generate, upload and import data with the stages overlapping')
+    bulk_import_config = load_config('bulk_import')
+    parser.add_argument('--workers', type=int, default=bulk_import_config["pipeline"]["generate_workers"], help='number of generator processes')
+    parser.add_argument('--upload-concurrency', type=int, default=bulk_import_config["upload"]["concurrency"], help='number of files uploaded in parallel')
+    parser.add_argument('--skip-provisioning', action='store_true', help='use the asset hierarchy created by an earlier run')
+    parser.add_argument('--local', action='store_true', help='run against a local S3 stand-in and a SiteWise stub, requires moto')
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated SiteWise API latency in seconds with --local')
+    parser.add_argument('--job-secs', type=float, default=5, help='time each simulated bulk import job takes with --local')
+    args = parser.parse_args()
+    start_run('run_pipeline', **vars(args))
+    start(args.workers, args.upload_concurrency, not args.skip_provisioning, args.local, args.latency, args.job_secs)
+    print_metrics()
+    finish_run()
+    print('Script execution successfully completed!!')
@@ -0,0 +1,100 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import zlib
+from typing import Callable, Dict, Tuple, Union
+import numpy as np
+
+# Every random choice that has to agree across blocks (walk anchors, step levels, outages,
+# quality bursts) is a hash of the series key and a time index, so any block can be
+# generated on its own and still line up with its neighbours.
+
+def get_series_key(seed: int, *parts: str) -> int:
+    entropy = [seed] + [zlib.crc32(part.encode()) for part in parts]
+    return int(np.random.SeedSequence(entropy).generate_state(1, np.uint64)[0])
+
+def splitmix64(key: int, idx: np.ndarray) -> np.ndarray:
+    with np.errstate(over='ignore'):
+        z = np.asarray(idx).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64(key)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+def hash_uniform(key: int, idx: np.ndarray) -> np.ndarray:
+    # splitmix64 of key + idx, mapped to [0, 1)
+    return (splitmix64(key, idx) >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+def uniform(timestamps: np.ndarray, config: Dict, signal: Dict, key: int, rng: np.random.Generator, block: Dict) -> np.ndarray:
+    return rng.uniform(config["min"], config["max"], len(timestamps))
+
+def random_walk(timestamps: np.ndarray, config: Dict, signal: Dict, key: int, rng: np.random.Generator, block: Dict) -> np.ndarray:
+    low, high = config["min"], config["max"]
+    # The walk is a Brownian bridge between anchor values at the block boundaries
+    anchors = low + (high - low) * hash_uniform(get_series_key(key, 'anchor'), np.array([block["num"], block["num"] + 1]))
+    steps = rng.normal(0, signal.get("step", (high - low) / 100), len(timestamps))
+    walk = np.concatenate(([0.0], np.cumsum(steps)[:-1]))
+    fraction = (timestamps - block["start"]) / block["seconds"]
+    return anchors[0] + (anchors[1] - anchors[0]) * fraction + walk - fraction * (walk[-1] + steps[-1])
+
+def sine(timestamps: np.ndarray, config: Dict, signal: Dict, key: int, rng: np.random.Generator, block: Dict) -> np.ndarray:
+    center = (config["min"] + config["max"]) / 2
+    amplitude = signal.get("amplitude", (config["max"] - config["min"]) / 2)
+    period = signal.get("period_seconds", 86400)
+    phase = hash_uniform(get_series_key(key, 'phase'), np.array([0]))[0] * period
+    return center + amplitude * np.sin(2 * np.pi * (timestamps + phase) / period)
+
+def step(timestamps: np.ndarray, config: Dict, signal: Dict, key: int, rng: np.random.Generator, block: Dict) -> np.ndarray:
+    # Hold a random level for step_seconds, then jump to the next one
+    levels = hash_uniform(get_series_key(key, 'step'), timestamps // signal.get("step_seconds", 21600))
+    return config["min"] + (config["max"] - config["min"]) * levels
+
+SIGNALS: Dict[str, Callable] = {
+    'uniform': uniform,
+    'random_walk': random_walk,
+    'sine': sine,
+    'step': step
+}
+
+def latent_factor(timestamps: np.ndarray, key: int) -> np.ndarray:
+    # Smooth shared driver in [-1, 1]: a few sinusoids with periods between 2 hours and 7 days
+    params = hash_uniform(key, np.arange(6))
+    periods = 7200 + params[:3] * (604800 - 7200)
+    phases = params[3:] * 2 * np.pi
+    return np.sin(2 * np.pi * timestamps[:, None] / periods + phases).sum(axis=1) / 3
+
+def generate_signal(timestamps: np.ndarray, config: Dict, seed: int, asset_id: str, property_id: str,
+                    rng: np.random.Generator, block: Dict) -> Tuple[np.ndarray, Union[str, np.ndarray], np.ndarray]:
+    """Returns the values, qualities and the timestamps to keep for one block of a property
+
+    block holds the block number, start and length in seconds, and the origin of the date range.
+    """
+    signal = config.get("signal") or {}
+    key = get_series_key(seed, asset_id, property_id)
+    values = SIGNALS[signal.get("type", 'uniform')](timestamps, config, signal, key, rng, block)
+    if "trend_per_day" in signal:
+        values = values + signal["trend_per_day"] * (timestamps - block["origin"]) / 86400
+    if "correlation" in signal:
+        # Properties of one asset that share a group follow the same latent driver
+        correlation = signal["correlation"]
+        center, half_range = (config["min"] + config["max"]) / 2, (config["max"] - config["min"]) / 2
+        latent = latent_factor(timestamps, get_series_key(seed, asset_id, correlation["group"]))
+        weight = correlation.get("weight", 0.8)
+        values = center + weight * half_range * latent + (1 - weight) * (values - center)
+    if "noise" in signal:
+        values = values + rng.normal(0, signal["noise"], len(timestamps))
+    values = np.clip(values, config["min"], config["max"])
+
+    keep = np.ones(len(timestamps), dtype=bool)
+    outages = config.get("outages")
+    if outages is not None:
+        # Drop whole windows of duration_seconds to simulate gaps in the data
+        windows = timestamps // outages["duration_seconds"]
+        keep = hash_uniform(get_series_key(key, 'outage'), windows) >= outages["probability"]
+
+    qualities = 'GOOD'
+    quality = config.get("quality")
+    if quality is not None:
+        draws = hash_uniform(get_series_key(key, 'quality'), timestamps // quality.get("burst_seconds", 600))
+        bad, uncertain = quality.get("bad_probability", 0), quality.get("uncertain_probability", 0)
+        qualities = np.where(draws < bad, 'BAD', np.where(draws < bad + uncertain, 'UNCERTAIN', 'GOOD'))
+    return values, qualities, keep
@@ -1,113 +1,417 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-import random
+import argparse
 import time
-import datetime
 import json
-import csv
+import multiprocessing
 import os
-from typing import List, Dict
-import boto3
-import yaml
+import secrets
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, Dict, Optional, Tuple
+import numpy as np
+from aws_clients import get_client, print_metrics
+from checkpoint_store import CheckpointStore
+from configs import date_to_epoch, load_config
+from instrumentation import add_progress, finish_run, init_worker, progress, run_with_stats, start_run, stats
+from output_writers import OUTPUT_WRITERS, FileWriter, CsvFileWriter, ParquetFileWriter, S3StreamWriter, get_block_length, slice_block
+from partitioner import estimate_row_bytes, plan_files, write_manifest
+from signals import generate_signal
 
-PROFILE_NAME = 'default'
-boto3.setup_default_session(profile_name=PROFILE_NAME)
-client = boto3.client('iotsitewise')
 dir = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.abspath(os.path.dirname(dir))
-config_dir = f'{root_dir}/config'
 data_dir = f'{root_dir}/data'
+archive_dir = f'{root_dir}/archive'
+tmp_dir = f'{root_dir}/tmp'
+properties_cache_path = f'{tmp_dir}/properties_cache.json'
+partition_manifest_path = f'{tmp_dir}/partition_manifest.json'
+checkpoints_db_path = f'{tmp_dir}/checkpoints.db'
 
-# Create data directory if doesn't exist
-if not os.path.exists(data_dir): os.makedirs(data_dir)
+# Number of timestamps generated per property in a single array operation
+BLOCK_ROWS = 50000
 
-# Load assets_models_configuration
-with open(f'{config_dir}/assets_models.yml', 'r') as file:
-    assets_models_config = yaml.safe_load(file)
+def print_json(dict_obj: Dict) -> None:
+    print(json.dumps(dict_obj, indent=2, default=str))
 
-# Load bulk import configuration
-with open(f'{config_dir}/bulk_import.yml', 'r') as file:
-    bulk_import_config = yaml.safe_load(file)
-rows_per_job = bulk_import_config["job"]["rows_per_job"]
+def list_all(operation: str, result_key: str, **kwargs) -> List[Dict]:
+    results = []
+    for page in get_client('iotsitewise').get_paginator(operation).paginate(**kwargs):
+        results.extend(page[result_key])
+    return results
 
-# Load simulation configuration
-with open(f'{config_dir}/data_simulation.yml', 'r') as file:
-    data_simulation_config = yaml.safe_load(file)
-date_range = data_simulation_config["date_range"]
+def get_model_properties(model: Dict) -> List[Dict]:
+    model_name = model["name"]
+    model_id = model["id"]
+    # Get all assets for the model
+    assets = list_all('list_assets', 'assetSummaries', assetModelId=model_id)
+    # Get all properties for the model
+    asset_model_properties = list_all('list_asset_model_properties', 'assetModelPropertySummaries', assetModelId=model_id)
+    # Generate property list for each asset
+    return [{'property_id': property["id"], 'property_name': property["name"], 'asset_id': asset["id"], 'model_name': model_name}
+            for property in asset_model_properties for asset in assets]
 
-def print_json(dict_obj: Dict) -> None:
-    print(json.dumps(dict_obj, indent=2, default=str))
+def discover_properties(assets_models_config: Dict, data_simulation_config: Dict) -> List[Dict]:
+    configured_model_names = {x["name"] for x in assets_models_config["asset_models"]}
+    # Only process models from the config file
+    models = [model for model in list_all('list_asset_models', 'assetModelSummaries') if model["name"] in configured_model_names]
+    with ThreadPoolExecutor(max_workers=data_simulation_config["discovery"]["concurrency"]) as executor:
+        return [property for model_properties in executor.map(get_model_properties, models) for property in model_properties]
 
-def get_properties_list() -> List[Dict]:
-    properties = []
-    res_models = client.list_asset_models(maxResults=100)
-    models = res_models["assetModelSummaries"]
-    for model in models:
-        model_name = model["name"]
-        model_id = model["id"]
-        configured_model_names = [x["name"] for x in assets_models_config["asset_models"]]
-        # Only process models from the config file
-        if model_name in configured_model_names:
-            # Get all assets for the model
-            res_assets = client.list_assets(assetModelId=model_id,maxResults=100)
-            assets = res_assets["assetSummaries"]
-            # Get all properties for the model
-            res_asset_model_properties = client.list_asset_model_properties(assetModelId=model_id,maxResults=100)
-            asset_model_properties = res_asset_model_properties["assetModelPropertySummaries"]
-            # Generate property list for each asset
-            for property in asset_model_properties:
-                for asset in assets:
-                    properties.append({'property_id': property["id"], 'property_name': property["name"], 'asset_id': asset["id"], 'model_name': model_name})
+def load_cached_properties(assets_models_config: Dict, data_simulation_config: Dict) -> Optional[List[Dict]]:
+    if not os.path.exists(properties_cache_path): return None
+    with open(properties_cache_path, 'r') as f:
+        cache = json.load(f)
+    configured_model_names = sorted(x["name"] for x in assets_models_config["asset_models"])
+    # The cache is only valid for the same set of models and within its time to live
+    if cache["model_names"] != configured_model_names or time.time() - cache["created"] > data_simulation_config["discovery"]["cache_ttl_secs"]: return None
+    return cache["properties"]
+
+def save_cached_properties(properties: List[Dict], assets_models_config: Dict) -> None:
+    if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
+    cache = {'created': time.time(), 'model_names': sorted(x["name"] for x in assets_models_config["asset_models"]), 'properties': properties}
+    with open(f'{properties_cache_path}.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(f'{properties_cache_path}.tmp', properties_cache_path)
+
+def get_properties_list(assets_models_config: Dict, data_simulation_config: Dict, refresh: bool = False) -> List[Dict]:
+    properties = None if refresh else load_cached_properties(assets_models_config, data_simulation_config)
+    if properties is not None:
+        print('\tUsing cached asset properties')
+        return properties
+    properties = discover_properties(assets_models_config, data_simulation_config)
+    save_cached_properties(properties, assets_models_config)
     return properties
 
-def generate_historical_data(properties: List[Dict]) -> None:
-    file_num = 0
-    # Configure data range
+def get_epoch_range(date_range: Dict) -> Tuple[int, int]:
+    # The end of the range is exclusive and covers the whole of the last day
+    return date_to_epoch(date_range["from"]), date_to_epoch(date_range["to"]) + 86400
+
+def resolve_seed(seed: Optional[int]) -> int:
+    # Unseeded runs still use one seed throughout, so blocks generated apart line up
+    return seed if seed is not None else secrets.randbits(63)
+
+def get_block_rng(seed: int, property: Dict, block_num: int) -> np.random.Generator:
+    # Derive a stream per property and time block so the values do not depend on generation order
+    entropy = [seed, zlib.crc32(property["asset_id"].encode()), zlib.crc32(property["property_id"].encode()), block_num]
+    return np.random.default_rng(entropy)
+
+def get_simulation_configs(data_simulation_config: Dict) -> Dict[Tuple[str, str], Dict]:
+    # Data is generated at the configured sampling interval, unless a property sets its own
+    default_interval = data_simulation_config.get("sampling_interval_seconds", 60)
+    return {(x["model"], x["name"]): dict(x, sampling_interval_seconds=x.get("sampling_interval_seconds", default_interval))
+            for x in data_simulation_config["properties"]}
+
+def get_sampling_interval(property_simulation_config: Dict) -> int:
+    return property_simulation_config["sampling_interval_seconds"]
+
+def generate_block(property: Dict, property_simulation_config: Dict, block_num: int, from_epoch: int, to_epoch: int, seed: int) -> Dict:
+    interval = get_sampling_interval(property_simulation_config)
+    block_seconds = BLOCK_ROWS * interval
+    block_start = from_epoch + block_num * block_seconds
+    # The whole block is generated even past to_epoch, so extending the date range later leaves earlier values unchanged
+    timestamps = np.arange(block_start, block_start + block_seconds, interval, dtype=np.int64)
+    rng = get_block_rng(seed, property, block_num)
+    block_info = {'num': block_num, 'start': block_start, 'seconds': block_seconds, 'origin': from_epoch}
+    values, qualities, keep = generate_signal(timestamps, property_simulation_config, seed, property["asset_id"], property["property_id"], rng, block_info)
+    keep &= timestamps < to_epoch
+    # Only the timestamp and value columns, and the quality column with quality bursts, vary within a block
+    block = {
+        'ASSET_ID': property["asset_id"],
+        'PROPERTY_ID': property["property_id"],
+        'DATA_TYPE': 'DOUBLE',
+        'TIMESTAMP_SECONDS': timestamps,
+        'TIMESTAMP_NANO_OFFSET': 0,
+        'QUALITY': qualities,
+        'VALUE': values
+    }
+    if keep.all(): return block
+    return {name: column[keep] if isinstance(column, np.ndarray) else column for name, column in block.items()}
+
+def count_samples(start: int, stop: int, grid_start: int, interval: int) -> int:
+    # Timestamps of the sampling grid from grid_start that fall in [start, stop)
+    return max(0, -((grid_start - stop) // interval) + (grid_start - start) // interval)
+
+def get_work_unit_samples(property_simulation_config: Dict, work_unit: Tuple[int, int, int], from_epoch: int, to_epoch: int) -> int:
+    _, block_num, start_epoch = work_unit
+    interval = get_sampling_interval(property_simulation_config)
+    block_start = from_epoch + block_num * BLOCK_ROWS * interval
+    return count_samples(max(block_start, start_epoch), min(block_start + BLOCK_ROWS * interval, to_epoch), block_start, interval)
+
+def count_work_unit_samples(properties: List[Dict], simulation_configs: Dict[Tuple[str, str], Dict], work_units: List[Tuple[int, int, int]],
+                            from_epoch: int, to_epoch: int) -> int:
+    # Progress is measured in samples of the date range, which outages and gaps do not change
+    return sum(get_work_unit_samples(simulation_configs[(properties[work_unit[0]]["model_name"], properties[work_unit[0]]["property_name"])],
+                                     work_unit, from_epoch, to_epoch) for work_unit in work_units)
+
+def create_writer(bulk_import_config: Dict, output_config: Dict, file_prefix: str = 'historical_data', stream: bool = False, output_format: str = 'csv',
+                  incremental: bool = False, data_dir: str = data_dir, completed_files=None) -> FileWriter:
+    writer = create_file_writer(bulk_import_config, output_config, file_prefix, stream, output_format, data_dir)
+    # Names of completed files are put on the completed_files queue, e.g. for run_pipeline.py to upload them
+    if completed_files is not None: writer.on_file_completed = completed_files.put
+    if incremental:
+        # Each process records its own files, and numbering continues after the files of earlier runs
+        writer.checkpoints = CheckpointStore(checkpoints_db_path)
+        writer.file_num = writer.checkpoints.get_last_file_num(file_prefix)
+    return writer
 
-    from_utc_date = datetime.datetime.strptime(date_range["from"], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
-    from_epoch = int(time.mktime(from_utc_date.timetuple()))
+def close_writer(writer: FileWriter) -> None:
+    writer.close()
+    if writer.checkpoints is not None: writer.checkpoints.close()
 
-    to_utc_date = datetime.datetime.strptime(date_range["to"], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
-    to_epoch = int(time.mktime(to_utc_date.timetuple()))
+def create_file_writer(bulk_import_config: Dict, output_config: Dict, file_prefix: str, stream: bool, output_format: str, data_dir: str = data_dir) -> FileWriter:
+    rows_per_job = bulk_import_config["job"]["rows_per_job"]
+    column_names = bulk_import_config["data"]["column_names"]
+    if stream:
+        upload_config = bulk_import_config["upload"]
+        # Clients are created here so each worker process gets its own
+        return S3StreamWriter(get_client('s3'), bulk_import_config["data"]["bucket"], bulk_import_config["data"]["prefix"], rows_per_job, file_prefix,
+                              column_names=column_names,
+                              part_size=upload_config["part_size_mb"] * 1024 * 1024,
+                              max_queued_parts=upload_config["max_queued_parts"],
+                              concurrency=upload_config["concurrency"])
+    if output_format == 'csv':
+        if not os.path.exists(data_dir): os.makedirs(data_dir)
+        return CsvFileWriter(data_dir, rows_per_job, file_prefix, column_names)
+    # Archive formats are not import-ready, convert_archive_to_csv.py turns them into CSV files under data/
+    if not os.path.exists(archive_dir): os.makedirs(archive_dir)
+    if output_format == 'parquet':
+        return ParquetFileWriter(archive_dir, output_config["rows_per_file"], file_prefix, column_names, output_config["parquet_row_group_rows"])
+    return OUTPUT_WRITERS[output_format](archive_dir, output_config["rows_per_file"], file_prefix, column_names)
 
-    # Use asset id and property id to identify a data point
-    total_row_count = 0
+def get_start_epochs(properties: List[Dict], simulation_configs: Dict[Tuple[str, str], Dict], from_epoch: int,
+                     checkpoints: Optional[CheckpointStore]) -> List[int]:
+    # Resume each property at its first sample after the last one in a completed file
+    start_epochs = []
+    for property in properties:
+        generated_to = checkpoints.get_generated_to(property["asset_id"], property["property_id"]) if checkpoints is not None else None
+        if generated_to is None or generated_to < from_epoch:
+            start_epochs.append(from_epoch)
+            continue
+        interval = get_sampling_interval(simulation_configs[(property["model_name"], property["property_name"])])
+        start_epochs.append(from_epoch + -((from_epoch - generated_to - 1) // interval) * interval)
+    return start_epochs
+
+def split_shards(items: List, shard_count: int, can_split: Optional[Callable] = None) -> List[List]:
+    # Cut items into up to shard_count runs of about equal length, only between items where can_split allows it
+    shards, shard = [], []
+    for pos, item in enumerate(items):
+        if len(shard) > 0 and len(shards) < shard_count - 1 and pos >= (len(shards) + 1) * len(items) // shard_count \
+                and (can_split is None or can_split(items[pos - 1], item)):
+            shards.append(shard)
+            shard = []
+        shard.append(item)
+    if len(shard) > 0: shards.append(shard)
+    return shards
+
+def remove_open_files(checkpoints: CheckpointStore) -> None:
+    # Files an interrupted run did not complete are regenerated from the checkpoints
+    open_files = checkpoints.get_open_files()
+    for file_name in open_files:
+        for directory in [data_dir, archive_dir]:
+            if os.path.exists(f'{directory}/{file_name}'): os.remove(f'{directory}/{file_name}')
+        checkpoints.remove_file(file_name)
+    if len(open_files) > 0: print(f'\tRemoved {len(open_files)} incomplete files of an interrupted run')
+
+def plan_work_units(properties: List[Dict], simulation_configs: Dict[Tuple[str, str], Dict], from_epoch: int, to_epoch: int,
+                    start_epochs: List[int]) -> List[Tuple[int, int, int]]:
+    # A work unit is one block of timestamps for one property: (property index, block number, first timestamp to write)
+    work_units = []
+    for idx, property in enumerate(properties):
+        block_seconds = BLOCK_ROWS * get_sampling_interval(simulation_configs[(property["model_name"], property["property_name"])])
+        block_count = -((from_epoch - to_epoch) // block_seconds)
+        work_units.extend((idx, block_num, start_epochs[idx]) for block_num in range((start_epochs[idx] - from_epoch) // block_seconds, block_count))
+    return work_units
+
+def generate_work_units(writer: FileWriter, properties: List[Dict], simulation_configs: Dict[Tuple[str, str], Dict], work_units: List[Tuple[int, int, int]],
+                        from_epoch: int, to_epoch: int, seed: int) -> None:
+    for work_unit in work_units:
+        idx, block_num, start_epoch = work_unit
+        property = properties[idx]
+        property_simulation_config = simulation_configs[(property["model_name"], property["property_name"])]
+        with stats.timer('generate_block'):
+            block = generate_block(property, property_simulation_config, block_num, from_epoch, to_epoch, seed)
+        # The block a resumed property starts in was partly written before
+        skip = np.searchsorted(block["TIMESTAMP_SECONDS"], start_epoch)
+        if skip > 0: block = slice_block(block, skip, get_block_length(block))
+        with stats.timer('write_block'):
+            writer.write(block)
+        stats.count('rows', get_block_length(block))
+        add_progress(get_work_unit_samples(property_simulation_config, work_unit, from_epoch, to_epoch))
+
+def generate_shard(shard_num: int, properties: List[Dict], work_units: List[Tuple[int, int, int]], from_epoch: int, to_epoch: int, seed: int,
+                   data_simulation_config: Dict, bulk_import_config: Dict, stream: bool = False, output_format: str = 'csv', incremental: bool = False,
+                   data_dir: str = data_dir, completed_files=None) -> int:
+    # Each worker writes its own historical_data_<shard>_<n> files
+    file_prefix = f'historical_data_{shard_num}'
+    writer = create_writer(bulk_import_config, data_simulation_config["output"], file_prefix, stream, output_format, incremental, data_dir, completed_files)
+    first_file_num = writer.file_num
+    generate_work_units(writer, properties, get_simulation_configs(data_simulation_config), work_units, from_epoch, to_epoch, seed)
+    close_writer(writer)
+    return writer.file_num - first_file_num
+
+def plan_partitioned_files(properties: List[Dict], simulation_configs: Dict[Tuple[str, str], Dict], from_epoch: int, to_epoch: int,
+                           start_epochs: List[int], job_config: Dict) -> List[Dict]:
+    series_list = []
     for idx, property in enumerate(properties):
-        property_simulation_config = [x for x in data_simulation_config["properties"] if x["name"] == property["property_name"] and x["model"] == property["model_name"]][0]
-        min = property_simulation_config["min"]
-        max = property_simulation_config["max"]
-        # generate data for at a specific sampling interval
-        sampling_interval_seconds = 60
-        for timestamp_seconds in range(from_epoch,to_epoch+86400,sampling_interval_seconds):
-            value = round(random.uniform(min, max),2)
-            row = [property["asset_id"], property["property_id"], 'DOUBLE', timestamp_seconds, 0, 'GOOD', value]
-            total_row_count += 1
-            # Check if need to open a new file
-            if total_row_count % rows_per_job == 1:
-                file_num = file_num + 1
-                file_name = f'historical_data_{file_num}.csv'
-                f = open(f'{data_dir}/{file_name}', 'w', encoding='UTF8')
-                writer = csv.writer(f)
-            # write a row to the csv file
-            writer.writerow(row)
-            # Check if need to close the current file 
-            # Close file when max rows are met or when the data generation is complete
-            if total_row_count % rows_per_job == 0 or (len(properties) == idx+1 and timestamp_seconds == to_epoch+86400-sampling_interval_seconds):
-                f.close()
-                print(f'\t{file_name} file created')
-
-def simulate_historical_data() -> None:
+        property_simulation_config = simulation_configs[(property["model_name"], property["property_name"])]
+        value_bytes = max(len(f'{property_simulation_config["min"]:.2f}'), len(f'{property_simulation_config["max"]:.2f}'))
+        series_list.append({'property_idx': idx, 'asset_id': property["asset_id"], 'property_id': property["property_id"],
+                            'from': start_epochs[idx], 'to': to_epoch, 'interval': get_sampling_interval(property_simulation_config),
+                            'row_bytes': estimate_row_bytes(property["asset_id"], property["property_id"], value_bytes)})
+    return plan_files(series_list, job_config["rows_per_job"], job_config["target_file_size_mb"] * 1024 * 1024, job_config["time_window_secs"])
+
+def generate_segment(writer: FileWriter, property: Dict, property_simulation_config: Dict, segment: Dict, from_epoch: int, to_epoch: int, seed: int) -> None:
+    # Regenerate the blocks overlapping the segment so values match the unpartitioned output
+    block_seconds = BLOCK_ROWS * get_sampling_interval(property_simulation_config)
+    for block_num in range((segment["from"] - from_epoch) // block_seconds, (segment["to"] - from_epoch) // block_seconds + 1):
+        with stats.timer('generate_block'):
+            block = generate_block(property, property_simulation_config, block_num, from_epoch, to_epoch, seed)
+        start, stop = np.searchsorted(block["TIMESTAMP_SECONDS"], [segment["from"], segment["to"] + 1])
+        with stats.timer('write_block'):
+            writer.write(slice_block(block, start, stop))
+        stats.count('rows', int(stop - start))
+    add_progress(segment["rows"])
+
+def generate_planned_files(files: List[Dict], properties: List[Dict], from_epoch: int, to_epoch: int, seed: int, data_simulation_config: Dict,
+                           bulk_import_config: Dict, stream: bool = False, output_format: str = 'csv', incremental: bool = False,
+                           data_dir: str = data_dir, completed_files=None) -> int:
+    simulation_configs = get_simulation_configs(data_simulation_config)
+    writer = create_writer(bulk_import_config, data_simulation_config["output"], stream=stream, output_format=output_format, incremental=incremental,
+                           data_dir=data_dir, completed_files=completed_files)
+    # Continue the numbering of the plan and let only the plan decide where files end
+    writer.file_num = files[0]["file_num"] - 1
+    writer.rows_per_file = max(file["rows"] for file in files)
+    for file in files:
+        for segment in file["segments"]:
+            property = properties[segment["property_idx"]]
+            property_simulation_config = simulation_configs[(property["model_name"], property["property_name"])]
+            generate_segment(writer, property, property_simulation_config, segment, from_epoch, to_epoch, seed)
+        writer.close_file()
+    close_writer(writer)
+    return len(files)
+
+def generate_partitioned_data(properties: List[Dict], data_simulation_config: Dict, bulk_import_config: Dict, seed: Optional[int] = None, workers: int = 1,
+                              stream: bool = False, output_format: str = 'csv', checkpoints: Optional[CheckpointStore] = None,
+                              data_dir: str = data_dir, completed_files=None) -> None:
+    from_epoch, to_epoch = get_epoch_range(data_simulation_config["date_range"])
+    seed = resolve_seed(seed)
+    simulation_configs, job_config = get_simulation_configs(data_simulation_config), bulk_import_config["job"]
+    files = plan_partitioned_files(properties, simulation_configs, from_epoch, to_epoch, get_start_epochs(properties, simulation_configs, from_epoch, checkpoints),
+                                   job_config)
+    if len(files) == 0:
+        print('\tAll data already generated')
+        return
+    last_file_num = checkpoints.get_last_file_num('historical_data') if checkpoints is not None else 0
+    extension = 'csv' if stream else OUTPUT_WRITERS[output_format].extension
+    for file in files:
+        file["file_num"] += last_file_num
+        file["file_name"] = f'historical_data_{file["file_num"]}.{extension}'
+    write_manifest(files, partition_manifest_path)
+    print(f'\tPlanned {len(files)} files of up to {job_config["rows_per_job"]} rows, see {partition_manifest_path}')
+
+    incremental = checkpoints is not None
+    # Checkpoints only move forward, so a property must not be split across workers that finish out of order
+    can_split = (lambda previous, file: previous["segments"][-1]["property_idx"] != file["segments"][0]["property_idx"]) if incremental else None
+    shards = split_shards(files, max(1, min(workers, len(files))), can_split)
+    total_samples = sum(file["rows"] for file in files)
+    if len(shards) == 1:
+        with progress('Generating', total_samples, 'samples'):
+            generate_planned_files(files, properties, from_epoch, to_epoch, seed, data_simulation_config, bulk_import_config, stream, output_format, incremental,
+                                   data_dir, completed_files)
+        return
+    counter = multiprocessing.Value('q', 0)
+    with progress('Generating', total_samples, 'samples', counter), \
+            ProcessPoolExecutor(max_workers=len(shards), initializer=init_worker, initargs=(counter,)) as executor:
+        futures = [executor.submit(run_with_stats, generate_planned_files, shard, properties, from_epoch, to_epoch, seed, data_simulation_config, bulk_import_config,
+                                   stream, output_format, incremental, data_dir, completed_files)
+                   for shard in shards]
+        results = [future.result() for future in futures]
+    for _, worker_stats in results: stats.merge(worker_stats)
+    print(f'\t{sum(file_count for file_count, _ in results)} files created by {len(shards)} workers')
+
+def generate_historical_data(properties: List[Dict], data_simulation_config: Dict, bulk_import_config: Dict, seed: Optional[int] = None, workers: int = 1,
+                             stream: bool = False, output_format: str = 'csv', checkpoints: Optional[CheckpointStore] = None,
+                             data_dir: str = data_dir, completed_files=None) -> None:
+    # Files are written to data_dir, and their names put on completed_files when given. Workers get both as
+    # arguments rather than through module globals, so a queue shared with them must be picklable, e.g. a Manager queue
+    from_epoch, to_epoch = get_epoch_range(data_simulation_config["date_range"])
+    seed = resolve_seed(seed)
+    simulation_configs = get_simulation_configs(data_simulation_config)
+    work_units = plan_work_units(properties, simulation_configs, from_epoch, to_epoch, get_start_epochs(properties, simulation_configs, from_epoch, checkpoints))
+    if len(work_units) == 0:
+        print('\tAll data already generated')
+        return
+
+    incremental = checkpoints is not None
+    total_samples = count_work_unit_samples(properties, simulation_configs, work_units, from_epoch, to_epoch)
+    if workers <= 1:
+        # Use asset id and property id to identify a data point
+        writer = create_writer(bulk_import_config, data_simulation_config["output"], stream=stream, output_format=output_format, incremental=incremental,
+                               data_dir=data_dir, completed_files=completed_files)
+        with progress('Generating', total_samples, 'samples'):
+            generate_work_units(writer, properties, simulation_configs, work_units, from_epoch, to_epoch, seed)
+            close_writer(writer)
+        return
+
+    # Values only depend on the seed, property and block, so any split of the work units yields the same rows.
+    # Checkpoints only move forward, so a property must not be split across workers that finish out of order
+    can_split = (lambda previous, work_unit: previous[0] != work_unit[0]) if incremental else None
+    shards = split_shards(work_units, min(workers, len(work_units)), can_split)
+    counter = multiprocessing.Value('q', 0)
+    with progress('Generating', total_samples, 'samples', counter), \
+            ProcessPoolExecutor(max_workers=len(shards), initializer=init_worker, initargs=(counter,)) as executor:
+        futures = [executor.submit(run_with_stats, generate_shard, shard_num, properties, shard, from_epoch, to_epoch, seed, data_simulation_config, bulk_import_config,
+                                   stream, output_format, incremental, data_dir, completed_files)
+                   for shard_num, shard in enumerate(shards, start=1)]
+        results = [future.result() for future in futures]
+    for _, worker_stats in results: stats.merge(worker_stats)
+    print(f'\t{sum(file_count for file_count, _ in results)} files created by {len(shards)} workers')
+
+def simulate_historical_data(assets_models_config: Dict, data_simulation_config: Dict, bulk_import_config: Dict, workers: int = 1, stream: bool = False,
+                             output_format: str = 'csv', refresh: bool = False, partition: bool = False, incremental: bool = False) -> None:
+    date_range, data_config = data_simulation_config["date_range"], bulk_import_config["data"]
     print('Retrieving list of configured asset properties..')
-    properties = get_properties_list()
+    properties = get_properties_list(assets_models_config, data_simulation_config, refresh)
     print(f'Retrieved asset properties: {len(properties)}')
     print(f'Generating simulated data between {date_range["from"]} and {date_range["to"]}..')
-    generate_historical_data(properties)
+    if stream: print(f'Streaming simulated data to s3://{data_config["bucket"]}/{data_config["prefix"]}..')
+    checkpoints = None
+    if incremental:
+        checkpoints = CheckpointStore(checkpoints_db_path)
+        remove_open_files(checkpoints)
+    try:
+        if partition:
+            generate_partitioned_data(properties, data_simulation_config, bulk_import_config, data_simulation_config.get("seed"), workers, stream, output_format,
+                                      checkpoints)
+        else:
+            generate_historical_data(properties, data_simulation_config, bulk_import_config, data_simulation_config.get("seed"), workers, stream, output_format,
+                                     checkpoints)
+    finally:
+        if checkpoints is not None: checkpoints.close()
     print(f'Data generation complete!')
 
-def start() -> None:
-    simulate_historical_data()
+def start(workers: int = 1, stream: bool = False, output_format: Optional[str] = None, refresh: bool = False, partition: Optional[bool] = None,
+          incremental: Optional[bool] = None) -> None:
+    data_simulation_config, bulk_import_config = load_config('data_simulation'), load_config('bulk_import')
+    if partition is None: partition = bulk_import_config["job"]["partition_files"]
+    if incremental is None: incremental = data_simulation_config.get("incremental", False)
+    simulate_historical_data(load_config('assets_models'), data_simulation_config, bulk_import_config, workers, stream,
+                             output_format or data_simulation_config["output"]["format"], refresh, partition, incremental)
 
 if __name__ == "__main__":
-    start()
-    print('Script execution successfully completed!!')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Simulate historical data for the configured asset properties')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes used to generate data')
+    parser.add_argument('--stream', action='store_true', help='upload generated data straight to S3 instead of writing it to data/')
+    parser.add_argument('--format', choices=list(OUTPUT_WRITERS), help='output format, csv files are import-ready while csv.gz and parquet files go to archive/')
+    parser.add_argument('--refresh', action='store_true', help='ignore the cached list of asset properties and query SiteWise again')
+    parser.add_argument('--partition', action='store_true', default=None, help='plan files by size and time window, see partition_files in bulk_import.yml')
+    parser.add_argument('--incremental', action='store_true', default=None, help='only generate data after the checkpoints of earlier runs, see incremental in data_simulation.yml')
+    args = parser.parse_args()
+    if args.stream and (args.format or load_config('data_simulation')["output"]["format"]) != 'csv':
+        parser.error('--stream only supports the csv format')
+    start_run('simulate_historical_data', **vars(args))
+    start(args.workers, args.stream, args.format, args.refresh, args.partition, args.incremental)
+    print_metrics()
+    finish_run()
+    print('Script execution successfully completed!!')
@@ -0,0 +1,228 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, Iterator, List, Optional
+
+class StubPaginator:
+    """Follows the nextToken of a stub listing, like a boto3 paginator"""
+
+    def __init__(self, operation: Callable) -> None:
+        self.operation = operation
+
+    def paginate(self, **kwargs) -> Iterator[Dict]:
+        next_token = None
+        while True:
+            page = self.operation(**kwargs, **({'nextToken': next_token} if next_token is not None else {}))
+            yield page
+            next_token = page.get("nextToken")
+            if next_token is None: return
+
+class StubSiteWiseClient:
+    """In-memory stand-in for the SiteWise client calls made by these scripts
+
+    Every call sleeps for latency seconds and is counted, so runs against the stub show how
+    many API calls a code path makes and how its wall time scales with the API latency.
+    Resources are ACTIVE as soon as they are created and bulk import jobs complete job_secs
+    after they are created. At most max_active_jobs jobs can be pending or running at once.
+    """
+
+    def __init__(self, latency: float = 0.0, job_secs: float = 0.0, max_active_jobs: int = 10) -> None:
+        self.latency = latency
+        self.job_secs = job_secs
+        self.max_active_jobs = max_active_jobs
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.models: Dict[str, Dict] = {}
+        self.assets: Dict[str, Dict] = {}
+        self.associations: List[Dict] = []
+        self.jobs: Dict[str, Dict] = {}
+
+    def record(self, operation: str) -> None:
+        with self.lock:
+            self.calls[operation] += 1
+        if self.latency > 0: time.sleep(self.latency)
+
+    def error(self, code: str, operation: str) -> Exception:
+        # Raised like the errors of a real client, botocore is only imported once a call fails
+        from botocore.exceptions import ClientError
+        return ClientError({'Error': {'Code': code, 'Message': f'{operation} failed with {code}'}}, operation)
+
+    def get_paginator(self, operation: str) -> StubPaginator:
+        return StubPaginator(getattr(self, operation))
+
+    def paginate(self, items: List[Dict], result_key: str, maxResults: int = 50, nextToken: Optional[str] = None) -> Dict:
+        offset = int(nextToken or 0)
+        response = {result_key: items[offset:offset + maxResults]}
+        if offset + maxResults < len(items): response["nextToken"] = str(offset + maxResults)
+        return response
+
+    def create_asset_model(self, assetModelName: str, assetModelProperties: List[Dict] = None, **kwargs) -> Dict:
+        self.record('create_asset_model')
+        asset_model_id = str(uuid.uuid4())
+        with self.lock:
+            self.models[asset_model_id] = {'name': assetModelName, 'properties': [
+                dict(property, id=str(uuid.uuid4())) for property in assetModelProperties or []], 'hierarchies': []}
+        return {'assetModelId': asset_model_id, 'assetModelStatus': {'state': 'CREATING'}}
+
+    def update_asset_model(self, assetModelId: str, assetModelName: str, assetModelProperties: List[Dict] = None,
+                           assetModelHierarchies: List[Dict] = None, **kwargs) -> Dict:
+        self.record('update_asset_model')
+        with self.lock:
+            if assetModelId not in self.models: raise self.error('ResourceNotFoundException', 'UpdateAssetModel')
+            self.models[assetModelId]["hierarchies"] = [dict(hierarchy, id=str(uuid.uuid4())) for hierarchy in assetModelHierarchies or []]
+        return {'assetModelStatus': {'state': 'UPDATING'}}
+
+    def describe_asset_model(self, assetModelId: str, excludeProperties: bool = False, **kwargs) -> Dict:
+        self.record('describe_asset_model')
+        model = self.models.get(assetModelId)
+        if model is None: raise self.error('ResourceNotFoundException', 'DescribeAssetModel')
+        response = {'assetModelId': assetModelId, 'assetModelName': model["name"], 'assetModelStatus': {'state': 'ACTIVE'},
+                    'assetModelHierarchies': model["hierarchies"]}
+        if not excludeProperties: response["assetModelProperties"] = model["properties"]
+        return response
+
+    def list_asset_models(self, **kwargs) -> Dict:
+        self.record('list_asset_models')
+        summaries = [{'id': model_id, 'name': model["name"], 'externalId': model.get("externalId"), 'status': {'state': 'ACTIVE'}}
+                     for model_id, model in list(self.models.items())]
+        return self.paginate(summaries, 'assetModelSummaries', **kwargs)
+
+    def list_asset_model_properties(self, assetModelId: str, **kwargs) -> Dict:
+        self.record('list_asset_model_properties')
+        return self.paginate(self.models[assetModelId]["properties"], 'assetModelPropertySummaries', **kwargs)
+
+    def delete_asset_model(self, assetModelId: str, **kwargs) -> Dict:
+        self.record('delete_asset_model')
+        with self.lock:
+            if self.models.pop(assetModelId, None) is None: raise self.error('ResourceNotFoundException', 'DeleteAssetModel')
+        return {'assetModelStatus': {'state': 'DELETING'}}
+
+    def create_asset(self, assetName: str, assetModelId: str, **kwargs) -> Dict:
+        self.record('create_asset')
+        asset_id = str(uuid.uuid4())
+        with self.lock:
+            if assetModelId not in self.models: raise self.error('ResourceNotFoundException', 'CreateAsset')
+            self.assets[asset_id] = {'name': assetName, 'model_id': assetModelId}
+        return {'assetId': asset_id, 'assetStatus': {'state': 'CREATING'}}
+
+    def describe_asset(self, assetId: str, **kwargs) -> Dict:
+        self.record('describe_asset')
+        asset = self.assets.get(assetId)
+        if asset is None: raise self.error('ResourceNotFoundException', 'DescribeAsset')
+        return {'assetId': assetId, 'assetName': asset["name"], 'assetModelId': asset["model_id"], 'assetStatus': {'state': 'ACTIVE'}}
+
+    def list_assets(self, assetModelId: str = None, **kwargs) -> Dict:
+        self.record('list_assets')
+        summaries = [{'id': asset_id, 'name': asset["name"], 'externalId': asset.get("externalId"), 'assetModelId': asset["model_id"], 'status': {'state': 'ACTIVE'}}
+                     for asset_id, asset in list(self.assets.items()) if assetModelId is None or asset["model_id"] == assetModelId]
+        return self.paginate(summaries, 'assetSummaries', **kwargs)
+
+    def delete_asset(self, assetId: str, **kwargs) -> Dict:
+        self.record('delete_asset')
+        with self.lock:
+            if self.assets.pop(assetId, None) is None: raise self.error('ResourceNotFoundException', 'DeleteAsset')
+        return {'assetStatus': {'state': 'DELETING'}}
+
+    def associate_assets(self, assetId: str, hierarchyId: str, childAssetId: str, **kwargs) -> None:
+        self.record('associate_assets')
+        with self.lock:
+            self.associations.append({'assetId': assetId, 'hierarchyId': hierarchyId, 'childAssetId': childAssetId})
+
+    def disassociate_assets(self, assetId: str, hierarchyId: str, childAssetId: str, **kwargs) -> None:
+        self.record('disassociate_assets')
+        association = {'assetId': assetId, 'hierarchyId': hierarchyId, 'childAssetId': childAssetId}
+        with self.lock:
+            if association not in self.associations: raise self.error('InvalidRequestException', 'DisassociateAssets')
+            self.associations.remove(association)
+
+    def list_associated_assets(self, assetId: str, hierarchyId: str, traversalDirection: str = 'CHILD', **kwargs) -> Dict:
+        self.record('list_associated_assets')
+        asset = self.assets.get(assetId)
+        if asset is None: raise self.error('ResourceNotFoundException', 'ListAssociatedAssets')
+        if hierarchyId not in [hierarchy["id"] for hierarchy in self.models[asset["model_id"]]["hierarchies"]]:
+            raise self.error('InvalidRequestException', 'ListAssociatedAssets')
+        summaries = [{'id': association["childAssetId"], 'name': self.assets[association["childAssetId"]]["name"]} for association in list(self.associations)
+                     if association["assetId"] == assetId and association["hierarchyId"] == hierarchyId]
+        return self.paginate(summaries, 'assetSummaries', **kwargs)
+
+    def import_document(self, document: Dict) -> int:
+        # Resources are matched by external id, so importing a document again updates them in place
+        with self.lock:
+            model_ids = {model["externalId"]: model_id for model_id, model in self.models.items() if model.get("externalId") is not None}
+            asset_ids = {asset["externalId"]: asset_id for asset_id, asset in self.assets.items() if asset.get("externalId") is not None}
+            for model in document.get("assetModels", []):
+                model_id = model_ids.setdefault(model["assetModelExternalId"], str(uuid.uuid4()))
+                self.models[model_id] = {'name': model["assetModelName"], 'externalId': model["assetModelExternalId"], 'properties': [
+                    dict(property, id=str(uuid.uuid4())) for property in model.get("assetModelProperties", [])],
+                    'hierarchies': self.models.get(model_id, {}).get("hierarchies", [])}
+            for model in document.get("assetModels", []):
+                hierarchy_ids = {hierarchy["externalId"]: hierarchy["id"] for hierarchy in self.models[model_ids[model["assetModelExternalId"]]]["hierarchies"]}
+                self.models[model_ids[model["assetModelExternalId"]]]["hierarchies"] = [
+                    {'id': hierarchy_ids.get(hierarchy["externalId"], str(uuid.uuid4())), 'externalId': hierarchy["externalId"], 'name': hierarchy["name"],
+                     'childAssetModelId': model_ids[hierarchy["childAssetModelExternalId"]]} for hierarchy in model.get("assetModelHierarchies", [])]
+            for asset in document.get("assets", []):
+                asset_id = asset_ids.setdefault(asset["assetExternalId"], str(uuid.uuid4()))
+                model_id = model_ids[asset["assetModelExternalId"]]
+                self.assets[asset_id] = {'name': asset["assetName"], 'externalId': asset["assetExternalId"], 'model_id': model_id}
+                hierarchy_ids = {hierarchy["externalId"]: hierarchy["id"] for hierarchy in self.models[model_id]["hierarchies"]}
+                for hierarchy in asset.get("assetHierarchies", []):
+                    association = {'assetId': asset_id, 'hierarchyId': hierarchy_ids[hierarchy["externalId"]],
+                                   'childAssetId': asset_ids[hierarchy["childAssetExternalId"]]}
+                    if association not in self.associations: self.associations.append(association)
+        return len(document.get("assetModels", [])) + len(document.get("assets", []))
+
+    def get_job_status(self, job: Dict) -> str:
+        return 'COMPLETED' if time.monotonic() - job["created"] >= self.job_secs else 'RUNNING'
+
+    def create_bulk_import_job(self, jobName: str, **kwargs) -> Dict:
+        self.record('create_bulk_import_job')
+        with self.lock:
+            active_jobs = sum(1 for job in self.jobs.values() if self.get_job_status(job) == 'RUNNING')
+            if active_jobs >= self.max_active_jobs: raise self.error('LimitExceededException', 'CreateBulkImportJob')
+            job_id = str(uuid.uuid4())
+            self.jobs[job_id] = dict(kwargs, name=jobName, created=time.monotonic())
+        return {'jobId': job_id, 'jobName': jobName, 'jobStatus': 'PENDING'}
+
+    def describe_bulk_import_job(self, jobId: str) -> Dict:
+        self.record('describe_bulk_import_job')
+        job = self.jobs[jobId]
+        return {'jobId': jobId, 'jobName': job["name"], 'jobStatus': self.get_job_status(job), 'files': job.get("files", [])}
+
+    def list_bulk_import_jobs(self, **kwargs) -> Dict:
+        self.record('list_bulk_import_jobs')
+        summaries = [{'id': job_id, 'name': job["name"], 'status': self.get_job_status(job)} for job_id, job in list(self.jobs.items())]
+        return self.paginate(summaries, 'jobSummaries', **kwargs)
+
+class StubMetadataTransferClient:
+    """In-memory stand-in for the metadata transfer job calls, importing into a StubSiteWiseClient
+
+    Documents are read from S3 through s3_client, e.g. a moto client, and imported when their job
+    is created. Jobs complete job_secs later. Calls are counted and delayed by the SiteWise stub.
+    """
+
+    def __init__(self, sitewise: StubSiteWiseClient, s3_client, job_secs: float = 0.0) -> None:
+        self.sitewise = sitewise
+        self.s3_client = s3_client
+        self.job_secs = job_secs
+        self.jobs: Dict[str, Dict] = {}
+
+    def create_metadata_transfer_job(self, metadataTransferJobId: str, sources: List[Dict], destination: Dict, **kwargs) -> Dict:
+        self.sitewise.record('create_metadata_transfer_job')
+        # Locations are S3 ARNs: arn:aws:s3:::<bucket>/<key>
+        bucket, key = sources[0]["s3Configuration"]["location"].split(':::', 1)[1].split('/', 1)
+        document = json.loads(self.s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+        self.jobs[metadataTransferJobId] = {'count': self.sitewise.import_document(document), 'created': time.monotonic()}
+        return {'metadataTransferJobId': metadataTransferJobId, 'status': {'state': 'VALIDATING'}}
+
+    def get_metadata_transfer_job(self, metadataTransferJobId: str, **kwargs) -> Dict:
+        self.sitewise.record('get_metadata_transfer_job')
+        job = self.jobs.get(metadataTransferJobId)
+        if job is None: raise self.sitewise.error('ResourceNotFoundException', 'GetMetadataTransferJob')
+        completed = time.monotonic() - job["created"] >= self.job_secs
+        return {'metadataTransferJobId': metadataTransferJobId, 'status': {'state': 'COMPLETED' if completed else 'RUNNING'},
+                'progress': {'totalCount': job["count"], 'succeededCount': job["count"] if completed else 0, 'skippedCount': 0, 'failedCount': 0}}
@@ -1,38 +1,143 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import argparse
 import os
 import glob
-import boto3
-import yaml
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+from aws_clients import get_client, print_metrics
+from checkpoint_store import CheckpointStore
+from configs import load_config
+from instrumentation import add_progress, finish_run, log_event, progress, report, start_run, stats
+import validate_data
 
-PROFILE_NAME = 'default'
-boto3.setup_default_session(profile_name=PROFILE_NAME)
-s3_client = boto3.client('s3')
+if TYPE_CHECKING: from boto3.s3.transfer import TransferConfig
 
 dir = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.abspath(os.path.dirname(dir))
-config_dir = f'{root_dir}/config'
 data_dir = f'{root_dir}/data'
+tmp_dir = f'{root_dir}/tmp'
+manifest_path = f'{tmp_dir}/upload_manifest.json'
+checkpoints_db_path = f'{tmp_dir}/checkpoints.db'
 
-# Load bulk import configuration
-with open(f'{config_dir}/bulk_import.yml', 'r') as file:
-    bulk_import_config = yaml.safe_load(file)
+def get_s3_client(concurrency: int):
+    # A single client is shared by all upload threads, so size its connection pool to match
+    return get_client('s3', max_pool_connections=max(concurrency, 10))
 
-def upload_history_to_s3() -> None:
-    s3_bucket = bulk_import_config["data"]["bucket"]
+def create_transfer_config(part_size_mb: int) -> 'TransferConfig':
+    # boto3 is imported once a transfer is set up, not when the script is imported
+    from boto3.s3.transfer import TransferConfig
+    part_size = part_size_mb * 1024 * 1024
+    # Files are uploaded in parallel rather than the parts of a file
+    return TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size, max_concurrency=1, use_threads=False)
+
+def load_manifest(manifest_path: str = manifest_path) -> Dict[str, Dict]:
+    if not os.path.exists(manifest_path): return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(manifest: Dict[str, Dict], manifest_path: str = manifest_path) -> None:
+    manifest_dir = os.path.dirname(manifest_path)
+    if not os.path.exists(manifest_dir): os.makedirs(manifest_dir)
+    # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+def is_uploaded(uploaded: Optional[Dict], local_file_path: str) -> bool:
+    # Regenerated files keep their name and often their size, so the modification time tells them apart
+    if uploaded is None or "mtime_ns" not in uploaded: return False
+    file_stat = os.stat(local_file_path)
+    return uploaded["size"] == file_stat.st_size and uploaded["mtime_ns"] == file_stat.st_mtime_ns
+
+def upload_file(s3_client, local_file_path: str, s3_bucket: str, s3_key: str, transfer_config: 'TransferConfig',
+                callback: Optional[Callable] = add_progress) -> Dict:
+    # Taken before the upload, so a file rewritten meanwhile does not match the manifest
+    mtime_ns = os.stat(local_file_path).st_mtime_ns
+    with stats.timer('upload_file'):
+        # The callback gets the bytes of each part as it is sent
+        s3_client.upload_file(local_file_path, s3_bucket, s3_key, Config=transfer_config, Callback=callback)
+    response = s3_client.head_object(Bucket=s3_bucket, Key=s3_key)
+    return {'size': response["ContentLength"], 'etag': response["ETag"], 'mtime_ns': mtime_ns}
+
+def upload_history_to_s3(concurrency: int, part_size_mb: int, data_config: Dict, data_dir: str = data_dir, manifest_path: str = manifest_path,
+                         checkpoints_db_path: str = checkpoints_db_path) -> None:
+    s3_bucket, prefix = data_config["bucket"], data_config["prefix"]
     data_files = glob.glob(os.path.join(data_dir, "*"))
+    manifest = load_manifest(manifest_path)
+    # Incremental generation records its progress, files it has not completed yet are left out
+    checkpoints = CheckpointStore(checkpoints_db_path) if os.path.exists(checkpoints_db_path) else None
+    if checkpoints is not None:
+        open_files = set(checkpoints.get_open_files())
+        data_files = [local_file_path for local_file_path in data_files if local_file_path.split('/')[-1] not in open_files]
+
+    # Skip files that a previous run already uploaded
+    pending_files = {}
     for local_file_path in data_files:
         file_name = local_file_path.split('/')[-1]
-        prefix = bulk_import_config["data"]["prefix"]
         s3_key = f'{prefix}{file_name}'
-        s3_client.upload_file(local_file_path, s3_bucket, s3_key)
+        if is_uploaded(manifest.get(f'{s3_bucket}/{s3_key}'), local_file_path): continue
+        pending_files[s3_key] = local_file_path
+    if len(pending_files) < len(data_files):
+        print(f'\tSkipping {len(data_files) - len(pending_files)} files already uploaded')
+
+    s3_client, transfer_config = get_s3_client(concurrency), create_transfer_config(part_size_mb)
+    start_time = time.time()
+    total_bytes = 0
+    uploaded_count = 0
+    failed_keys = []
+    pending_bytes = sum(os.path.getsize(local_file_path) for local_file_path in pending_files.values())
+    with progress('Uploading', pending_bytes, 'bytes'), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(upload_file, s3_client, local_file_path, s3_bucket, s3_key, transfer_config): s3_key for s3_key, local_file_path in pending_files.items()}
+        for future in as_completed(futures):
+            s3_key = futures[future]
+            try:
+                uploaded = future.result()
+            except Exception as e:
+                report(f'\tFailed to upload {s3_key}: {e}', 'upload_failed', key=s3_key, error=str(e))
+                failed_keys.append(s3_key)
+                continue
+            total_bytes += uploaded["size"]
+            uploaded_count += 1
+            # Record every completed file right away so an interrupted run can resume
+            with stats.timer('record_upload'):
+                manifest[f'{s3_bucket}/{s3_key}'] = uploaded
+                save_manifest(manifest, manifest_path)
+                if checkpoints is not None: checkpoints.mark_uploaded(s3_key[len(prefix):])
+            log_event('file_uploaded', key=s3_key, size=uploaded["size"])
+    if checkpoints is not None: checkpoints.close()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    print(f'\tUploaded {uploaded_count} files ({total_bytes / 1024 / 1024:.1f} MB) in {elapsed:.1f} secs: '
+          f'{total_bytes / 1024 / 1024 / elapsed:.1f} MB/s, {uploaded_count / elapsed:.1f} files/s')
+    if len(failed_keys) > 0:
+        raise RuntimeError(f'{len(failed_keys)} files failed to upload, re-run to retry them')
     print(f'Successfully uploaded historical data to S3!')
 
-def start() -> None:
+def start(concurrency: Optional[int] = None, part_size_mb: Optional[int] = None, validate: Optional[bool] = None,
+          bulk_import_config: Optional[Dict] = None) -> None:
+    if bulk_import_config is None: bulk_import_config = load_config('bulk_import')
+    upload_config = bulk_import_config["upload"]
+    if concurrency is None: concurrency = upload_config["concurrency"]
+    if part_size_mb is None: part_size_mb = upload_config["part_size_mb"]
+    if validate is None: validate = upload_config["validate"]
+    if validate:
+        if not validate_data.start(bulk_import_config=bulk_import_config): raise RuntimeError('Data files failed validation, fix them or upload without --validate')
     print('Uploading historical data files into Amazon S3..')
-    upload_history_to_s3()
+    upload_history_to_s3(concurrency, part_size_mb, bulk_import_config["data"])
 
 if __name__ == "__main__":
-    start()
-    print('Script execution successfully completed!!')
\ No newline at end of file
+    upload_config = load_config('bulk_import')["upload"]
+    parser = argparse.ArgumentParser(description='Upload the simulated historical data files into Amazon S3')
+    parser.add_argument('--concurrency', type=int, default=upload_config["concurrency"], help='number of files uploaded in parallel')
+    parser.add_argument('--part-size-mb', type=int, default=upload_config["part_size_mb"], help='multipart upload chunk size in MB')
+    parser.add_argument('--validate', action='store_true', default=upload_config["validate"], help='validate the data files before uploading them')
+    args = parser.parse_args()
+    start_run('upload_to_s3', **vars(args))
+    start(args.concurrency, args.part_size_mb, args.validate)
+    print_metrics()
+    finish_run()
+    print('Script execution successfully completed!!')
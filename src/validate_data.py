@@ -0,0 +1,391 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import argparse
+import glob
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from configs import date_to_epoch, load_config
+from instrumentation import add_progress, finish_run, init_worker, progress, run_with_stats, start_run, stats
+from signals import splitmix64
+
+dir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.abspath(os.path.dirname(dir))
+data_dir = f'{root_dir}/data'
+tmp_dir = f'{root_dir}/tmp'
+properties_cache_path = f'{tmp_dir}/properties_cache.json'
+report_path = f'{tmp_dir}/validation_report.json'
+
+NEWLINE, CARRIAGE_RETURN, COMMA, QUOTE, MINUS = b'\n'[0], b'\r'[0], b','[0], b'"'[0], b'-'[0]
+# Longer fields are rejected by SiteWise, and are only hashed up to this length
+MAX_FIELD_BYTES = 1024
+# Integers of up to 18 digits fit in an int64 while they are parsed
+MAX_DIGITS = 18
+MAX_NANO_OFFSET = 999999999
+INTEGER_RANGE = (-2 ** 31, 2 ** 31 - 1)
+DATA_TYPES = ['DOUBLE', 'INTEGER', 'BOOLEAN', 'STRING']
+QUALITIES = ['GOOD', 'BAD', 'UNCERTAIN']
+BOOLEANS = ['true', 'false', 'TRUE', 'FALSE', 'True', 'False']
+
+HASH_OFFSET = np.uint64(0xcbf29ce484222325)
+HASH_PRIME = np.uint64(0x100000001b3)
+
+# Character classes of double values: 0 not allowed, 1 digit, 2 sign, point or exponent
+DOUBLE_CHARS = np.zeros(256, dtype=np.uint8)
+DOUBLE_CHARS[list(b'0123456789')] = 1
+DOUBLE_CHARS[list(b'+-.eE')] = 2
+
+def split_lines(buffer: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Start and end of each line, without its \r\n or \n terminator
+    ends = np.flatnonzero(buffer == NEWLINE)
+    if len(buffer) > 0 and buffer[-1] != NEWLINE: ends = np.append(ends, len(buffer))
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+    has_carriage_return = (ends > starts) & (buffer[np.maximum(ends - 1, 0)] == CARRIAGE_RETURN)
+    return starts, ends - has_carriage_return
+
+def split_fields(buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray, column_count: int,
+                 separator: int = COMMA) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns which lines have column_count fields, and the start and end of each field of those lines"""
+    commas = np.flatnonzero(buffer == separator)
+    first = np.searchsorted(commas, starts)
+    valid = np.searchsorted(commas, ends) - first == column_count - 1
+    separators = commas[first[valid][:, None] + np.arange(column_count - 1)]
+    field_starts = np.column_stack((starts[valid], separators + 1))
+    field_ends = np.column_stack((separators, ends[valid]))
+    return valid, field_starts, field_ends
+
+def get_words(buffer: np.ndarray) -> np.ndarray:
+    """Returns the 8 bytes starting at each position of the buffer as one little-endian integer
+
+    The words overlap, so the array is a copy of the buffer padded by 8 bytes, viewed with a stride of one byte.
+    """
+    padded = np.zeros(len(buffer) + 8, dtype=np.uint8)
+    padded[:len(buffer)] = buffer
+    return np.ndarray((len(buffer) + 1,), dtype='<u8', buffer=padded, strides=(1,))
+
+def hash_fields(words: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # FNV-1a style hash of each field, over 8 bytes of all fields at a time
+    lengths = np.minimum(ends - starts, MAX_FIELD_BYTES)
+    hashes = HASH_OFFSET ^ lengths.astype(np.uint64)
+    last = len(words) - 1
+    with np.errstate(over='ignore'):
+        for pos in range(0, int(lengths.max(initial=0)), 8):
+            remaining = lengths - pos
+            # Drop the bytes past the end of the field, the low bytes come first
+            shift = ((8 - np.clip(remaining, 1, 8)) * 8).astype(np.uint64)
+            word = (words[np.minimum(starts + pos, last)] << shift) >> shift
+            mixed = (hashes ^ word) * HASH_PRIME
+            hashes = np.where(remaining > 0, mixed ^ (mixed >> np.uint64(32)), hashes)
+    return hashes
+
+def hash_values(values: List[str]) -> np.ndarray:
+    # Hashes strings the same way as fields read from a file
+    buffer = np.frombuffer(''.join(f'{value}\n' for value in values).encode('UTF8'), dtype=np.uint8)
+    starts, ends = split_lines(buffer)
+    return hash_fields(get_words(buffer), starts, ends)
+
+def hash_series(asset_hashes: np.ndarray, property_hashes: np.ndarray) -> np.ndarray:
+    return splitmix64(0, asset_hashes ^ splitmix64(1, property_hashes))
+
+def parse_integers(buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the value of each field and whether it is a valid integer, optionally negative"""
+    negative = (ends > starts) & (buffer[np.minimum(starts, max(len(buffer) - 1, 0))] == MINUS)
+    starts = starts + negative
+    lengths = ends - starts
+    values = np.zeros(len(starts), dtype=np.int64)
+    valid = (lengths > 0) & (lengths <= MAX_DIGITS)
+    last = max(len(buffer) - 1, 0)
+    for pos in range(min(int(lengths.max(initial=0)), MAX_DIGITS)):
+        in_field = pos < lengths
+        digit = buffer[np.minimum(starts + pos, last)].astype(np.int64) - 48
+        valid &= ~in_field | ((digit >= 0) & (digit <= 9))
+        values = np.where(in_field, values * 10 + digit, values)
+    return np.where(negative, -values, values), valid
+
+def check_doubles(buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # Only digits, signs, points and exponents, with at least one digit
+    lengths = ends - starts
+    valid = (lengths > 0) & (lengths <= MAX_FIELD_BYTES)
+    has_digit = np.zeros(len(starts), dtype=bool)
+    last = max(len(buffer) - 1, 0)
+    for pos in range(min(int(lengths.max(initial=0)), MAX_FIELD_BYTES)):
+        in_field = pos < lengths
+        char_class = DOUBLE_CHARS[buffer[np.minimum(starts + pos, last)]]
+        valid &= ~in_field | (char_class > 0)
+        has_digit |= in_field & (char_class == 1)
+    return valid & has_digit
+
+def is_in(hashes: np.ndarray, allowed: np.ndarray) -> np.ndarray:
+    # Few distinct values per chunk, so look up the distinct ones only
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    return np.isin(unique, allowed)[inverse]
+
+class ChunkValidator:
+    """Checks the lines of one chunk of a data file, and collects errors and duplicate keys"""
+
+    def __init__(self, column_names: List[str], series_hashes: Optional[np.ndarray], min_timestamp: int, max_timestamp: int) -> None:
+        self.column_names = column_names
+        self.columns = {name: idx for idx, name in enumerate(column_names)}
+        self.series_hashes = series_hashes
+        self.min_timestamp = min_timestamp
+        self.max_timestamp = max_timestamp
+        self.data_type_hashes = dict(zip(DATA_TYPES, hash_values(DATA_TYPES)))
+        self.quality_hashes = hash_values(QUALITIES)
+        self.boolean_hashes = hash_values(BOOLEANS)
+
+    def validate(self, buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray]:
+        """Returns the lines failing each check, and the key hash and line of each row with a readable key"""
+        words = get_words(buffer)
+        errors = {}
+        lines = np.arange(len(starts))
+        # The fast path does not parse quoted fields, those lines are counted but not checked
+        quoted = np.zeros(len(starts), dtype=bool)
+        if np.any(buffer == QUOTE):
+            quote_lines = np.searchsorted(ends, np.flatnonzero(buffer == QUOTE))
+            quoted[np.unique(quote_lines[quote_lines < len(starts)])] = True
+            errors["quoted_not_checked"] = lines[quoted]
+            starts, ends, lines = starts[~quoted], ends[~quoted], lines[~quoted]
+        valid, field_starts, field_ends = split_fields(buffer, starts, ends, len(self.column_names))
+        errors["column_count"] = lines[~valid]
+        lines = lines[valid]
+        def field(name: str) -> Tuple[np.ndarray, np.ndarray]:
+            return field_starts[:, self.columns[name]], field_ends[:, self.columns[name]]
+        ok = np.ones(len(lines), dtype=bool)
+
+        too_long = ((field_ends - field_starts) > MAX_FIELD_BYTES).any(axis=1)
+        errors["field_length"] = lines[too_long]
+        series = None
+        if 'ASSET_ID' in self.columns and 'PROPERTY_ID' in self.columns:
+            series = hash_series(hash_fields(words, *field('ASSET_ID')), hash_fields(words, *field('PROPERTY_ID')))
+            if self.series_hashes is not None:
+                known = is_in(series, self.series_hashes)
+                errors["unknown_series"] = lines[~known]
+        elif 'ALIAS' in self.columns:
+            series = hash_fields(words, *field('ALIAS'))
+
+        timestamps, nano_offsets = None, np.zeros(len(lines), dtype=np.int64)
+        if 'TIMESTAMP_SECONDS' in self.columns:
+            timestamps, is_integer = parse_integers(buffer, *field('TIMESTAMP_SECONDS'))
+            errors["timestamp"] = lines[~is_integer]
+            in_range = (timestamps >= self.min_timestamp) & (timestamps <= self.max_timestamp)
+            errors["timestamp_range"] = lines[is_integer & ~in_range]
+            ok &= is_integer
+        if 'TIMESTAMP_NANO_OFFSET' in self.columns:
+            nano_offsets, is_integer = parse_integers(buffer, *field('TIMESTAMP_NANO_OFFSET'))
+            is_valid = is_integer & (nano_offsets >= 0) & (nano_offsets <= MAX_NANO_OFFSET)
+            errors["nano_offset"] = lines[~is_valid]
+            ok &= is_valid
+        if 'QUALITY' in self.columns:
+            errors["quality"] = lines[~is_in(hash_fields(words, *field('QUALITY')), self.quality_hashes)]
+        if 'DATA_TYPE' in self.columns:
+            self.check_values(buffer, words, field, lines, errors)
+
+        # Only rows with a readable key take part in the duplicate check
+        keys = np.zeros(0, dtype=np.uint64)
+        if series is not None and timestamps is not None:
+            key_ns = timestamps[ok].astype(np.uint64) * np.uint64(1000000000) + nano_offsets[ok].astype(np.uint64)
+            keys = splitmix64(0, series[ok] ^ splitmix64(2, key_ns))
+        return errors, keys, lines[ok]
+
+    def check_values(self, buffer: np.ndarray, words: np.ndarray, field: Callable, lines: np.ndarray, errors: Dict[str, np.ndarray]) -> None:
+        data_types = hash_fields(words, *field('DATA_TYPE'))
+        errors["data_type"] = lines[~is_in(data_types, np.array(list(self.data_type_hashes.values())))]
+        if 'VALUE' not in self.columns: return
+        starts, ends = field('VALUE')
+        bad_values = []
+        for data_type, data_type_hash in self.data_type_hashes.items():
+            rows = np.flatnonzero(data_types == data_type_hash)
+            if len(rows) == 0: continue
+            if data_type == 'DOUBLE':
+                valid = check_doubles(buffer, starts[rows], ends[rows])
+            elif data_type == 'INTEGER':
+                values, valid = parse_integers(buffer, starts[rows], ends[rows])
+                valid &= (values >= INTEGER_RANGE[0]) & (values <= INTEGER_RANGE[1])
+            elif data_type == 'BOOLEAN':
+                valid = is_in(hash_fields(words, starts[rows], ends[rows]), self.boolean_hashes)
+            else:
+                valid = ends[rows] - starts[rows] <= MAX_FIELD_BYTES
+            bad_values.append(lines[rows[~valid]])
+        errors["value"] = np.concatenate(bad_values) if len(bad_values) > 0 else np.zeros(0, dtype=np.int64)
+
+# Set in each worker process by init_validator
+validator: Optional[ChunkValidator] = None
+
+def init_validator(settings: Dict, counter) -> None:
+    global validator
+    validator = ChunkValidator(**settings)
+    init_worker(counter)
+
+def map_chunk(file_path: str, start: int, end: int):
+    """Maps the lines that start within [start, end) of the file
+
+    Returns the open file, its mapping and the offsets of those lines, so chunks can be
+    read in parallel without splitting a line.
+    """
+    f = open(file_path, 'rb')
+    size = os.fstat(f.fileno()).st_size
+    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    begin = start if start == 0 or mapped[start - 1] == NEWLINE else mapped.find(b'\n', start) + 1
+    if begin == 0 and start > 0: begin = size
+    stop = size if end >= size else (end if mapped[end - 1] == NEWLINE else mapped.find(b'\n', end) + 1)
+    if stop == 0: stop = size
+    return f, mapped, begin, max(begin, stop)
+
+def validate_chunk(file_path: str, start: int, end: int, max_examples: int, duplicates: Optional[np.ndarray] = None) -> Dict:
+    f, mapped, begin, stop = map_chunk(file_path, start, end)
+    buffer = None
+    try:
+        buffer = np.frombuffer(mapped, dtype=np.uint8, count=stop - begin, offset=begin) if stop > begin else np.zeros(0, dtype=np.uint8)
+        with stats.timer('validate_chunk'):
+            starts, ends = split_lines(buffer)
+            errors, keys, key_lines = validator.validate(buffer, starts, ends)
+        result = {'lines': len(starts), 'errors': {}, 'examples': []}
+        if duplicates is not None:
+            # Second pass, find the lines of the keys seen more than once
+            errors = {'duplicate': key_lines[np.isin(keys, duplicates)]}
+        else:
+            result["keys"] = keys
+        for error, error_lines in errors.items():
+            if len(error_lines) == 0: continue
+            result["errors"][error] = len(error_lines)
+            for line in np.sort(error_lines)[:max_examples]:
+                text = bytes(buffer[starts[line]:min(ends[line], starts[line] + 200)]).decode('UTF8', errors='replace')
+                result["examples"].append({'error': error, 'line': int(line), 'text': text})
+        if duplicates is None: add_progress(stop - begin)
+        return result
+    finally:
+        # The mapping can only be closed once no array points into it
+        buffer = None
+        mapped.close()
+        f.close()
+
+def plan_chunks(file_paths: List[str], chunk_bytes: int) -> List[Tuple[str, int, int]]:
+    chunks = []
+    for file_path in file_paths:
+        size = os.path.getsize(file_path)
+        chunks.extend((file_path, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes))
+    return chunks
+
+def find_duplicates(keys: List[np.ndarray]) -> np.ndarray:
+    # The hash index takes 8 bytes per row, sorted once all chunks are read
+    with stats.timer('find_duplicates'):
+        index = np.sort(np.concatenate(keys)) if len(keys) > 0 else np.zeros(0, dtype=np.uint64)
+        return np.unique(index[1:][index[1:] == index[:-1]])
+
+def load_series_hashes() -> Optional[np.ndarray]:
+    # The asset properties cached by simulate_historical_data.py
+    if not os.path.exists(properties_cache_path): return None
+    with open(properties_cache_path, 'r') as f:
+        properties = json.load(f)["properties"]
+    if len(properties) == 0: return np.zeros(0, dtype=np.uint64)
+    return hash_series(hash_values([property["asset_id"] for property in properties]), hash_values([property["property_id"] for property in properties]))
+
+def get_timestamp_range(validation_config: Dict, from_date: Optional[str], to_date: Optional[str]) -> Tuple[int, int]:
+    min_timestamp = validation_config.get("min_timestamp") or 1
+    max_timestamp = validation_config.get("max_timestamp") or int(time.time()) + validation_config["max_future_secs"]
+    # Dates are converted like the date range of the simulator, so the rows it generated are in range
+    if from_date is not None: min_timestamp = date_to_epoch(from_date)
+    # The end date is inclusive
+    if to_date is not None: max_timestamp = date_to_epoch(to_date) + 86399
+    return min_timestamp, max_timestamp
+
+def run_chunks(executor: ProcessPoolExecutor, chunks: List[Tuple[str, int, int]], max_examples: int, duplicates: Optional[np.ndarray] = None) -> List[Dict]:
+    futures = [executor.submit(run_with_stats, validate_chunk, *chunk, max_examples, duplicates) for chunk in chunks]
+    results = []
+    for future in futures:
+        result, worker_stats = future.result()
+        stats.merge(worker_stats)
+        results.append(result)
+    return results
+
+def collect_errors(chunks: List[Tuple[str, int, int]], results: List[Dict], line_offsets: List[int], report: Dict, max_examples: int) -> None:
+    for (file_path, _, _), result, line_offset in zip(chunks, results, line_offsets):
+        report["errors"].update(result["errors"])
+        for example in result["examples"]:
+            if sum(1 for other in report["examples"] if other["error"] == example["error"]) >= max_examples: continue
+            report["examples"].append(dict(example, file=os.path.basename(file_path), line=line_offset + example["line"] + 1))
+
+def validate_files(file_paths: List[str], bulk_import_config: Dict, workers: int, check_ids: bool = True, check_duplicates: bool = True,
+                   from_date: Optional[str] = None, to_date: Optional[str] = None) -> Dict:
+    """Validates the files in parallel chunks and returns the errors found, with examples"""
+    series_hashes = load_series_hashes() if check_ids else None
+    if check_ids and series_hashes is None:
+        print(f'\tNo cached asset properties in {properties_cache_path}, run simulate_historical_data.py first. Skipping the id check')
+    validation_config = bulk_import_config["validation"]
+    min_timestamp, max_timestamp = get_timestamp_range(validation_config, from_date, to_date)
+    settings = {'column_names': bulk_import_config["data"]["column_names"], 'series_hashes': series_hashes,
+                'min_timestamp': min_timestamp, 'max_timestamp': max_timestamp}
+    chunks = plan_chunks(file_paths, validation_config["chunk_mb"] * 1024 * 1024)
+    max_examples = validation_config["max_examples"]
+    counter = multiprocessing.Value('q', 0)
+    with progress('Validating', sum(os.path.getsize(file_path) for file_path in file_paths), 'bytes', counter), \
+            ProcessPoolExecutor(max_workers=max(1, min(workers, len(chunks))), initializer=init_validator, initargs=(settings, counter)) as executor:
+        results = run_chunks(executor, chunks, max_examples)
+        # Lines are numbered per file, from the line counts of its earlier chunks
+        line_offsets, file_lines = [], Counter()
+        for (file_path, _, _), result in zip(chunks, results):
+            line_offsets.append(file_lines[file_path])
+            file_lines[file_path] += result["lines"]
+        report = {'files': len(file_paths), 'lines': sum(file_lines.values()), 'bytes': sum(os.path.getsize(file_path) for file_path in file_paths),
+                  'timestamp_range': [min_timestamp, max_timestamp], 'errors': Counter(), 'examples': []}
+        collect_errors(chunks, results, line_offsets, report, max_examples)
+        duplicates = find_duplicates([result.pop("keys") for result in results]) if check_duplicates else np.zeros(0, dtype=np.uint64)
+        if len(duplicates) > 0:
+            collect_errors(chunks, run_chunks(executor, chunks, max_examples, duplicates), line_offsets, report, max_examples)
+    report["errors"] = dict(report["errors"])
+    return report
+
+def print_report(report: Dict, elapsed: float) -> None:
+    print(f'\tValidated {report["lines"]} lines of {report["files"]} files ({report["bytes"] / 1024 / 1024:.1f} MB) in {elapsed:.1f} secs: '
+          f'{report["bytes"] / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s')
+    for error, count in sorted(report["errors"].items()):
+        print(f'\t{error}: {count} lines')
+        for example in [example for example in report["examples"] if example["error"] == error][:3]:
+            print(f'\t\t{example["file"]}:{example["line"]}: {example["text"]}')
+
+def is_valid(report: Dict) -> bool:
+    # Quoted lines are only reported, SiteWise may still accept them
+    return all(count == 0 for error, count in report["errors"].items() if error != 'quoted_not_checked')
+
+def start(workers: int = os.cpu_count(), check_ids: bool = True, check_duplicates: Optional[bool] = None,
+          from_date: Optional[str] = None, to_date: Optional[str] = None, bulk_import_config: Optional[Dict] = None) -> bool:
+    if bulk_import_config is None: bulk_import_config = load_config('bulk_import')
+    if check_duplicates is None: check_duplicates = bulk_import_config["validation"]["check_duplicates"]
+    file_paths = sorted(file_path for file_path in glob.glob(os.path.join(data_dir, '*')) if os.path.isfile(file_path))
+    if len(file_paths) == 0:
+        print('No data files found!')
+        return True
+    print(f'Validating {len(file_paths)} data files..')
+    start_time = time.perf_counter()
+    report = validate_files(file_paths, bulk_import_config, workers, check_ids, check_duplicates, from_date, to_date)
+    print_report(report, time.perf_counter() - start_time)
+    if not os.path.exists(tmp_dir): os.makedirs(tmp_dir)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    if not is_valid(report):
+        print(f'Data files have errors, see {report_path}')
+        return False
+    print('All data files are valid!')
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the data files for rows bulk import would reject, before uploading them')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes reading the files')
+    parser.add_argument('--skip-ids', action='store_true', help='do not check asset and property ids against the cached asset properties')
+    parser.add_argument('--skip-duplicates', action='store_true', default=None, help='do not check for duplicate asset, property and timestamp keys')
+    parser.add_argument('--from-date', help='first valid date of the timestamps, e.g. 2022-11-01')
+    parser.add_argument('--to-date', help='last valid date of the timestamps, e.g. 2022-11-30')
+    args = parser.parse_args()
+    start_run('validate_data', **vars(args))
+    valid = start(args.workers, not args.skip_ids, None if args.skip_duplicates is None else False, args.from_date, args.to_date)
+    finish_run()
+    if not valid: sys.exit(1)
+    print('Script execution successfully completed!!')
@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np
+import convert_historian_export
+
+COLUMN_NAMES = ['ASSET_ID', 'PROPERTY_ID', 'DATA_TYPE', 'TIMESTAMP_SECONDS', 'TIMESTAMP_NANO_OFFSET', 'QUALITY', 'VALUE']
+TAG_MAPPING = {'Press.Pressure': ('asset-1', 'prop-1', 'DOUBLE'), 'Press.State': ('asset-1', 'prop-2', 'STRING')}
+EXPORT_CONFIG = {
+    'input': {'columns': {'tag': 'TagName', 'timestamp': 'DateTime', 'value': 'Value', 'quality': 'Quality'},
+              'has_header': True, 'separator': ',', 'chunk_mb': 1, 'chunk_rows': 1000, 'utc_offset_minutes': 0},
+    'quality_map': {'192': 'GOOD', 'Good': 'GOOD', 'Bad': 'BAD'},
+    'default_quality': 'UNCERTAIN',
+    'unmapped_tags': 'skip',
+    'file_prefix': 'historian_data',
+}
+BULK_IMPORT_CONFIG = {'job': {'rows_per_job': 100}, 'data': {'column_names': COLUMN_NAMES}}
+
+def convert(tmp_path, monkeypatch, lines):
+    export_path = tmp_path / 'export.csv'
+    export_path.write_text('TagName,DateTime,Value,Quality\n' + ''.join(f'{line}\n' for line in lines))
+    output_dir = tmp_path / 'data'
+    monkeypatch.setattr(convert_historian_export, 'data_dir', str(output_dir))
+    converter = convert_historian_export.convert_exports([str(export_path)], TAG_MAPPING, EXPORT_CONFIG, BULK_IMPORT_CONFIG)
+    with open(output_dir / 'historian_data_1.csv', 'r', newline='') as f:
+        return converter, f.read()
+
+def test_converted_rows_are_written_as_text(tmp_path, monkeypatch):
+    converter, text = convert(tmp_path, monkeypatch, [
+        'Press.Pressure,2022-11-01T12:30:00.125Z,72.5,Good',
+        'Press.State,2022-11-01T12:30:01Z,Running,192',
+        'Press.Pressure,2022-11-01T12:30:02Z,73,Bad',
+    ])
+    assert converter.rows == 3
+    assert text == ('asset-1,prop-1,DOUBLE,1667305800,125000000,GOOD,72.5\r\n'
+                    'asset-1,prop-2,STRING,1667305801,0,GOOD,Running\r\n'
+                    'asset-1,prop-1,DOUBLE,1667305802,0,BAD,73\r\n')
+
+def test_timestamps_with_z_offset_or_no_zone_are_parsed():
+    values = np.array([b'2022-11-01T12:30:00Z', b'2022-11-01T12:30:00.5Z', b'2022-11-01 14:30:00+02:00', b'2022-11-01T07:00:00-0530',
+                       b'2022-11-01T12:30:00.123456789+00:00', b'2022-11-01T12:30:00', b'2022-11-01 13:30:00'])
+    seconds, nanos, valid = convert_historian_export.parse_timestamps(values, 3600)
+    assert valid.tolist() == [True] * 7
+    assert seconds.tolist() == [1667305800, 1667305800, 1667305800, 1667305800, 1667305800, 1667302200, 1667305800]
+    assert nanos.tolist() == [0, 500000000, 0, 0, 123456789, 0, 0]
+
+def test_invalid_timestamps_are_flagged():
+    values = np.array([b'2022-02-30T00:00:00Z', b'2022-11-01T24:00:00Z', b'2022-11-01T12:30:00.1234567890Z', b'2022-11-01T12:30:00+2:00',
+                       b'2022-11-01T12:30', b'not a timestamp', b''])
+    seconds, nanos, valid = convert_historian_export.parse_timestamps(values, 0)
+    assert valid.tolist() == [False] * 7
+    assert seconds.tolist() == [0] * 7 and nanos.tolist() == [0] * 7
+
+def test_numeric_and_text_qualities_are_mapped():
+    converter = convert_historian_export.ExportConverter(TAG_MAPPING, {192: 'GOOD', 'Good': 'GOOD', 'Bad': 'BAD'}, 'UNCERTAIN', 0)
+    qualities = np.array([b'192', b'Good', b'Bad', b'0', b' Bad ', b'good'])
+    assert converter.map_qualities(qualities, 6).tolist() == ['GOOD', 'GOOD', 'BAD', 'UNCERTAIN', 'BAD', 'UNCERTAIN']
+    assert converter.map_qualities(np.array([192, 0]), 2).tolist() == ['GOOD', 'UNCERTAIN']
+    assert converter.map_qualities(None, 2).tolist() == ['GOOD', 'GOOD']
+
+def test_rows_are_mapped_and_invalid_rows_dropped(tmp_path, monkeypatch):
+    converter, text = convert(tmp_path, monkeypatch, [
+        'Press.Pressure,2022-11-01 14:30:00+02:00,72.25,192',
+        'Press.Unknown,2022-11-01T12:30:00Z,1,Good',
+        'Press.Pressure,2022-11-01T12:30:01,71.5,Uncertain',
+        'Press.Pressure,yesterday,70,Good',
+        'Press.State,2022-11-01T12:30:02.000001Z,,Good',
+        'Press.State,2022-11-01T12:30:03Z,Stopped,Bad',
+    ])
+    assert converter.rows == 3
+    assert dict(converter.dropped) == {'column_count': 0, 'unmapped_tag': 1, 'timestamp': 1, 'value': 1}
+    assert dict(converter.unmapped_tags) == {'Press.Unknown': 1}
+    assert text == ('asset-1,prop-1,DOUBLE,1667305800,0,GOOD,72.25\r\n'
+                    'asset-1,prop-1,DOUBLE,1667305801,0,UNCERTAIN,71.5\r\n'
+                    'asset-1,prop-2,STRING,1667305803,0,BAD,Stopped\r\n')
@@ -0,0 +1,75 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from id_registry import IdRegistry
+from metadata_transfer import build_transfer_documents, get_external_id, map_external_ids
+
+PROPERTIES = [{'name': 'pressure', 'dataType': 'DOUBLE', 'unit': 'kPa', 'type': {'measurement': {}}}]
+ASSETS_MODELS_CONFIG = {
+    'asset_models': [{'name': 'Site', 'children': ['Press Line']}, {'name': 'Press Line', 'children': ['Press']}, {'name': 'Press', 'children': None}],
+    'assets': [{'name': 'Site 1', 'model': 'Site', 'associated_assets': ['Line 1', 'Line 2']},
+               {'name': 'Line 1', 'model': 'Press Line', 'associated_assets': ['Press A', 'Press B']},
+               {'name': 'Line 2', 'model': 'Press Line', 'associated_assets': ['Press C']},
+               {'name': 'Press A', 'model': 'Press', 'associated_assets': None},
+               {'name': 'Press B', 'model': 'Press', 'associated_assets': None},
+               {'name': 'Press C', 'model': 'Press', 'associated_assets': None}],
+}
+
+def build_documents(tmp_path, max_assets_per_document: int):
+    with open(tmp_path / 'press_properties.json', 'w') as f:
+        json.dump(PROPERTIES, f)
+    return build_transfer_documents(ASSETS_MODELS_CONFIG, str(tmp_path), max_assets_per_document)
+
+def test_external_ids_are_valid_and_distinct():
+    external_ids = [get_external_id('asset', name) for name in ['Press A', 'Press_A', 'Press/A']]
+    assert len(set(external_ids)) == 3
+    assert all(external_id.startswith('asset.Press_A.') for external_id in external_ids)
+    assert get_external_id('asset', 'Press A') == get_external_id('asset', 'Press A')
+
+def test_documents_hold_models_first_and_children_before_parents(tmp_path):
+    documents = build_documents(tmp_path, 4)
+    assert [len(document["assets"]) for document in documents] == [4, 2]
+    assert 'assetModels' in documents[0] and 'assetModels' not in documents[1]
+
+    models = {model["assetModelName"]: model for model in documents[0]["assetModels"]}
+    assert models["Press"]["assetModelProperties"] == PROPERTIES
+    assert models["Site"]["assetModelProperties"] == []
+    assert models["Site"]["assetModelHierarchies"] == [{'externalId': get_external_id('hierarchy', 'Press Line'), 'name': 'Press Line',
+                                                        'childAssetModelExternalId': get_external_id('model', 'Press Line')}]
+
+    assets = [asset for document in documents for asset in document["assets"]]
+    order = [asset["assetName"] for asset in assets]
+    assert sorted(order) == sorted(asset["name"] for asset in ASSETS_MODELS_CONFIG["assets"])
+    for asset in assets:
+        assert asset["assetExternalId"] == get_external_id('asset', asset["assetName"])
+        for hierarchy in asset["assetHierarchies"]:
+            child_name = next(name for name in order if get_external_id('asset', name) == hierarchy["childAssetExternalId"])
+            assert order.index(child_name) < order.index(asset["assetName"])
+    line_1 = next(asset for asset in assets if asset["assetName"] == 'Line 1')
+    assert line_1["assetModelExternalId"] == get_external_id('model', 'Press Line')
+    assert line_1["assetHierarchies"] == [{'externalId': get_external_id('hierarchy', 'Press'), 'childAssetExternalId': get_external_id('asset', name)}
+                                          for name in ['Press A', 'Press B']]
+
+def test_assigned_ids_are_stored_by_name(tmp_path):
+    documents = build_documents(tmp_path, 10)
+    model_summaries = [{'id': f'model-id-{idx}', 'externalId': get_external_id('model', name)} for idx, name in enumerate(['Site', 'Press Line', 'Press'])]
+    model_hierarchies = {'model-id-0': [{'id': 'hierarchy-id-0', 'childAssetModelId': 'model-id-1'}]}
+    # Press C was not transferred, and an asset without an external id is ignored
+    asset_summaries = [{'id': f'asset-id-{name}', 'externalId': get_external_id('asset', name)} for name in ['Site 1', 'Line 1', 'Line 2', 'Press A', 'Press B']]
+    asset_summaries.append({'id': 'asset-id-other'})
+    id_registry = IdRegistry(str(tmp_path / 'ids.db'))
+    try:
+        missing = map_external_ids(id_registry, documents, model_summaries, model_hierarchies, asset_summaries)
+        assert missing == [get_external_id('asset', 'Press C')]
+        assert id_registry.get_model_id('Press Line') == 'model-id-1'
+        assert id_registry.get_hierarchy_id('Site', 'model-id-1') == 'hierarchy-id-0'
+        assert id_registry.get_asset_id('Press B') == 'asset-id-Press B'
+        assert id_registry.get_asset_id('Press C') is None
+    finally:
+        id_registry.close()
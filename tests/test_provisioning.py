@@ -0,0 +1,67 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import pytest
+from botocore.exceptions import ClientError
+from id_registry import IdRegistry
+from provisioning import TeardownEngine, get_asset_levels
+from sitewise_stub import StubSiteWiseClient
+
+def names(levels):
+    return [[asset["name"] for asset in level] for level in levels]
+
+def test_child_of_two_parents_in_one_level_is_listed_once():
+    assets = [{'name': 'Site', 'associated_assets': ['Line 1', 'Line 2']},
+              {'name': 'Line 1', 'associated_assets': ['Press']},
+              {'name': 'Line 2', 'associated_assets': ['Press']},
+              {'name': 'Press', 'associated_assets': None}]
+    assert names(get_asset_levels(assets)) == [['Site'], ['Line 1', 'Line 2'], ['Press']]
+
+def test_child_reached_at_two_depths_is_listed_at_the_first():
+    assets = [{'name': 'Site', 'associated_assets': ['Line', 'Press']},
+              {'name': 'Line', 'associated_assets': ['Press']},
+              {'name': 'Press', 'associated_assets': []}]
+    assert names(get_asset_levels(assets)) == [['Site'], ['Line', 'Press']]
+
+def test_unreachable_assets_are_rejected():
+    assets = [{'name': 'Site', 'associated_assets': None},
+              {'name': 'Loop 1', 'associated_assets': ['Loop 2']},
+              {'name': 'Loop 2', 'associated_assets': ['Loop 1']}]
+    with pytest.raises(ValueError, match='Loop 1'):
+        get_asset_levels(assets)
+
+def create_hierarchy(tmp_path):
+    client = StubSiteWiseClient()
+    id_registry = IdRegistry(str(tmp_path / 'ids.db'))
+    engine = TeardownEngine(client, id_registry, min_poll_secs=0)
+    parent_model_id = client.create_asset_model('Line')["assetModelId"]
+    child_model_id = client.create_asset_model('Press')["assetModelId"]
+    client.update_asset_model(parent_model_id, 'Line', assetModelHierarchies=[{'name': 'Press', 'childAssetModelId': child_model_id}])
+    hierarchy_id = client.describe_asset_model(parent_model_id)["assetModelHierarchies"][0]["id"]
+    parent_id = client.create_asset('Line 1', parent_model_id)["assetId"]
+    child_id = client.create_asset('Press A', child_model_id)["assetId"]
+    client.associate_assets(parent_id, hierarchy_id, child_id)
+    return client, id_registry, engine, parent_id, hierarchy_id, child_id
+
+def test_disassociating_a_child_twice_is_tolerated(tmp_path):
+    client, id_registry, engine, parent_id, hierarchy_id, child_id = create_hierarchy(tmp_path)
+    try:
+        engine.disassociate_child(parent_id, hierarchy_id, child_id)
+        assert client.associations == []
+        engine.disassociate_child(parent_id, hierarchy_id, child_id)
+    finally:
+        id_registry.close()
+
+def test_disassociating_with_a_wrong_hierarchy_id_fails(tmp_path):
+    client, id_registry, engine, parent_id, hierarchy_id, child_id = create_hierarchy(tmp_path)
+    try:
+        with pytest.raises(ClientError):
+            engine.disassociate_child(parent_id, 'wrong-hierarchy-id', child_id)
+        assert len(client.associations) == 1
+    finally:
+        id_registry.close()
@@ -0,0 +1,54 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import validate_data
+
+COLUMN_NAMES = ['ASSET_ID', 'PROPERTY_ID', 'DATA_TYPE', 'TIMESTAMP_SECONDS', 'TIMESTAMP_NANO_OFFSET', 'QUALITY', 'VALUE']
+
+def write_lines(file_path: str, line_count: int) -> int:
+    # Fixed width lines, so chunks of a multiple of the line length end right after a newline
+    lines = [f'asset-{idx % 7:05d},property-{idx:08d},DOUBLE,{1667260800 + idx},0,GOOD,{idx % 100:06.2f}\n' for idx in range(line_count)]
+    assert len({len(line) for line in lines}) == 1
+    with open(file_path, 'w') as f:
+        f.writelines(lines)
+    return len(lines[0])
+
+def validate_in_chunks(file_path: str, chunk_bytes: int):
+    validate_data.validator = validate_data.ChunkValidator(COLUMN_NAMES, None, 1, 2 ** 40)
+    chunks = validate_data.plan_chunks([file_path], chunk_bytes)
+    results = [validate_data.validate_chunk(*chunk, 5) for chunk in chunks]
+    duplicates = validate_data.find_duplicates([result["keys"] for result in results])
+    return chunks, results, duplicates
+
+def test_newline_aligned_chunks_are_read_once(tmp_path):
+    file_path = str(tmp_path / 'historical_data_1.csv')
+    line_bytes = write_lines(file_path, 3000)
+    chunks, results, duplicates = validate_in_chunks(file_path, line_bytes * 1000)
+    assert len(chunks) == 3
+    assert sum(result["lines"] for result in results) == 3000
+    assert len(duplicates) == 0
+    assert all(len(result["errors"]) == 0 for result in results)
+
+def test_chunks_split_inside_lines_are_read_once(tmp_path):
+    file_path = str(tmp_path / 'historical_data_1.csv')
+    line_bytes = write_lines(file_path, 3000)
+    chunks, results, duplicates = validate_in_chunks(file_path, line_bytes * 1000 + line_bytes // 2)
+    assert sum(result["lines"] for result in results) == 3000
+    assert len(duplicates) == 0
+
+def test_date_range_matches_the_simulator_in_any_time_zone(monkeypatch):
+    import simulate_historical_data
+    for time_zone in ['UTC', 'America/New_York', 'Asia/Kolkata']:
+        monkeypatch.setenv('TZ', time_zone)
+        time.tzset()
+        from_epoch, to_epoch = simulate_historical_data.get_epoch_range({'from': '2022-11-01', 'to': '2022-11-07'})
+        validation_config = {'min_timestamp': None, 'max_timestamp': None, 'max_future_secs': 600}
+        assert validate_data.get_timestamp_range(validation_config, '2022-11-01', '2022-11-07') == (from_epoch, to_epoch - 1)
+    monkeypatch.undo()
+    time.tzset()